@@ -11,6 +11,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from ivg.lifespan import LifespanMiddleware
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'invoice_generator.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Releases the PDF render pool when the server shuts the worker down
+application = LifespanMiddleware(django_application)
@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from datetime import timedelta
+import importlib.util
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -107,7 +109,7 @@ WSGI_APPLICATION = 'invoice_generator.wsgi.application'
 REST_USE_JWT = True
 
 REST_FRAMEWORK = {
-    "DEFAULT_AUTHENTICATION_CLASSES": ('rest_framework_simplejwt.authentication.JWTAuthentication',),
+    "DEFAULT_AUTHENTICATION_CLASSES": ('ivg.authentication.CachedJWTAuthentication',),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
@@ -134,8 +136,59 @@ else:
             "USER": os.getenv("POSTGRES_USER", ""),
             "PORT": os.getenv("DATABASE_PORT", "5432"),
             "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            # Persistent connections belong to a thread, and under ASGI each request
+            # runs on a fresh one, so CONN_MAX_AGE only pays off under WSGI
+            "CONN_MAX_AGE": int(os.getenv("DATABASE_CONN_MAX_AGE", 0)),
+            "CONN_HEALTH_CHECKS": True,
         }
     }
+    # psycopg 3 connection pool shared by all threads of a worker (see ivg/db_pool.py),
+    # on unless DATABASE_POOL=0. Left unset, an environment without psycopg[pool] falls
+    # back to a connection per request; DATABASE_POOL=1 requires the pool.
+    pool_installed = importlib.util.find_spec("psycopg_pool") is not None
+    if os.getenv("DATABASE_POOL") == "1" and not pool_installed:
+        raise ImproperlyConfigured("DATABASE_POOL=1 needs psycopg[pool], install the project dependencies")
+    DATABASE_POOL = os.getenv("DATABASE_POOL", "1") != "0" and pool_installed
+    if DATABASE_POOL:
+        from psycopg_pool import ConnectionPool
+
+        DATABASES["default"]["CONN_MAX_AGE"] = 0  # Django refuses persistent connections with a pool
+        DATABASES["default"]["OPTIONS"] = {
+            "pool": {
+                "min_size": int(os.getenv("DATABASE_POOL_MIN_SIZE", 2)),
+                "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", 10)),
+                # Seconds a request waits for a free connection before failing
+                "timeout": float(os.getenv("DATABASE_POOL_TIMEOUT", 10)),
+                "max_lifetime": float(os.getenv("DATABASE_POOL_MAX_LIFETIME", 1800)),
+                "max_idle": float(os.getenv("DATABASE_POOL_MAX_IDLE", 300)),
+                # Ping on checkout, connections the server dropped are replaced
+                "check": ConnectionPool.check_connection,
+            }
+        }
+
+    # Optional read replica for the heavy read paths (see ivg/db_routers.py)
+    if os.getenv("DATABASE_REPLICA_HOST"):
+        REPLICA_CONNECT_TIMEOUT = int(os.getenv("DATABASE_REPLICA_CONNECT_TIMEOUT", 2))
+        replica_options = {**DATABASES["default"].get("OPTIONS", {}), "connect_timeout": REPLICA_CONNECT_TIMEOUT}
+        if "pool" in replica_options:
+            replica_options["pool"] = {**replica_options["pool"], "timeout": REPLICA_CONNECT_TIMEOUT}
+        DATABASES["replica"] = {
+            **DATABASES["default"],
+            "HOST": os.getenv("DATABASE_REPLICA_HOST"),
+            "PORT": os.getenv("DATABASE_REPLICA_PORT", DATABASES["default"]["PORT"]),
+            "USER": os.getenv("DATABASE_REPLICA_USER", DATABASES["default"]["USER"]),
+            "PASSWORD": os.getenv("DATABASE_REPLICA_PASSWORD", DATABASES["default"]["PASSWORD"]),
+            # A replica that doesn't answer quickly fails its health check, reads go to the primary
+            "OPTIONS": replica_options,
+            "TEST": {"MIRROR": "default"},
+        }
+        DATABASE_ROUTERS = ["ivg.db_routers.ReplicaRouter"]
+        MIDDLEWARE.append("ivg.db_routers.ReplicaRoutingMiddleware")
+
+# Seconds a user's reads stay on the primary after they wrote
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+# Seconds between replica health checks, per worker
+REPLICA_HEALTH_CHECK_INTERVAL = int(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", 10))
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Invoice API',
@@ -151,6 +204,79 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME', 'us-east-1')
 AWS_S3_CUSTOM_DOMAIN = os.getenv('AWS_S3_CUSTOM_DOMAIN')
+AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL')
+AWS_S3_SIGNATURE_VERSION = os.getenv('AWS_S3_SIGNATURE_VERSION', 's3v4')
+AWS_S3_ADDRESSING_STYLE = os.getenv('AWS_S3_ADDRESSING_STYLE', 'auto')
+
+# Shared S3 client (see ivg/storage.py). "local" keeps objects in memory for tests
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3')
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_S3_MAX_POOL_CONNECTIONS', 20))
+AWS_S3_CONNECT_TIMEOUT = float(os.getenv('AWS_S3_CONNECT_TIMEOUT', 5))
+AWS_S3_READ_TIMEOUT = float(os.getenv('AWS_S3_READ_TIMEOUT', 30))
+AWS_S3_MAX_ATTEMPTS = int(os.getenv('AWS_S3_MAX_ATTEMPTS', 3))
+AWS_S3_RETRY_MODE = os.getenv('AWS_S3_RETRY_MODE', 'standard')
+
+# Presigned GET URLs are reused until less than MIN_REMAINING of their lifetime is left
+PRESIGNED_URL_CACHE_MAX_ENTRIES = int(os.getenv('PRESIGNED_URL_CACHE_MAX_ENTRIES', 10000))
+PRESIGNED_URL_CACHE_MIN_REMAINING = float(os.getenv('PRESIGNED_URL_CACHE_MIN_REMAINING', 0.5))
+
+# Multipart uploads for large attachments
+MULTIPART_PART_SIZE = int(os.getenv('MULTIPART_PART_SIZE', 8 * 1024 * 1024))
+MULTIPART_MAX_CONCURRENCY = int(os.getenv('MULTIPART_MAX_CONCURRENCY', 4))
+MULTIPART_PRESIGN_BATCH_SIZE = int(os.getenv('MULTIPART_PRESIGN_BATCH_SIZE', 100))
+MULTIPART_PART_URL_EXPIRES = int(os.getenv('MULTIPART_PART_URL_EXPIRES', 3600))
+
+# Max invoices per invoice/view-files/ request
+INVOICE_VIEW_URL_BATCH_SIZE = int(os.getenv('INVOICE_VIEW_URL_BATCH_SIZE', 100))
+
+# invoice/bulk/: max rows per request and rows per INSERT transaction
+INVOICE_BULK_MAX_ROWS = int(os.getenv('INVOICE_BULK_MAX_ROWS', 500))
+INVOICE_BULK_BATCH_SIZE = int(os.getenv('INVOICE_BULK_BATCH_SIZE', 100))
+
+# CSV/XLSX imports (see ivg/imports.py): rows per committed batch, row errors kept on the job
+INVOICE_IMPORT_BATCH_SIZE = int(os.getenv('INVOICE_IMPORT_BATCH_SIZE', 1000))
+INVOICE_IMPORT_MAX_ERRORS = int(os.getenv('INVOICE_IMPORT_MAX_ERRORS', 100))
+
+# Rows fetched per server side cursor round trip by invoice/export/
+INVOICE_EXPORT_CHUNK_SIZE = int(os.getenv('INVOICE_EXPORT_CHUNK_SIZE', 2000))
+
+# Invoice PDF rendering (see ivg/pdf.py). One worker process per core you want to give it
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', os.cpu_count() or 1))
+PDF_RENDER_QUEUE_PER_WORKER = int(os.getenv('PDF_RENDER_QUEUE_PER_WORKER', 4))
+PDF_RENDER_MAX_TASKS_PER_CHILD = int(os.getenv('PDF_RENDER_MAX_TASKS_PER_CHILD', 1000))
+PDF_RENDER_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', 60))
+
+# Background jobs (see ivg/jobs.py) and the bulk PDF export
+BACKGROUND_JOB_WORKERS = int(os.getenv('BACKGROUND_JOB_WORKERS', 2))
+PDF_EXPORT_CONCURRENCY = int(os.getenv('PDF_EXPORT_CONCURRENCY', 8))
+PDF_EXPORT_URL_EXPIRES = int(os.getenv('PDF_EXPORT_URL_EXPIRES', 3600))
+
+# Per process memory cache by default. With several workers set REDIS_URL (needs the
+# redis package) so a write in one worker invalidates what the others have cached
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ivg',
+        }
+    }
+
+# Seconds the UltraAdmin dashboard stats are cached (see ivg/dashboard.py)
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 60))
+
+# Users resolved by CachedJWTAuthentication, per worker (see ivg/authentication.py)
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_USER_CACHE_MAX_ENTRIES', 10000))
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 300))
+
+# Seconds a worker serves branches and vendors from memory before checking their version again (see ivg/refdata.py)
+REFDATA_VERSION_CHECK_INTERVAL = int(os.getenv('REFDATA_VERSION_CHECK_INTERVAL', 1))
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import Branches, InvoiceUser , InvoiceData
+from .models import Branches, InvoiceUser , InvoiceData, InvoiceFile, BackgroundJob, InvoiceDailyRollup, DataVersion
 # Register your models here.
 admin.site.register(InvoiceUser)
 admin.site.register(InvoiceData)
-admin.site.register(Branches)
\ No newline at end of file
+admin.site.register(Branches)
+admin.site.register(InvoiceFile)
+admin.site.register(BackgroundJob)
+admin.site.register(InvoiceDailyRollup)
+admin.site.register(DataVersion)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class IvgConfig(AppConfig):
     name = 'ivg'
+
+    def ready(self):
+        # Registers the background job handlers and model signal receivers
+        from ivg import exports, imports, signals  # noqa: F401
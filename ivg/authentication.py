@@ -0,0 +1,170 @@
+"""
+JWT authentication with a per-process cache of the resolved users.
+
+simplejwt's JWTAuthentication loads the user on every request, and the views
+then load `request.user.branch` lazily. CachedJWTAuthentication loads both in
+one select_related query and keeps the result in a bounded LRU, so repeat
+requests of the same user make no queries to authenticate.
+
+Entries are validated on every request against DataVersion counters (see
+ivg/versions.py): one per user and the one shared by all branches, read in
+one small indexed query. Saving or deleting a user or branch bumps its
+counter in the same transaction (see ivg/signals.py), so every worker sees a
+deactivation, password change or branch move on its next request, through
+the database they already share. AUTH_USER_CACHE_TTL only bounds memory
+churn, not staleness.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from ivg.versions import BRANCHES_SCOPE, user_scope, version_tokens
+
+
+class AuthenticatedUserCache:
+    """
+    LRU of user id -> (versions, loaded_at, user)
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, versions):
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                cached_versions, loaded_at, user = entry
+                if cached_versions == versions and now - loaded_at < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def set(self, user_id, versions, user):
+        with self._lock:
+            self._entries[user_id] = (versions, self.clock(), user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AuthenticatedUserCache(
+                    max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES,
+                    ttl=settings.AUTH_USER_CACHE_TTL,
+                )
+    return _cache
+
+
+def reset_user_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting.startswith('AUTH_USER_CACHE_'):
+        reset_user_cache()
+
+
+setting_changed.connect(_reset_on_setting_change)
+
+
+def current_versions(user_id):
+    """
+    (user version, branches version). Read before the user is loaded: a write
+    committing in between makes the entry miss next time instead of hiding it.
+    """
+    return version_tokens([user_scope(user_id), BRANCHES_SCOPE])
+
+
+def invalidate_cached_user(user_id):
+    """
+    Drop the user from this worker's cache. Other workers see the version
+    bump that comes with the save.
+    """
+    get_user_cache().invalidate(str(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication whose users come with their branch and are cached per process
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user_cache = get_user_cache()
+        user_id = str(user_id)
+        versions = current_versions(user_id)
+        user = user_cache.get(user_id, versions)
+        if user is None:
+            try:
+                user = self.user_model.objects.select_related('branch').get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            user_cache.set(user_id, versions, user)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # Requests share the cached instance, each gets a copy it can mutate
+        return copy.copy(user)
@@ -22,3 +22,21 @@ class PayMentStatus(Enum) :
     def choices(cls):
         return [(key.value, key.name.replace("_", " ").title()) for key in cls]
 
+
+
+class JobKind(Enum) :
+    PDF_EXPORT = "pdf export"
+    INVOICE_IMPORT = "invoice import"
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name.replace("_", " ").title()) for key in cls]
+
+
+class JobStatus(Enum) :
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name.replace("_", " ").title()) for key in cls]
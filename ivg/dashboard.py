@@ -0,0 +1,101 @@
+"""
+UltraAdmin dashboard numbers.
+
+Three GROUP BY queries cover everything: the branch list, users per branch
+with a conditional count per role, and invoice totals per branch with a
+conditional sum per trip. Invoice totals come from InvoiceDailyRollup, so
+they cost one row per branch, day and trip rather than one per invoice.
+Global totals are summed from the per branch rows in Python. The finished payload is cached for
+DASHBOARD_CACHE_TTL seconds and dropped whenever a branch, user or invoice
+changes (see ivg/signals.py).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from ivg.constant import TripStatusType
+from ivg.models import Branches, InvoiceDailyRollup, InvoiceUser
+
+DASHBOARD_CACHE_KEY = 'ivg:dashboard:ultraadmin'
+
+# Same precedence as InvoiceUser.user_type, so each user lands in exactly one role
+ROLE_FILTERS = {
+    'superadmin': Q(is_superadmin=True),
+    'coofficer': Q(is_superadmin=False, is_coofficer=True),
+    'adminuser': Q(is_superadmin=False, is_coofficer=False, is_admin=True),
+    'user': Q(is_superadmin=False, is_coofficer=False, is_admin=False),
+}
+TRIPS = [trip.value for trip in TripStatusType]
+
+
+def _empty_branch_stats():
+    return {
+        'users': 0,
+        'users_by_role': dict.fromkeys(ROLE_FILTERS, 0),
+        'invoices': 0,
+        'total_cft': 0.0,
+        'trips': dict.fromkeys(TRIPS, 0),
+    }
+
+
+def compute_dashboard_stats():
+    branches = {
+        row['id']: {**row, **_empty_branch_stats()}
+        for row in Branches.objects.order_by('name').values('id', 'name', 'slug', 'is_active')
+    }
+    unassigned = _empty_branch_stats()
+
+    user_rows = (
+        InvoiceUser.objects.filter(is_ultraadmin=False)
+        .values('branch')
+        .annotate(users=Count('id'), **{role: Count('id', filter=q) for role, q in ROLE_FILTERS.items()})
+        .order_by()
+    )
+    for row in user_rows:
+        stats = branches.get(row['branch'], unassigned)
+        stats['users'] = row['users']
+        stats['users_by_role'] = {role: row[role] for role in ROLE_FILTERS}
+
+    trip_counts = {f'trip_{i}': Sum('invoices', filter=Q(trip=trip)) for i, trip in enumerate(TRIPS)}
+    invoice_rows = (
+        InvoiceDailyRollup.objects.values('branch')
+        .annotate(invoice_count=Sum('invoices'), cft=Sum('total_cft'), **trip_counts)
+        .order_by()
+    )
+    for row in invoice_rows:
+        stats = branches.get(row['branch'], unassigned)
+        stats['invoices'] = row['invoice_count']
+        stats['total_cft'] = row['cft'] or 0.0
+        stats['trips'] = {trip: row[f'trip_{i}'] or 0 for i, trip in enumerate(TRIPS)}
+
+    every = [*branches.values(), unassigned]
+    return {
+        'total_branches': len(branches),
+        'active_branches': sum(1 for branch in branches.values() if branch['is_active']),
+        'total_users': sum(stats['users'] for stats in every),
+        'users_by_role': {role: sum(stats['users_by_role'][role] for stats in every) for role in ROLE_FILTERS},
+        'total_invoices': sum(stats['invoices'] for stats in every),
+        'total_cft': sum(stats['total_cft'] for stats in every),
+        'trips': {trip: sum(stats['trips'][trip] for stats in every) for trip in TRIPS},
+        'branches': list(branches.values()),
+        'unassigned': unassigned,
+        'generated_at': timezone.now(),
+    }
+
+
+def get_dashboard_stats():
+    stats = cache.get(DASHBOARD_CACHE_KEY)
+    if stats is None:
+        stats = compute_dashboard_stats()
+        cache.set(DASHBOARD_CACHE_KEY, stats, settings.DASHBOARD_CACHE_TTL)
+    return stats
+
+
+def invalidate_dashboard_stats():
+    """
+    Drop the cached payload once the current transaction commits, so a
+    reader can't cache numbers from before the write
+    """
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
@@ -0,0 +1,41 @@
+"""
+Database connection reuse, see DATABASES in settings.
+
+On PostgreSQL every worker keeps a psycopg ConnectionPool per alias (Django's OPTIONS["pool"]): a request borrows a
+connection, Django hands it back when the request finishes, and the pool
+pings it on checkout and retires it after max_lifetime / max_idle. With
+DATABASE_POOL=0, connections are closed after each request unless CONN_MAX_AGE is
+set, with CONN_HEALTH_CHECKS guarding reused ones.
+
+`manage.py bench_db_connections` compares the two under concurrent load.
+"""
+from django.db import connections
+
+
+def pool_stats():
+    """
+    Per alias: how connections are reused, and the pool counters when pooled
+    """
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        settings_dict = connection.settings_dict
+        pool = getattr(connection, 'pool', None)
+        entry = {
+            'vendor': connection.vendor,
+            'pooled': pool is not None,
+            'conn_max_age': settings_dict['CONN_MAX_AGE'],
+            'health_checks': settings_dict['CONN_HEALTH_CHECKS'],
+        }
+        if pool is not None:
+            # get_stats() without resetting the counters, the next call still sees them
+            entry['pool'] = {
+                'min_size': pool.min_size,
+                'max_size': pool.max_size,
+                'timeout': pool.timeout,
+                'max_lifetime': pool.max_lifetime,
+                'max_idle': pool.max_idle,
+                **pool.get_stats(),
+            }
+        stats[alias] = entry
+    return stats
@@ -0,0 +1,190 @@
+"""
+Read replica routing.
+
+With DATABASE_REPLICA_HOST set, settings add a `replica` alias. Views that
+opt in with ReplicaReadMixin (the invoice list and export, the file listing,
+the dashboards) run their reads there. Everything else, and every write,
+uses `default`. Reads stay on the primary when:
+
+- the user wrote within the last REPLICA_STICKY_SECONDS (read your writes):
+  after any request that wrote, ReplicaRoutingMiddleware bumps the user's
+  primary pin, a DataVersion row (see ivg/versions.py) every worker reads
+  from the primary;
+- the request itself has written, or is inside a transaction;
+- the replica failed its last health check, repeated at most every
+  REPLICA_HEALTH_CHECK_INTERVAL seconds per worker.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+from ivg.versions import bump_data_versions, primary_pin_scope, version_tokens
+
+REPLICA_ALIAS = 'replica'
+
+
+class RoutingState:
+    """
+    What the router knows about the current request
+    """
+    __slots__ = ('replica_reads', 'wrote')
+
+    def __init__(self):
+        self.replica_reads = False
+        self.wrote = False
+
+
+_routing_state = ContextVar('ivg_db_routing_state', default=None)
+
+
+class ReplicaHealth:
+    """
+    Last health check result of this worker's replica connection
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.healthy = True
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def is_healthy(self):
+        now = self.clock()
+        if self.checked_at is not None and now - self.checked_at < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+            return self.healthy
+        # One thread checks, the others go on with the previous result
+        if not self._lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            self.healthy = self.check()
+            self.checked_at = self.clock()
+        finally:
+            self._lock.release()
+        return self.healthy
+
+    def check(self):
+        connection = connections[REPLICA_ALIAS]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except DatabaseError:
+            # Drop the broken connection, the next check opens a new one
+            connection.close()
+            return False
+        return True
+
+
+replica_health = ReplicaHealth()
+
+
+def pin_to_primary(user_id):
+    bump_data_versions(primary_pin_scope(user_id))
+
+
+def pinned_to_primary(user_id):
+    """
+    Whether the user wrote within REPLICA_STICKY_SECONDS, from any worker
+    """
+    token = version_tokens([primary_pin_scope(user_id)])[0]
+    if token is None:
+        return False
+    return timezone.now() - token[1] < timedelta(seconds=settings.REPLICA_STICKY_SECONDS)
+
+
+class ReplicaRouter:
+    """
+    Reads of opted in requests go to the replica, all writes to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or not state.replica_reads or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Part of a transaction on the primary, has to see its writes
+            return DEFAULT_DB_ALIAS
+        if not replica_health.is_healthy():
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        # Explicitly, or an instance read from the replica would be saved back there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica follows the primary's schema
+        return db != REPLICA_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Fresh routing state per request. After a request that wrote, the user's
+    reads stay on the primary for REPLICA_STICKY_SECONDS.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Not reset afterwards: streamed responses keep reading after the view returns
+        state = RoutingState()
+        _routing_state.set(state)
+        response = self.get_response(request)
+        user_id = self.written_by(request, state)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        _routing_state.set(state)
+        response = await self.get_response(request)
+        user_id = self.written_by(request, state)
+        if user_id is not None:
+            await sync_to_async(pin_to_primary)(user_id)
+        return response
+
+    @staticmethod
+    def written_by(request, state):
+        if not state.wrote:
+            return None
+        # DRF sets the token's user on the Django request as well
+        user = getattr(request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+
+class ReplicaReadMixin:
+    """
+    Views whose `replica_methods` requests may read from the replica.
+    Checked after authentication, a user who just wrote stays on the primary.
+    """
+    replica_methods = SAFE_METHODS
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        state = _routing_state.get()
+        if state is None or request.method not in self.replica_methods:
+            # No replica configured, the middleware isn't installed
+            return
+        state.replica_reads = not pinned_to_primary(request.user.pk)
@@ -0,0 +1,223 @@
+"""
+Exports of a branch's invoices: streamed CSV and month end PDF bundles.
+
+For PDF bundles invoices are walked with a server side iterator. Each one's
+PDF is fetched from S3 when a PDF was uploaded for it, otherwise rendered in
+the PDF pool, with at most PDF_EXPORT_CONCURRENCY of them in flight. Results
+are written in order into a ZIP that streams straight into a multipart
+upload, so memory stays at one upload part plus the PDFs in flight however
+big the export is.
+
+Bundles are ZIPs only, there is no single merged PDF. WeasyPrint lays a
+document out whole, and joining separately rendered PDFs page by page needs a
+PDF library this project doesn't depend on. A merged PDF would give up the
+bounded memory and the progress reports. Jobs queued with format=pdf before
+it was dropped fail with an error asking for a ZIP.
+"""
+import csv
+import io
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.text import slugify
+
+from ivg.constant import JobKind
+from ivg.filters import local_day_range
+from ivg.jobs import job_handler
+from ivg.models import InvoiceData, InvoiceFile
+from ivg.pdf import PDF_CONTENT_TYPE, invoice_context, submit_render
+from ivg.storage import MultipartWriter, ObjectNotFound, get_storage
+
+EXPORT_CONTENT_TYPES = {
+    'zip': 'application/zip',
+}
+PROGRESS_EVERY = 25
+
+
+# (CSV header, values_list path). Headers match what ivg/imports.py reads back
+INVOICE_CSV_COLUMNS = (
+    ('invoice_id', 'id'),
+    ('created_at', 'created_at'),
+    ('trip', 'trip'),
+    ('police_station', 'police_station'),
+    ('car_number', 'car_number'),
+    ('phone_number', 'phone_number'),
+    ('name', 'name'),
+    ('location', 'location'),
+    ('wheels', 'wheels'),
+    ('cft', 'cft'),
+    ('remarks', 'remarks'),
+    ('created_by', 'created_by__username'),
+    ('object_key', 'object_key'),
+)
+CSV_FLUSH_BYTES = 64 * 1024
+# A cell starting with one of these is read as a formula by spreadsheet apps
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_csv_cell(value):
+    """
+    Text that would open as a formula gets a leading ', which spreadsheets
+    show as text. User entered fields go out as typed, not as =HYPERLINK(...).
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def iter_invoice_csv(queryset, chunk_size):
+    """
+    CSV text of `queryset` in ~64KB pieces. The header goes out before the query
+    runs; rows come off a server side cursor as tuples, no model instances.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _ in INVOICE_CSV_COLUMNS])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    tz = timezone.get_current_timezone()
+    created_at = [path for _, path in INVOICE_CSV_COLUMNS].index('created_at')
+    rows = queryset.values_list(*(path for _, path in INVOICE_CSV_COLUMNS)).iterator(chunk_size=chunk_size)
+    for row in rows:
+        row = [escape_csv_cell(value) for value in row]
+        row[created_at] = row[created_at].astimezone(tz).isoformat(' ', 'seconds')
+        writer.writerow(row)
+        if buffer.tell() >= CSV_FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def aiter_sync(iterator):
+    """
+    Serve a sync iterator from ASGI a chunk at a time. Handing it to
+    StreamingHttpResponse as is makes Django read it all into a list first.
+    All steps run on the one thread_sensitive thread, so the DB cursor
+    stays on the connection that opened it.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    try:
+        while True:
+            chunk = await step(iterator, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        # Client went away: release the server side cursor
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def export_queryset(branch_id, params):
+    """
+    The invoices an export covers. Dates are whole local days, turned into a
+    created_at range so the (branch, -created_at) index does the work.
+    """
+    start, end = local_day_range(
+        datetime.fromisoformat(params['date_from']).date(),
+        datetime.fromisoformat(params['date_to']).date(),
+    )
+
+    invoices = InvoiceData.objects.filter(branch_id=branch_id, created_at__gte=start, created_at__lt=end)
+    if params.get('trip'):
+        invoices = invoices.filter(trip=params['trip'])
+    return (
+        invoices.select_related('branch', 'created_by')
+        .annotate(attached_type=Subquery(
+            InvoiceFile.objects.filter(invoice=OuterRef('pk'), key=OuterRef('object_key')).values('content_type')[:1]
+        ))
+        .order_by('created_at', 'id')
+    )
+
+
+def uploaded_pdf_key(invoice):
+    key = invoice.object_key
+    if key and (key.lower().endswith('.pdf') or invoice.attached_type == PDF_CONTENT_TYPE):
+        return key
+    return None
+
+
+def export_filename(invoice):
+    return f"INV-{invoice.id:06d}-{slugify(invoice.car_number) or 'invoice'}.pdf"
+
+
+def iter_invoice_pdfs(invoices, window):
+    """
+    (invoice, pdf bytes, source) in queryset order, keeping up to `window`
+    fetches and renders running ahead of the consumer
+    """
+    storage = get_storage()
+
+    def start(invoice):
+        key = uploaded_pdf_key(invoice)
+        if key:
+            return 'fetched', fetchers.submit(storage.read_object, key)
+        return 'rendered', submit_render(invoice_context(invoice), block=True)
+
+    def finish(invoice, source, future):
+        try:
+            return invoice, future.result(settings.PDF_RENDER_TIMEOUT), source
+        except ObjectNotFound:
+            # Attachment gone from the bucket, fall back to rendering it
+            render = submit_render(invoice_context(invoice), block=True)
+            return invoice, render.result(settings.PDF_RENDER_TIMEOUT), 'rendered'
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix='ivg-export') as fetchers:
+        for invoice in invoices.iterator(chunk_size=500):
+            in_flight.append((invoice, *start(invoice)))
+            if len(in_flight) >= window:
+                yield finish(*in_flight.popleft())
+        while in_flight:
+            yield finish(*in_flight.popleft())
+
+
+@job_handler(JobKind.PDF_EXPORT)
+def export_invoice_pdfs(job):
+    params = job.params
+    export_format = params.get('format', 'zip')
+    invoices = export_queryset(job.branch_id, params)
+    total = invoices.count()
+    job.set_progress(0, total)
+
+    if export_format not in EXPORT_CONTENT_TYPES:
+        # Queued before merged PDF exports were dropped
+        raise ValueError(f"Unsupported export format {export_format!r}, export a ZIP instead")
+    if not total:
+        raise ValueError("No invoices match this export")
+
+    object_key = f"exports/{job.branch_id}/{job.pk}.{export_format}"
+    counts = {'fetched': 0, 'rendered': 0}
+    with MultipartWriter(get_storage(), object_key, EXPORT_CONTENT_TYPES[export_format]) as out:
+        write_zip(job, invoices, out, counts)
+    job.set_progress(total)
+
+    return {
+        'object_key': object_key,
+        'format': export_format,
+        'size': out.tell(),
+        'count': total,
+        **counts,
+    }
+
+
+def write_zip(job, invoices, out, counts):
+    # PDFs are already compressed, deflating them again only burns CPU
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        processed = 0
+        for invoice, pdf, source in iter_invoice_pdfs(invoices, settings.PDF_EXPORT_CONCURRENCY):
+            archive.writestr(export_filename(invoice), pdf)
+            counts[source] += 1
+            processed += 1
+            if processed % PROGRESS_EVERY == 0:
+                job.set_progress(processed)
@@ -0,0 +1,88 @@
+"""
+Server side filters for the invoice list and export.
+
+Every filter is an equality or range on the column that follows branch in
+one of InvoiceData's composite indexes. Equality filters come back from the
+index already in (-created_at, -id) order; a cft range is sorted afterwards.
+
+    date_from/date_to    invoice_branch_created_idx
+    trip                 invoice_branch_trip_idx
+    wheels               invoice_branch_wheels_idx
+    police_station       invoice_branch_station_idx
+    car_number           invoice_branch_car_idx
+    created_by           invoice_branch_creator_idx
+    has_attachment=false invoice_branch_unattached_idx (partial)
+    has_attachment=true  invoice_branch_created_idx, most invoices have one
+    cft_min/cft_max      invoice_branch_cft_idx
+
+`manage.py bench_invoice_filters` checks the plans actually use them.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from rest_framework.filters import BaseFilterBackend
+
+from ivg.serializers import InvoiceListFilterSerializer
+
+FILTER_FIELDS = tuple(InvoiceListFilterSerializer().fields)
+
+
+def local_day_range(date_from=None, date_to=None):
+    """
+    Whole local days as an aware [start, end) created_at range, either end may be open
+    """
+    start = end = None
+    if date_from is not None:
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+    if date_to is not None:
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    return start, end
+
+
+def filter_invoices(queryset, filters):
+    """
+    Apply validated InvoiceListFilterSerializer data to an InvoiceData queryset
+    """
+    start, end = local_day_range(filters.get('date_from'), filters.get('date_to'))
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+
+    for field in ('trip', 'wheels', 'police_station', 'car_number'):
+        if filters.get(field) is not None:
+            queryset = queryset.filter(**{field: filters[field]})
+    if filters.get('created_by') is not None:
+        queryset = queryset.filter(created_by_id=filters['created_by'])
+    if filters.get('cft_min') is not None:
+        queryset = queryset.filter(cft__gte=filters['cft_min'])
+    if filters.get('cft_max') is not None:
+        queryset = queryset.filter(cft__lte=filters['cft_max'])
+    if filters.get('has_attachment') is not None:
+        queryset = queryset.filter(object_key__isnull=not filters['has_attachment'])
+    return queryset
+
+
+class InvoiceFilter(BaseFilterBackend):
+    """
+    ?date_from=&date_to=&trip=&wheels=&cft_min=&cft_max=&police_station=
+    &car_number=&created_by=&has_attachment= on the invoice list and export
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not any(name in request.query_params for name in FILTER_FIELDS):
+            return queryset
+        serializer = InvoiceListFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return filter_invoices(queryset, serializer.validated_data)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': 'string'},
+            }
+            for name in FILTER_FIELDS
+        ]
@@ -0,0 +1,333 @@
+"""
+Streaming import of historical invoices from CSV or XLSX.
+
+Files are read one row at a time: CSV straight off the S3 stream, XLSX (a
+zip, so it needs random access) from a temp file parsed with iterparse. Only
+the current batch of rows and, for XLSX, the shared string table are held in
+memory. Every batch is inserted with bulk_create in one transaction together
+with the job's checkpoint, so a failed or interrupted import resumes from the
+first row that was not committed.
+"""
+import csv
+import io
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from ivg.constant import JobKind, TripStatusType
+from ivg.dashboard import invalidate_dashboard_stats
+from ivg.exports import FORMULA_PREFIXES
+from ivg.jobs import job_handler
+from ivg.models import BackgroundJob, InvoiceData
+from ivg.rollups import add_invoices_to_rollup
+from ivg.serializers import InvoiceGenerationSerializer
+from ivg.storage import get_storage
+from ivg.versions import bump_data_versions, invoices_scope
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+IMPORT_COLUMNS = (
+    'trip', 'police_station', 'car_number', 'phone_number', 'name',
+    'location', 'wheels', 'cft', 'remarks', 'created_at',
+)
+COLUMN_ALIASES = {
+    'date': 'created_at',
+    'invoice_date': 'created_at',
+    'phone': 'phone_number',
+    'mobile': 'phone_number',
+    'vehicle_number': 'car_number',
+    'vehicle_no': 'car_number',
+    'car_no': 'car_number',
+}
+# Accept both the stored value and the display label, in any case
+TRIP_VALUES = {
+    name.lower(): value
+    for value, label in TripStatusType.choices()
+    for name in (value, label)
+}
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%Y %H:%M', '%d-%m-%Y %H:%M')
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+CELL_REF_RE = re.compile(r'^([A-Z]+)')
+
+
+def import_format(filename, requested=None):
+    if requested:
+        return requested
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported file type {extension!r}, expected one of {', '.join(IMPORT_FORMATS)}")
+    return extension
+
+
+def unescape_csv_cell(value):
+    # Undo escape_csv_cell, so an export imports back unchanged
+    if value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+def normalize_header(name):
+    name = re.sub(r'[^a-z0-9]+', '_', str(name or '').strip().lower()).strip('_')
+    return COLUMN_ALIASES.get(name, name)
+
+
+def _rows_from_values(values_iter):
+    """
+    (row number, {column: value}) for every non empty data row, numbered from 1 after the header
+    """
+    header = None
+    number = 0
+    for values in values_iter:
+        if header is None:
+            header = [normalize_header(value) for value in values]
+            continue
+        number += 1
+        if not any(str(value).strip() for value in values):
+            continue
+        yield number, {column: value for column, value in zip(header, values) if column in IMPORT_COLUMNS}
+
+
+# --- readers ---
+
+def iter_csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return _rows_from_values(csv.reader(text))
+
+
+def _column_index(reference):
+    match = CELL_REF_RE.match(reference or '')
+    if not match:
+        return None
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _first_sheet_path(archive):
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{XLSX_NS}sheets/{XLSX_NS}sheet')
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{XLSX_PKG_REL_NS}Relationship'):
+        if sheet is not None and rel.get('Id') == sheet.get(f'{XLSX_REL_NS}id'):
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as stream:
+        for _, elem in ET.iterparse(stream):
+            if elem.tag == f'{XLSX_NS}si':
+                # Plain <t>, or rich text runs <r><t>; phonetic hints (<rPh>) are not part of the text
+                strings.append(''.join(
+                    (child.text or '') if child.tag == f'{XLSX_NS}t' else child.findtext(f'{XLSX_NS}t', '')
+                    for child in elem
+                    if child.tag in (f'{XLSX_NS}t', f'{XLSX_NS}r')
+                ))
+                elem.clear()
+    return strings
+
+
+def _cell_value(cell, shared):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(f'{XLSX_NS}t'))
+    value = cell.findtext(f'{XLSX_NS}v')
+    if value is None:
+        return ''
+    if kind == 's':
+        return shared[int(value)]
+    return value
+
+
+def _iter_xlsx_values(archive):
+    shared = _shared_strings(archive)
+    with archive.open(_first_sheet_path(archive)) as stream:
+        sheet_data = None
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == f'{XLSX_NS}sheetData':
+                    sheet_data = elem
+                continue
+            if elem.tag != f'{XLSX_NS}row':
+                continue
+            values = []
+            for cell in elem.iter(f'{XLSX_NS}c'):
+                index = _column_index(cell.get('r'))
+                if index is None:
+                    index = len(values)
+                values.extend([''] * (index - len(values)))
+                values.append(_cell_value(cell, shared))
+            # Rows already handed out are dropped, the parsed tree never grows
+            if sheet_data is not None:
+                sheet_data.clear()
+            yield values
+
+
+def iter_xlsx_rows(path):
+    with zipfile.ZipFile(path) as archive:
+        yield from _rows_from_values(_iter_xlsx_values(archive))
+
+
+@contextmanager
+def open_import_rows(params):
+    """
+    Rows of the file a job imports, from `path` (management command) or `object_key` (uploaded)
+    """
+    file_format = params['format']
+    if params.get('path'):
+        with open(params['path'], 'rb') as stream:
+            yield iter_csv_rows(stream) if file_format == 'csv' else iter_xlsx_rows(stream)
+        return
+
+    storage = get_storage()
+    if file_format == 'csv':
+        with storage.open_object(params['object_key']) as stream:
+            yield iter_csv_rows(stream)
+        return
+    with tempfile.TemporaryFile(suffix='.xlsx') as local, storage.open_object(params['object_key']) as stream:
+        shutil.copyfileobj(stream, local, 1024 * 1024)
+        local.seek(0)
+        yield iter_xlsx_rows(local)
+
+
+# --- validation and loading ---
+
+def _parse_datetime(value, excel_serials=False):
+    if excel_serials:
+        try:
+            # XLSX stores dates as days since 1899-12-30. Only trusted for XLSX:
+            # in a CSV a bare number such as 2024 is a year, not day 2024 of 1899
+            return EXCEL_EPOCH + timedelta(days=float(value))
+        except (ValueError, OverflowError):
+            pass
+    try:
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return parsed
+        date = parse_date(value)
+        if date is not None:
+            return datetime(date.year, date.month, date.day)
+    except ValueError:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_import_datetime(value, excel_serials=False):
+    value = str(value).strip()
+    parsed = _parse_datetime(value, excel_serials)
+    if parsed is None:
+        raise ValidationError({'created_at': [f"Unrecognised date {value!r}"]})
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class InvoiceImporter:
+    """
+    Validates rows and commits them in batches along with the job checkpoint
+    """
+
+    def __init__(self, job, state):
+        self.job = job
+        self.state = state
+        self.validator = InvoiceGenerationSerializer()
+        self.excel_serials = job.params.get('format') == 'xlsx'
+        self.batch = []
+        self.batch_errors = []
+        self.last_row = state['row']
+
+    def add(self, number, row):
+        self.last_row = number
+        try:
+            self.batch.append((number, *self.validate(row)))
+        except ValidationError as e:
+            self.batch_errors.append({'row': number, 'errors': e.detail})
+        if len(self.batch) + len(self.batch_errors) >= settings.INVOICE_IMPORT_BATCH_SIZE:
+            self.flush()
+
+    def validate(self, row):
+        row = {column: unescape_csv_cell(str(value)).strip() for column, value in row.items()}
+        created_at = row.pop('created_at', '')
+        if row.get('trip'):
+            row['trip'] = TRIP_VALUES.get(row['trip'].lower(), row['trip'])
+        data = self.validator.run_validation(row)
+        invoice = InvoiceData(**data, created_by_id=self.job.created_by_id, branch_id=self.job.branch_id)
+        return invoice, parse_import_datetime(created_at, self.excel_serials) if created_at else None
+
+    def flush(self):
+        if self.last_row == self.state['row']:
+            return
+        invoices = [invoice for _, invoice, _ in self.batch]
+        # Taken over only once the batch commits, a failed one leaves the checkpoint as it was
+        room = settings.INVOICE_IMPORT_MAX_ERRORS - len(self.state['errors'])
+        state = {
+            'row': self.last_row,
+            'created': self.state['created'] + len(invoices),
+            'failed': self.state['failed'] + len(self.batch_errors),
+            'errors': self.state['errors'] + self.batch_errors[:max(room, 0)],
+        }
+
+        with transaction.atomic():
+            InvoiceData.objects.bulk_create(invoices)
+            # auto_now_add stamped now on insert, put the spreadsheet's dates back. Sheets
+            # mostly hold whole days, so one UPDATE per distinct date beats bulk_update's CASE
+            backdated = defaultdict(list)
+            for _, invoice, created_at in self.batch:
+                if created_at is not None:
+                    invoice.created_at = created_at
+                    backdated[created_at].append(invoice.pk)
+            for created_at, ids in backdated.items():
+                InvoiceData.objects.filter(pk__in=ids).update(created_at=created_at)
+            add_invoices_to_rollup(invoices)
+            bump_data_versions(*{invoices_scope(invoice.branch_id) for invoice in invoices})
+            BackgroundJob.objects.filter(pk=self.job.pk).update(
+                checkpoint=state,
+                processed=state['created'] + state['failed'],
+                updated_at=timezone.now(),
+            )
+            invalidate_dashboard_stats()
+        self.state = state
+        self.batch, self.batch_errors = [], []
+        # With DEBUG on Django keeps the SQL of every query, 1000 row INSERTs add up fast
+        reset_queries()
+
+
+@job_handler(JobKind.INVOICE_IMPORT)
+def import_invoices(job):
+    importer = InvoiceImporter(job, job.checkpoint or {'row': 0, 'created': 0, 'failed': 0, 'errors': []})
+    with open_import_rows(job.params) as rows:
+        for number, row in rows:
+            if number <= importer.state['row']:
+                # Committed by an earlier run
+                continue
+            importer.add(number, row)
+        importer.flush()
+    state = importer.state
+    return {
+        'rows': state['row'],
+        'created': state['created'],
+        'failed': state['failed'],
+        'errors': state['errors'],
+    }
@@ -0,0 +1,81 @@
+"""
+In-process runner for `BackgroundJob`s.
+
+Jobs run on a small thread pool owned by the web process. Heavy CPU work
+(PDF rendering) is pushed further out to the PDF process pool by the job
+itself, so these threads mostly wait on S3 and the database. A job that was
+pending or running when its process died can be picked up again with
+`manage.py run_jobs`.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from ivg.constant import JobStatus
+from ivg.models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """
+    Register `func(job) -> result dict` as the handler for a JobKind
+    """
+    def register(func):
+        JOB_HANDLERS[kind.value] = func
+        return func
+    return register
+
+
+def get_job_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_JOB_WORKERS,
+                    thread_name_prefix='ivg-job',
+                )
+    return _executor
+
+
+def enqueue_job(job):
+    """
+    Start `job` once the transaction that created it commits
+    """
+    transaction.on_commit(lambda: get_job_executor().submit(run_job, job.pk))
+
+
+def run_job(job_id):
+    """
+    Run one job to completion on the calling thread
+    """
+    close_old_connections()
+    try:
+        claimed = BackgroundJob.objects.filter(
+            pk=job_id, status=JobStatus.PENDING.value
+        ).update(status=JobStatus.RUNNING.value, started_at=timezone.now(), updated_at=timezone.now())
+        if not claimed:
+            # Already picked up by another thread or process
+            return
+        job = BackgroundJob.objects.get(pk=job_id)
+        try:
+            job.result = JOB_HANDLERS[job.kind](job)
+            job.status = JobStatus.SUCCEEDED.value
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.pk, job.kind)
+            job.status = JobStatus.FAILED.value
+            job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error', 'finished_at', 'updated_at'])
+    finally:
+        close_old_connections()
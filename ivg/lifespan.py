@@ -0,0 +1,44 @@
+"""
+ASGI lifespan for the worker-wide resources Django has no hook for.
+
+Django's ASGI handler only speaks HTTP. LifespanMiddleware answers the
+server's lifespan messages itself and on shutdown releases what the worker
+started lazily: the PDF render pool's processes and the storage's HTTP
+client on the server's event loop.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+
+async def shutdown():
+    from ivg.pdf import shutdown_render_pool
+    from ivg.storage import get_storage
+
+    # Waits for the renders already running, cancels the queued ones
+    await sync_to_async(shutdown_render_pool, thread_sensitive=False)()
+    await get_storage().aclose()
+
+
+class LifespanMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await shutdown()
+                except Exception as e:
+                    logger.exception("Worker shutdown failed")
+                    await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                else:
+                    await send({'type': 'lifespan.shutdown.complete'})
+                return
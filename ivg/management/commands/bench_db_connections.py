@@ -0,0 +1,107 @@
+import copy
+import importlib.util
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the database connection setup: concurrent short requests with "
+        "a connection per request against the same requests through the pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Simulated requests per mode')
+        parser.add_argument('--concurrency', type=int, default=20, help='Threads issuing requests')
+        parser.add_argument('--sql', default='SELECT 1', help='Query each request runs')
+
+    def handle(self, *args, **options):
+        default = connections['default']
+        if default.vendor != 'postgresql':
+            raise CommandError("Connection pooling only applies to PostgreSQL, set DATABASE_ENGINE to run this")
+
+        base = copy.deepcopy(default.settings_dict)
+        base['OPTIONS'].pop('pool', None)
+        direct = {**base, 'CONN_MAX_AGE': 0}
+        modes = [('direct', direct)]
+        if importlib.util.find_spec('psycopg_pool') is not None:
+            pool_options = dict(default.settings_dict['OPTIONS'].get('pool') or {})
+            # Sized to the load unless settings already configure the pool
+            pool_options.setdefault('max_size', options['concurrency'])
+            pooled = {**base, 'CONN_MAX_AGE': 0, 'OPTIONS': {**base['OPTIONS'], 'pool': pool_options}}
+            modes.append(('pooled', pooled))
+        else:
+            self.stdout.write(self.style.WARNING("psycopg[pool] is not installed, only the direct mode runs"))
+
+        results = {}
+        for name, settings_dict in modes:
+            results[name] = self.run(f'bench_{name}', settings_dict, options['requests'], options['concurrency'], options['sql'])
+            result = results[name]
+            self.stdout.write(
+                f"{name:>7}: {result['requests']} requests in {result['seconds']:.2f}s "
+                f"({result['requests'] / result['seconds']:.0f}/s), "
+                f"p50 {result['p50']:.2f} ms, p95 {result['p95']:.2f} ms, "
+                f"{result['connections']} connections opened"
+            )
+        if 'pooled' in results:
+            direct, pooled = results['direct'], results['pooled']
+            self.stdout.write(self.style.SUCCESS(
+                f"Pooling: {direct['connections'] / max(pooled['connections'], 1):.0f}x fewer connections, "
+                f"p50 {direct['p50'] / pooled['p50']:.1f}x faster"
+            ))
+
+    def run(self, alias, settings_dict, requests, concurrency, sql):
+        backend = load_backend(settings_dict['ENGINE'])
+        opened = []
+        lock = threading.Lock()
+
+        def count_connection(sender, connection, **kwargs):
+            if connection.alias == alias:
+                with lock:
+                    opened.append(1)
+
+        def worker(count):
+            wrapper = backend.DatabaseWrapper(settings_dict, alias)
+            latencies = []
+            for _ in range(count):
+                started = time.perf_counter()
+                with wrapper.cursor() as cursor:
+                    cursor.execute(sql)
+                    cursor.fetchall()
+                # What Django does when a request finishes: close, or hand back to the pool
+                wrapper.close()
+                latencies.append((time.perf_counter() - started) * 1000)
+            return wrapper, latencies
+
+        shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        connection_created.connect(count_connection)
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                finished = list(executor.map(worker, shares))
+            seconds = time.perf_counter() - started
+        finally:
+            connection_created.disconnect(count_connection)
+
+        latencies = sorted(latency for _, worker_latencies in finished for latency in worker_latencies)
+        wrapper = finished[0][0]
+        if wrapper.pool is not None:
+            # connection_created fires on every checkout, the pool knows how many it really opened
+            connections_opened = wrapper.pool.get_stats()['connections_num']
+            wrapper.close_pool()
+        else:
+            connections_opened = len(opened)
+        return {
+            'requests': len(latencies),
+            'seconds': seconds,
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'connections': connections_opened,
+        }
@@ -0,0 +1,73 @@
+import statistics
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from ivg.filters import filter_invoices
+from ivg.management.commands.bench_invoice_queries import BENCH_PREFIX, Command as QueryBench
+from ivg.models import Branches, InvoiceData
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the invoice list filters (ivg/filters.py) on seeded invoices and check "
+        "that the plan of each one uses the index meant to serve it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000)
+        parser.add_argument('--branches', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query, the median is reported')
+        parser.add_argument('--reuse', action='store_true', help='Reuse rows seeded by an earlier --keep run')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        bench = QueryBench(stdout=self.stdout, stderr=self.stderr)
+        if not (options['reuse'] and Branches.objects.filter(slug__startswith=BENCH_PREFIX).exists()):
+            bench.seed(options['rows'], options['branches'], options['batch_size'])
+        with connection.cursor() as cursor:
+            # Fresh statistics, or the planner guesses selectivity
+            cursor.execute('ANALYZE')
+
+        branch = Branches.objects.filter(slug__startswith=BENCH_PREFIX).order_by('id')[options['branches'] // 2]
+        invoices = InvoiceData.objects.filter(branch=branch)
+        sample = invoices.exclude(police_station=None).values('car_number', 'police_station', 'created_by_id').first()
+        today = timezone.localdate()
+
+        cases = [
+            ('last 30 days', {'date_from': today - timedelta(days=30), 'date_to': today}, 'invoice_branch_created_idx'),
+            ('trip', {'trip': 'second trip'}, 'invoice_branch_trip_idx'),
+            ('trip + month', {'trip': 'second trip', 'date_from': today - timedelta(days=30)}, 'invoice_branch_trip_idx'),
+            ('wheels', {'wheels': 14}, 'invoice_branch_wheels_idx'),
+            ('police station', {'police_station': sample['police_station']}, 'invoice_branch_station_idx'),
+            ('car number', {'car_number': sample['car_number']}, 'invoice_branch_car_idx'),
+            ('creator', {'created_by': sample['created_by_id']}, 'invoice_branch_creator_idx'),
+            ('no attachment', {'has_attachment': False}, 'invoice_branch_unattached_idx'),
+            ('has attachment', {'has_attachment': True}, 'invoice_branch_created_idx'),
+            ('cft 100-101', {'cft_min': 100, 'cft_max': 101}, 'invoice_branch_cft_idx'),
+        ]
+
+        self.stdout.write(f"{InvoiceData.objects.count()} invoices, branch {branch.slug} ({connection.vendor})\n")
+        self.stdout.write(f"{'filter':<18}{'p50 ms':>10}{'p95 ms':>10}  index")
+        missed = []
+        for name, filters, index in cases:
+            page = filter_invoices(invoices, filters).order_by('-created_at', '-id')[:20]
+            samples = bench.samples(lambda qs: list(qs.all()), page, options['repeat'])
+            p95 = statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+            plan = page.explain()
+            used = index in plan
+            if not used:
+                missed.append((name, index, plan))
+            self.stdout.write(
+                f"{name:<18}{statistics.median(samples):>10.2f}{p95:>10.2f}  {index} {'ok' if used else 'NOT USED'}"
+            )
+
+        if not options['keep']:
+            bench.cleanup()
+        if missed:
+            for name, index, plan in missed:
+                self.stderr.write(f"\n{name}: expected {index}\n{plan}")
+            raise CommandError(f"{len(missed)} filter(s) not served by their index")
@@ -0,0 +1,135 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ivg.constant import TripStatusType
+from ivg.models import Branches, InvoiceData, InvoiceUser
+from ivg.search import SEARCH_FIELDS, search_invoices
+
+BENCH_PREFIX = 'bench-'
+STATIONS = [f"Bench PS {i}" for i in range(40)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a few million invoices and compare branch scoped queries joined through "
+        "InvoiceUser (before) with the denormalized branch column and its indexes (after)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000)
+        parser.add_argument('--branches', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query, the median is reported')
+        parser.add_argument('--reuse', action='store_true', help='Reuse rows seeded by an earlier --keep run')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        if not (options['reuse'] and Branches.objects.filter(slug__startswith=BENCH_PREFIX).exists()):
+            self.seed(options['rows'], options['branches'], options['batch_size'])
+        branches = list(Branches.objects.filter(slug__startswith=BENCH_PREFIX).order_by('id'))
+        branch = branches[len(branches) // 2]
+        car_number = InvoiceData.objects.filter(branch=branch).values_list('car_number', flat=True).first()
+        deep = 20 * 2500
+
+        before = InvoiceData.objects.filter(created_by__branch=branch).order_by('-created_at', '-updated_at')
+        after = InvoiceData.objects.filter(branch=branch)
+        cases = [
+            ('first page', lambda qs: list(qs[:20])),
+            (f'page at offset {deep}', lambda qs: list(qs[deep:deep + 20])),
+            ('count', lambda qs: qs.count()),
+            ('car_number lookup', lambda qs: list(qs.filter(car_number=car_number)[:20])),
+        ]
+
+        self.stdout.write(f"{InvoiceData.objects.count()} invoices, branch {branch.slug}\n")
+        self.stdout.write(f"{'query':<24}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+        for name, run in cases:
+            before_ms = self.time(run, before, options['repeat'])
+            after_ms = self.time(run, after, options['repeat'])
+            self.stdout.write(f"{name:<24}{before_ms:>12.2f}{after_ms:>12.2f}{before_ms / max(after_ms, 1e-6):>9.1f}x")
+
+        # Search: icontains scan of the branch vs the trigram index (ivg/search.py)
+        term = car_number[-6:]
+        scan = Q()
+        for field in SEARCH_FIELDS:
+            scan |= Q(**{f'{field}__icontains': term})
+        self.stdout.write(f"\n{'search ' + repr(term):<24}{'p50 ms':>12}{'p95 ms':>12}")
+        for name, queryset in (('icontains', after.filter(scan)), ('indexed', search_invoices(after, term))):
+            samples = self.samples(lambda qs: list(qs[:20]), queryset, options['repeat'])
+            p95 = statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+            self.stdout.write(f"{name:<24}{statistics.median(samples):>12.2f}{p95:>12.2f}")
+
+        self.stdout.write("\nPlans after:")
+        self.stdout.write(after[:20].explain())
+        self.stdout.write(after.filter(car_number=car_number)[:20].explain())
+        self.stdout.write(search_invoices(after, term)[:20].explain())
+
+        if not options['keep']:
+            self.cleanup()
+
+    def time(self, run, queryset, repeat):
+        return statistics.median(self.samples(run, queryset, repeat))
+
+    def samples(self, run, queryset, repeat):
+        run(queryset)  # warm up caches
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run(queryset)
+            samples.append((time.perf_counter() - started) * 1000)
+        return samples
+
+    def seed(self, rows, branch_count, batch_size):
+        self.cleanup()
+        branches = Branches.objects.bulk_create([
+            Branches(name=f"{BENCH_PREFIX}branch-{i}", slug=f"{BENCH_PREFIX}branch-{i}")
+            for i in range(branch_count)
+        ])
+        users = InvoiceUser.objects.bulk_create([
+            InvoiceUser(username=f"{BENCH_PREFIX}user-{i}", branch=branch)
+            for i, branch in enumerate(branches)
+        ])
+        trips = [trip.value for trip in TripStatusType]
+        now = timezone.now()
+        rng = random.Random(42)
+
+        # Spread created_at over two years, auto_now_add would stamp every row with now
+        created_at = InvoiceData._meta.get_field('created_at')
+        created_at.auto_now_add = False
+        try:
+            for start in range(0, rows, batch_size):
+                batch = []
+                for _ in range(min(batch_size, rows - start)):
+                    user = rng.choice(users)
+                    batch.append(InvoiceData(
+                        created_by=user,
+                        branch_id=user.branch_id,
+                        created_at=now - timedelta(seconds=rng.randrange(2 * 365 * 86400)),
+                        trip=rng.choice(trips),
+                        police_station=rng.choice(STATIONS),
+                        car_number=f"WB{rng.randrange(10, 99)}-{rng.randrange(10000)}",
+                        phone_number=f"9{rng.randrange(10 ** 9):09d}",
+                        name="Bench Driver",
+                        location="Bench Yard",
+                        wheels=rng.choice([6, 10, 12, 14]),
+                        cft=round(rng.uniform(50, 600), 2),
+                        # Most invoices get their file, a few are still waiting
+                        object_key=f"invoices/bench/{start}-{len(batch)}.pdf" if rng.random() < 0.9 else None,
+                    ))
+                with transaction.atomic():
+                    InvoiceData.objects.bulk_create(batch)
+                self.stdout.write(f"\rseeded {start + len(batch)}/{rows}", ending='')
+            self.stdout.write('')
+        finally:
+            created_at.auto_now_add = True
+
+    def cleanup(self):
+        InvoiceData.objects.filter(branch__slug__startswith=BENCH_PREFIX).delete()
+        InvoiceUser.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        Branches.objects.filter(slug__startswith=BENCH_PREFIX).delete()
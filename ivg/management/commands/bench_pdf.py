@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from ivg import pdf
+from ivg.constant import TripStatusType
+
+
+def _render_batch(contexts):
+    for context in contexts:
+        pdf.render_invoice_pdf_bytes(context)
+    return len(contexts)
+
+
+class Command(BaseCommand):
+    help = "Measure invoice PDF throughput (invoices/s per core), cold and warm, in process and through the render pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Invoices rendered per run')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Pool size for the parallel run')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        workers = options['workers']
+        contexts = self.sample_contexts(count)
+
+        # Cold: what every render paid when the template, CSS and fonts were built per request
+        started = time.perf_counter()
+        size = len(pdf.render_invoice_pdf_bytes(contexts[0]))
+        cold_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        _render_batch(contexts)
+        serial = count / (time.perf_counter() - started)
+
+        # Same work in `workers` processes, warmed up before the clock starts
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=pdf.warm_up,
+        ) as pool:
+            wait([pool.submit(pdf.warm_up) for _ in range(workers)])
+            chunk = max(1, count // (workers * 4))
+            started = time.perf_counter()
+            rendered = sum(pool.map(_render_batch, [contexts[i:i + chunk] for i in range(0, count, chunk)]))
+            parallel = rendered / (time.perf_counter() - started)
+
+        self.stdout.write(f"PDF size ~{size / 1024:.1f} KiB, first (cold) render {cold_ms:.1f} ms")
+        self.stdout.write(f"{'run':<18}{'invoices/s':>12}{'per core':>12}")
+        self.stdout.write(f"{'in process, warm':<18}{serial:>12.1f}{serial:>12.1f}")
+        self.stdout.write(f"{f'pool x{workers}':<18}{parallel:>12.1f}{parallel / workers:>12.1f}")
+
+    def sample_contexts(self, count):
+        rng = random.Random(7)
+        trips = [trip.name.replace('_', ' ').title() for trip in TripStatusType]
+        return [
+            {
+                'invoice_id': i,
+                'invoice_number': f"INV-{i:06d}",
+                'date': '18 Oct 2026',
+                'time': '10:30 AM',
+                'trip': rng.choice(trips),
+                'police_station': 'Bench PS',
+                'car_number': f"WB{rng.randrange(10, 99)}-{rng.randrange(10000)}",
+                'phone_number': f"9{rng.randrange(10 ** 9):09d}",
+                'name': 'Bench Driver',
+                'location': 'Bench Yard',
+                'wheels': rng.choice([6, 10, 12, 14]),
+                'cft': round(rng.uniform(50, 600), 2),
+                'remarks': '',
+                'branch_name': 'Bench Branch',
+                'branch_address': '1 Bench Road',
+                'created_by': 'bench',
+            }
+            for i in range(1, count + 1)
+        ]
@@ -0,0 +1,83 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ivg.constant import JobKind, JobStatus
+from ivg.imports import import_format
+from ivg.jobs import run_job
+from ivg.models import BackgroundJob, InvoiceUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a CSV or XLSX file of historical invoices into InvoiceData. "
+        "Progress is committed per batch, re-run with --resume <job id> to continue after a failure."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='CSV or XLSX file to import')
+        parser.add_argument('--user', help='Username the invoices are created by, their branch is used')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help='Override the format guessed from the extension')
+        parser.add_argument('--resume', metavar='JOB_ID', help='Continue an earlier import from its last committed row')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            job = self.resume(options['resume'])
+        else:
+            job = self.create(options)
+
+        self.stdout.write(f"Importing {job.params.get('path') or job.params['object_key']} as job {job.pk}")
+        run_job(job.pk)
+        job.refresh_from_db()
+
+        if job.status != JobStatus.SUCCEEDED.value:
+            raise CommandError(
+                f"Import failed after row {(job.checkpoint or {}).get('row', 0)}: {job.error}\n"
+                f"Fix the cause and re-run with --resume {job.pk}"
+            )
+        result = job.result
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} rows: {result['created']} created, {result['failed']} failed"
+        ))
+        for error in result['errors']:
+            self.stdout.write(f"  row {error['row']}: {error['errors']}")
+
+    def create(self, options):
+        if not options['path'] or not options['user']:
+            raise CommandError("path and --user are required unless --resume is given")
+        if not os.path.isfile(options['path']):
+            raise CommandError(f"No such file: {options['path']}")
+        try:
+            user = InvoiceUser.objects.get(username=options['user'])
+        except InvoiceUser.DoesNotExist:
+            raise CommandError(f"No user {options['user']!r}")
+        if user.branch_id is None:
+            raise CommandError(f"User {user.username!r} is not assigned to a branch")
+        try:
+            file_format = import_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        return BackgroundJob.objects.create(
+            kind=JobKind.INVOICE_IMPORT.value,
+            created_by=user,
+            branch_id=user.branch_id,
+            params={
+                'path': os.path.abspath(options['path']),
+                'filename': os.path.basename(options['path']),
+                'format': file_format,
+            },
+        )
+
+    def resume(self, job_id):
+        try:
+            job = BackgroundJob.objects.get(pk=job_id, kind=JobKind.INVOICE_IMPORT.value)
+        except (BackgroundJob.DoesNotExist, ValueError):
+            raise CommandError(f"No import job {job_id}")
+        if job.status == JobStatus.SUCCEEDED.value:
+            raise CommandError(f"Job {job.pk} already finished")
+        # A job left running by a dead process is resumed as well
+        job.status = JobStatus.PENDING.value
+        job.error = None
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return job
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ivg import refdata
+from ivg.dashboard import invalidate_dashboard_stats
+from ivg.rollups import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute InvoiceDailyRollup from InvoiceData. Run it after writes that bypass the "
+        "rollup (queryset updates, raw SQL) or a change of TIME_ZONE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', help='Slug of the one branch to rebuild, all branches by default')
+
+    def handle(self, *args, **options):
+        branch_id = None
+        if options['branch']:
+            branch = refdata.branches.get_by_slug(options['branch'])
+            if branch is None:
+                raise CommandError(f"No branch {options['branch']!r}")
+            branch_id = branch.pk
+
+        started = time.perf_counter()
+        written = rebuild_rollup(branch_id)
+        invalidate_dashboard_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"{written} rollup rows written in {time.perf_counter() - started:.2f}s"
+        ))
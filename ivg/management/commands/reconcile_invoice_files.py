@@ -0,0 +1,194 @@
+import re
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ivg.models import InvoiceData, InvoiceFile
+from ivg.services import BLOB_PREFIX, content_hash_from_key
+from ivg.storage import get_storage
+
+INVOICE_PREFIX = 'invoices/'
+INVOICE_KEY_RE = re.compile(r'^invoices/(\d+)/')
+
+
+class Command(BaseCommand):
+    help = "Page through the bucket and bring the InvoiceFile index in line with S3"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', action='append', dest='prefixes',
+            help=f"Only reconcile keys under this prefix, repeatable (default: {INVOICE_PREFIX} and {BLOB_PREFIX})",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Objects compared per DB round trip')
+        parser.add_argument('--dry-run', action='store_true', help='Report differences without writing')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.stats = {'seen': 0, 'created': 0, 'updated': 0, 'deleted': 0, 'skipped': 0}
+
+        for prefix in options['prefixes'] or [INVOICE_PREFIX, BLOB_PREFIX]:
+            self.prefix = prefix
+            # Blob keys carry no invoice id, they are matched through the rows and invoices pointing at them
+            if prefix.startswith(BLOB_PREFIX):
+                self._reconcile_blobs()
+            else:
+                self._reconcile_invoices()
+
+        self.stdout.write(self.style.SUCCESS(
+            ("[dry run] " if self.dry_run else "") + ", ".join(f"{k}: {v}" for k, v in self.stats.items())
+        ))
+
+    def _reconcile_invoices(self):
+        seen_invoices = set()
+
+        # S3 lists keys in lexicographic order, so the objects of one invoice arrive together
+        batch = {}
+        batch_objects = 0
+        objects = get_storage().iter_objects(self.prefix)
+        for invoice_id, group in groupby(objects, key=self._invoice_id):
+            group = list(group)
+            self.stats['seen'] += len(group)
+            if invoice_id is None:
+                self.stats['skipped'] += len(group)
+                continue
+            seen_invoices.add(invoice_id)
+            batch.setdefault(invoice_id, []).extend(group)
+            batch_objects += len(group)
+            if batch_objects >= self.batch_size:
+                self._reconcile(batch)
+                batch, batch_objects = {}, 0
+        if batch:
+            self._reconcile(batch)
+
+        self._sweep(seen_invoices)
+
+    def _invoice_id(self, obj):
+        match = INVOICE_KEY_RE.match(obj['Key'])
+        return int(match.group(1)) if match else None
+
+    def _reconcile(self, batch):
+        existing_invoices = set(
+            InvoiceData.objects.filter(id__in=batch.keys()).values_list('id', flat=True)
+        )
+        rows = {
+            (row.invoice_id, row.key): row
+            for row in InvoiceFile.objects.filter(invoice_id__in=existing_invoices, key__startswith=self.prefix)
+        }
+        to_create, to_update = [], []
+        for invoice_id, objects in batch.items():
+            if invoice_id not in existing_invoices:
+                self.stats['skipped'] += len(objects)
+                continue
+            for obj in objects:
+                row = rows.pop((invoice_id, obj['Key']), None)
+                if row is None:
+                    to_create.append(self._new_row(invoice_id, obj))
+                elif self._refresh_row(row, obj):
+                    to_update.append(row)
+        # Whatever is left in `rows` is indexed but no longer in the bucket
+        self._write(to_create, to_update, [row.id for row in rows.values()])
+
+    def _sweep(self, seen_invoices):
+        """
+        Drop index rows of invoices that have no objects left under the prefix at all
+        """
+        indexed = (
+            InvoiceFile.objects.filter(key__startswith=self.prefix)
+            .values_list('invoice_id', flat=True)
+            .distinct()
+            .order_by('invoice_id')
+        )
+        missing = [
+            invoice_id for invoice_id in indexed.iterator(chunk_size=self.batch_size)
+            if invoice_id not in seen_invoices
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            stale = InvoiceFile.objects.filter(invoice_id__in=chunk, key__startswith=self.prefix)
+            self.stats['deleted'] += stale.count()
+            if not self.dry_run:
+                stale.delete()
+
+    def _reconcile_blobs(self):
+        seen_keys = set()
+        batch = {}
+        for obj in get_storage().iter_objects(self.prefix):
+            self.stats['seen'] += 1
+            seen_keys.add(obj['Key'])
+            batch[obj['Key']] = obj
+            if len(batch) >= self.batch_size:
+                self._reconcile_blob_batch(batch)
+                batch = {}
+        if batch:
+            self._reconcile_blob_batch(batch)
+
+        self._sweep_blobs(seen_keys)
+
+    def _reconcile_blob_batch(self, batch):
+        """
+        A blob is shared by every invoice of the branch that uploaded the same
+        content: refresh each row pointing at it and index it for invoices
+        whose `object_key` is the blob but have no row yet
+        """
+        indexed = set()
+        to_update = []
+        for row in InvoiceFile.objects.filter(key__in=batch.keys()):
+            indexed.add((row.invoice_id, row.key))
+            if self._refresh_row(row, batch[row.key]):
+                to_update.append(row)
+
+        to_create = []
+        referenced = set()
+        for invoice_id, key in InvoiceData.objects.filter(object_key__in=batch.keys()).values_list('id', 'object_key'):
+            referenced.add(key)
+            if (invoice_id, key) not in indexed:
+                to_create.append(self._new_row(invoice_id, batch[key]))
+
+        # Uploaded but never attached to an invoice, nothing to index them under
+        self.stats['skipped'] += len(batch.keys() - referenced - {key for _, key in indexed})
+        self._write(to_create, to_update, [])
+
+    def _sweep_blobs(self, seen_keys):
+        """
+        Drop index rows of blobs that are no longer in the bucket
+        """
+        indexed = InvoiceFile.objects.filter(key__startswith=self.prefix).values_list('id', 'key').order_by('id')
+        stale = [row_id for row_id, key in indexed.iterator(chunk_size=self.batch_size) if key not in seen_keys]
+        self.stats['deleted'] += len(stale)
+        if self.dry_run:
+            return
+        for start in range(0, len(stale), self.batch_size):
+            InvoiceFile.objects.filter(id__in=stale[start:start + self.batch_size]).delete()
+
+    def _new_row(self, invoice_id, obj):
+        return InvoiceFile(
+            invoice_id=invoice_id,
+            key=obj['Key'],
+            size=obj['Size'],
+            etag=obj.get('ETag', '').strip('"'),
+            content_hash=content_hash_from_key(obj['Key']),
+            uploaded_at=obj['LastModified'],
+        )
+
+    def _refresh_row(self, row, obj):
+        """
+        Bring `row` in line with the listed object, False when it already was
+        """
+        etag = obj.get('ETag', '').strip('"')
+        if (row.size, row.etag, row.uploaded_at) == (obj['Size'], etag, obj['LastModified']):
+            return False
+        row.size, row.etag, row.uploaded_at = obj['Size'], etag, obj['LastModified']
+        return True
+
+    def _write(self, to_create, to_update, stale):
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update)
+        self.stats['deleted'] += len(stale)
+        if self.dry_run:
+            return
+        with transaction.atomic():
+            InvoiceFile.objects.bulk_create(to_create)
+            InvoiceFile.objects.bulk_update(to_update, ['size', 'etag', 'uploaded_at'])
+            InvoiceFile.objects.filter(id__in=stale).delete()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from ivg.constant import JobStatus
+from ivg.jobs import run_job
+from ivg.models import BackgroundJob
+
+
+class Command(BaseCommand):
+    help = "Run pending background jobs in this process, e.g. ones lost when a web worker restarted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', help='Only these jobs (default: every pending job)')
+        parser.add_argument('--requeue-running', action='store_true', help='Also retry jobs stuck in running')
+
+    def handle(self, *args, **options):
+        jobs = BackgroundJob.objects.all()
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+        if options['requeue_running']:
+            jobs.filter(status=JobStatus.RUNNING.value).update(status=JobStatus.PENDING.value)
+
+        job_ids = list(jobs.filter(status=JobStatus.PENDING.value).order_by('created_at').values_list('pk', flat=True))
+        for job_id in job_ids:
+            run_job(job_id)
+            job = BackgroundJob.objects.get(pk=job_id)
+            style = self.style.SUCCESS if job.status == JobStatus.SUCCEEDED.value else self.style.ERROR
+            self.stdout.write(style(f"{job.pk} {job.kind}: {job.status} {job.error or ''}".rstrip()))
+        self.stdout.write(f"{len(job_ids)} job(s) run")
@@ -0,0 +1,71 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def object_key_field():
+    field = models.CharField(blank=True, max_length=500, null=True)
+    field.set_attributes_from_name('object_key')
+    return field
+
+
+def object_key_exists(schema_editor, model):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(cursor, model._meta.db_table)
+    return any(column.name == 'object_key' for column in columns)
+
+
+def add_object_key(apps, schema_editor):
+    # start.sh used to run makemigrations on boot, so existing databases may
+    # already have the column from a migration generated there
+    InvoiceData = apps.get_model('ivg', 'InvoiceData')
+    if not object_key_exists(schema_editor, InvoiceData):
+        schema_editor.add_field(InvoiceData, object_key_field())
+
+
+def remove_object_key(apps, schema_editor):
+    InvoiceData = apps.get_model('ivg', 'InvoiceData')
+    if object_key_exists(schema_editor, InvoiceData):
+        schema_editor.remove_field(InvoiceData, object_key_field())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0004_remove_invoicedata_file_url'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='invoicedata',
+                    name='object_key',
+                    field=models.CharField(blank=True, max_length=500, null=True),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_object_key, remove_object_key),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('key', models.CharField(max_length=500)),
+                ('size', models.BigIntegerField(default=0)),
+                ('etag', models.CharField(blank=True, default='', max_length=100)),
+                ('content_type', models.CharField(blank=True, default='', max_length=255)),
+                ('uploaded_at', models.DateTimeField()),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='ivg.invoicedata')),
+            ],
+            options={
+                'ordering': ['key'],
+                'constraints': [models.UniqueConstraint(fields=('invoice', 'key'), name='unique_invoice_file_key')],
+            },
+        ),
+    ]
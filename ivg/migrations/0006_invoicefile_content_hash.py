@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0005_invoicedata_object_key_invoicefile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoicefile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
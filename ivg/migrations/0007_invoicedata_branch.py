@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0006_invoicefile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='invoicedata',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='invoicedata',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='ivg.branches'),
+        ),
+    ]
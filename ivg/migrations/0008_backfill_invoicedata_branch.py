@@ -0,0 +1,20 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_branch(apps, schema_editor):
+    InvoiceData = apps.get_model('ivg', 'InvoiceData')
+    InvoiceUser = apps.get_model('ivg', 'InvoiceUser')
+    creator_branch = InvoiceUser.objects.filter(id=OuterRef('created_by_id')).values('branch_id')[:1]
+    InvoiceData.objects.filter(branch__isnull=True).update(branch_id=Subquery(creator_branch))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0007_invoicedata_branch'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_branch, migrations.RunPython.noop),
+    ]
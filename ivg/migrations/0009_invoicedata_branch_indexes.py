@@ -0,0 +1,21 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0008_backfill_invoicedata_branch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', '-created_at', '-id'], name='invoice_branch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'car_number', '-created_at', '-id'], name='invoice_branch_car_idx'),
+        ),
+    ]
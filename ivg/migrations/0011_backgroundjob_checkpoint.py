@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0010_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='checkpoint',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('pdf export', 'Pdf Export'), ('invoice import', 'Invoice Import')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.1.2 on 2026-10-18 20:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_rollup(apps, schema_editor):
+    InvoiceData = apps.get_model('ivg', 'InvoiceData')
+    InvoiceDailyRollup = apps.get_model('ivg', 'InvoiceDailyRollup')
+    rows = (
+        InvoiceData.objects.annotate(day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()))
+        .values('branch', 'day', 'trip')
+        .annotate(count=Count('id'), cft=Sum('cft'), wheel_sum=Sum('wheels'))
+        .order_by()
+    )
+    InvoiceDailyRollup.objects.bulk_create(
+        (
+            InvoiceDailyRollup(
+                branch_id=row['branch'], day=row['day'], trip=row['trip'],
+                invoices=row['count'], total_cft=row['cft'] or 0.0, wheels=row['wheel_sum'] or 0,
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0011_backgroundjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('day', models.DateField()),
+                ('trip', models.CharField(choices=[('first trip', 'First Trip'), ('second trip', 'Second Trip')], max_length=50)),
+                ('invoices', models.PositiveIntegerField(default=0)),
+                ('total_cft', models.FloatField(default=0)),
+                ('wheels', models.BigIntegerField(default=0)),
+                ('branch', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='ivg.branches')),
+            ],
+            options={
+                'ordering': ['day', 'trip'],
+                'constraints': [models.UniqueConstraint(fields=('branch', 'day', 'trip'), name='unique_invoice_rollup'), models.UniqueConstraint(condition=models.Q(('branch__isnull', True)), fields=('day', 'trip'), name='unique_invoice_rollup_no_branch')],
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
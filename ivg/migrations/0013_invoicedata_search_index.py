@@ -0,0 +1,61 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ('car_number', 'phone_number', 'name', 'location')
+# Same expression ivg/search.py queries with, or the planner won't use the index
+SEARCH_DOCUMENT_SQL = "lower({})".format(" || ' ' || ".join(f'"ivg_invoicedata"."{field}"' for field in SEARCH_FIELDS))
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # CONCURRENTLY: invoices keep being written while a large table is indexed
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS invoice_search_trgm_idx '
+            f'ON "ivg_invoicedata" USING gin (({SEARCH_DOCUMENT_SQL}) gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite':
+        columns = ', '.join(SEARCH_FIELDS)
+        new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+        old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+        # External content table: the index only, rows are read from ivg_invoicedata
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE ivg_invoicedata_fts USING fts5({columns}, "
+            "content='ivg_invoicedata', content_rowid='id', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER ivg_invoicedata_fts_insert AFTER INSERT ON ivg_invoicedata BEGIN "
+            f"INSERT INTO ivg_invoicedata_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER ivg_invoicedata_fts_delete AFTER DELETE ON ivg_invoicedata BEGIN "
+            f"INSERT INTO ivg_invoicedata_fts(ivg_invoicedata_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER ivg_invoicedata_fts_update AFTER UPDATE OF {columns} ON ivg_invoicedata BEGIN "
+            f"INSERT INTO ivg_invoicedata_fts(ivg_invoicedata_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO ivg_invoicedata_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+        schema_editor.execute("INSERT INTO ivg_invoicedata_fts(ivg_invoicedata_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS invoice_search_trgm_idx')
+    elif vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS ivg_invoicedata_fts_{trigger}')
+        schema_editor.execute('DROP TABLE IF EXISTS ivg_invoicedata_fts')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('ivg', '0012_invoicedailyrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
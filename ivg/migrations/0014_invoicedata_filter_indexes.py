@@ -0,0 +1,37 @@
+# Generated by Django 6.1.2 on 2026-10-18 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivg', '0013_invoicedata_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'trip', '-created_at', '-id'], name='invoice_branch_trip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'wheels', '-created_at', '-id'], name='invoice_branch_wheels_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'police_station', '-created_at', '-id'], name='invoice_branch_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'created_by', '-created_at', '-id'], name='invoice_branch_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(fields=['branch', 'cft'], name='invoice_branch_cft_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicedata',
+            index=models.Index(condition=models.Q(('object_key__isnull', True)), fields=['branch', '-created_at', '-id'], name='invoice_branch_unattached_idx'),
+        ),
+    ]
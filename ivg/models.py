@@ -1,8 +1,9 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
-from ivg.constant import PayMentStatus, PaymentMethodType, TripStatusType
+from ivg.constant import JobKind, JobStatus, PayMentStatus, PaymentMethodType, TripStatusType
 
 class Base(models.Model):
     """Base model that provides UUID primary key for all models"""
@@ -71,6 +72,9 @@ class InvoiceUser(AbstractUser):
 
 class InvoiceData(Base) :
     created_by = models.ForeignKey(InvoiceUser, on_delete=models.CASCADE)  
+    # Copy of created_by.branch so branch scoped queries skip the join through InvoiceUser.
+    # Not indexed on its own, every composite index below starts with it
+    branch = models.ForeignKey(Branches, on_delete=models.CASCADE, null=True, blank=True, db_index=False, related_name='invoices')
     trip = models.CharField(max_length=50, choices=TripStatusType.choices())
     police_station = models.CharField(max_length=160 , null=True , blank=True)
     car_number = models.CharField(max_length=150)
@@ -83,8 +87,151 @@ class InvoiceData(Base) :
     object_key = models.CharField(max_length=500, null=True, blank=True)
 
     class Meta :
-        ordering = ['-created_at' , '-updated_at']
+        # id as tie breaker keeps the order deterministic and lets one index serve
+        # both the default ordering and keyset pagination
+        ordering = ['-created_at' , '-id']
+        indexes = [
+            models.Index(fields=['branch', '-created_at', '-id'], name='invoice_branch_created_idx'),
+            models.Index(fields=['branch', 'car_number', '-created_at', '-id'], name='invoice_branch_car_idx'),
+            # List filters, see ivg/filters.py
+            models.Index(fields=['branch', 'trip', '-created_at', '-id'], name='invoice_branch_trip_idx'),
+            models.Index(fields=['branch', 'wheels', '-created_at', '-id'], name='invoice_branch_wheels_idx'),
+            models.Index(fields=['branch', 'police_station', '-created_at', '-id'], name='invoice_branch_station_idx'),
+            models.Index(fields=['branch', 'created_by', '-created_at', '-id'], name='invoice_branch_creator_idx'),
+            models.Index(fields=['branch', 'cft'], name='invoice_branch_cft_idx'),
+            # Invoices still waiting for their file, a small slice of the table
+            models.Index(
+                fields=['branch', '-created_at', '-id'],
+                condition=models.Q(object_key__isnull=True),
+                name='invoice_branch_unattached_idx',
+            ),
+        ]
+
+    # What InvoiceDailyRollup counts an invoice by (see ivg/rollups.py)
+    ROLLUP_FIELDS = ('branch_id', 'created_at', 'trip', 'cft', 'wheels')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the rollup holds for this row, a later save only touches it when these change
+        instance._rollup_values = instance.rollup_values()
+        return instance
+
+    def rollup_values(self):
+        """
+        Current ROLLUP_FIELDS, None when some are deferred
+        """
+        loaded = self.__dict__
+        if any(name not in loaded for name in self.ROLLUP_FIELDS):
+            return None
+        return tuple(loaded[name] for name in self.ROLLUP_FIELDS)
+
+    def save(self, *args, **kwargs):
+        if self.branch_id is None and self.created_by_id is not None:
+            self.branch_id = self.created_by.branch_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{str(self.name)} PICKED -- WEIGHT :- {self.cft}" 
-    
\ No newline at end of file
+    
+class InvoiceDailyRollup(Base) :
+    """
+    Invoice totals per branch, local day and trip, kept current by
+    ivg/rollups.py so reports read one row per day instead of every invoice.
+    `manage.py rebuild_invoice_rollup` recomputes it from InvoiceData.
+    """
+    branch = models.ForeignKey(Branches, on_delete=models.CASCADE, null=True, blank=True, db_index=False, related_name='daily_rollups')
+    day = models.DateField()
+    trip = models.CharField(max_length=50, choices=TripStatusType.choices())
+    invoices = models.PositiveIntegerField(default=0)
+    total_cft = models.FloatField(default=0)
+    wheels = models.BigIntegerField(default=0)
+
+    class Meta :
+        ordering = ['day', 'trip']
+        constraints = [
+            # Also the (branch, day) range index reports read through
+            models.UniqueConstraint(fields=['branch', 'day', 'trip'], name='unique_invoice_rollup'),
+            # NULLs never collide in the one above
+            models.UniqueConstraint(fields=['day', 'trip'], condition=models.Q(branch__isnull=True), name='unique_invoice_rollup_no_branch'),
+        ]
+
+    def __str__(self):
+        return f"{self.branch_id} -- {self.day} -- {self.trip} -- {self.invoices}"
+
+
+class InvoiceFile(Base) :
+    """
+    Index of the objects stored for an invoice, so listing files
+    is a DB query instead of an S3 listing
+    """
+    invoice = models.ForeignKey(InvoiceData, on_delete=models.CASCADE, related_name='files')
+    key = models.CharField(max_length=500)
+    size = models.BigIntegerField(default=0)
+    etag = models.CharField(max_length=100, blank=True, default='')
+    content_type = models.CharField(max_length=255, blank=True, default='')
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    uploaded_at = models.DateTimeField()
+
+    class Meta :
+        ordering = ['key']
+        constraints = [
+            models.UniqueConstraint(fields=['invoice', 'key'], name='unique_invoice_file_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice_id} -- {self.key}"
+
+
+class BackgroundJob(Base) :
+    """
+    Long running work (exports, imports) done off the request by ivg/jobs.py.
+    Clients poll it for progress.
+    """
+    id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True)
+    kind = models.CharField(max_length=50, choices=JobKind.choices())
+    status = models.CharField(max_length=20, choices=JobStatus.choices(), default=JobStatus.PENDING.value)
+    created_by = models.ForeignKey(InvoiceUser, on_delete=models.CASCADE, related_name='jobs')
+    branch = models.ForeignKey(Branches, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    params = models.JSONField(default=dict, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    # Whatever a job needs to pick up where it stopped, written in the same transaction as its work
+    checkpoint = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta :
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def set_progress(self, processed, total=None):
+        """
+        Single UPDATE so a poller sees progress without the job saving every field
+        """
+        self.processed = processed
+        fields = {'processed': processed, 'updated_at': timezone.now()}
+        if total is not None:
+            self.total = total
+            fields['total'] = total
+        BackgroundJob.objects.filter(pk=self.pk).update(**fields)
+
+    def __str__(self):
+        return f"{self.kind} -- {self.status}"
+
+
+class DataVersion(Base) :
+    """
+    Counter bumped in the same transaction as every write to the data it
+    covers (see ivg/versions.py), so readers can tell whether what they
+    served before is still current without reading the data itself
+    """
+    scope = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope} -- {self.version}"
@@ -0,0 +1,222 @@
+"""
+Server side invoice PDFs.
+
+The expensive parts of a WeasyPrint render that don't depend on the invoice,
+compiling the Jinja template, parsing the stylesheet and loading fonts, are
+done once per worker process and reused. Renders run in a bounded process
+pool: layout is CPU bound and holds the GIL, so it never runs on a request
+thread or the ASGI event loop.
+
+Everything the workers import is Django free, they only ever see the plain
+dict built by `invoice_context`.
+"""
+import asyncio
+import base64
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from pathlib import Path
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / 'pdf_templates'
+INVOICE_TEMPLATE = 'invoice.html'
+INVOICE_STYLESHEET = 'invoice.css'
+PDF_CONTENT_TYPE = 'application/pdf'
+
+
+class RendererBusy(Exception):
+    """
+    Every worker is busy and the pending queue is full
+    """
+
+
+def invoice_pdf_key(invoice):
+    return f"invoices/{invoice.id}/invoice-{invoice.id}.pdf"
+
+
+def invoice_context(invoice):
+    """
+    Picklable render input. Reads `branch` and `created_by`, select_related them.
+    """
+    from django.utils import timezone
+
+    created_at = timezone.localtime(invoice.created_at)
+    branch = invoice.branch
+    return {
+        'invoice_id': invoice.id,
+        'invoice_number': f"INV-{invoice.id:06d}",
+        'date': created_at.strftime('%d %b %Y'),
+        'time': created_at.strftime('%I:%M %p'),
+        'trip': invoice.get_trip_display(),
+        'police_station': invoice.police_station or '',
+        'car_number': invoice.car_number,
+        'phone_number': invoice.phone_number,
+        'name': invoice.name,
+        'location': invoice.location,
+        'wheels': invoice.wheels,
+        'cft': invoice.cft,
+        'remarks': invoice.remarks or '',
+        'branch_name': branch.name if branch else '',
+        'branch_address': (branch.address or '') if branch else '',
+        'created_by': invoice.created_by.get_full_name() or invoice.created_by.username,
+    }
+
+
+# --- worker side, cached per process ---
+
+@lru_cache(maxsize=1)
+def get_jinja_env():
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    # Templates ship with the code, no need to stat them on every render
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html']),
+        auto_reload=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_stylesheet():
+    """
+    Parsed stylesheet and the FontConfiguration its @font-face rules were loaded into
+    """
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    stylesheet = CSS(filename=str(TEMPLATE_DIR / INVOICE_STYLESHEET), font_config=font_config)
+    return stylesheet, font_config
+
+
+def qr_data_uri(data):
+    import qrcode
+    import qrcode.image.svg
+
+    # SVG keeps the QR vector and skips Pillow entirely
+    svg = qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage, border=1).to_string()
+    return 'data:image/svg+xml;base64,' + base64.b64encode(svg).decode()
+
+
+def render_invoice_html(context):
+    template = get_jinja_env().get_template(INVOICE_TEMPLATE)
+    qr_payload = f"{context['invoice_number']}|{context['car_number']}|{context['cft']}"
+    return template.render(invoice=context, qr_code=qr_data_uri(qr_payload))
+
+
+def render_invoice_pdf_bytes(context):
+    from weasyprint import HTML
+
+    stylesheet, font_config = get_stylesheet()
+    html = HTML(string=render_invoice_html(context), base_url=str(TEMPLATE_DIR))
+    buffer = io.BytesIO()
+    html.write_pdf(buffer, stylesheets=[stylesheet], font_config=font_config)
+    return buffer.getvalue()
+
+
+def warm_up():
+    """
+    Pool initializer: pay template compilation, CSS parsing and font loading
+    once when the worker starts instead of on the first request it serves
+    """
+    get_jinja_env().get_template(INVOICE_TEMPLATE)
+    get_stylesheet()
+
+
+# --- request side ---
+
+_pool = None
+_pending = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    The process pool and the semaphore bounding how many renders may be queued on it
+    """
+    global _pool, _pending
+    if _pool is None:
+        from django.conf import settings
+
+        with _pool_lock:
+            if _pool is None:
+                workers = settings.PDF_RENDER_WORKERS
+                # spawn: forking a process that already runs threads (ASGI, boto3) isn't safe
+                _pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=warm_up,
+                    max_tasks_per_child=settings.PDF_RENDER_MAX_TASKS_PER_CHILD or None,
+                )
+                _pending = threading.BoundedSemaphore(workers * settings.PDF_RENDER_QUEUE_PER_WORKER)
+    with _pool_lock:
+        return _pool, _pending
+
+
+def _discard_pool(pool):
+    """
+    Forget a broken pool (a worker was OOM killed or crashed in native code)
+    so the next render starts a fresh one. The executor has already torn
+    itself down by then, calling shutdown() from its own callback would deadlock.
+    """
+    global _pool, _pending
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pending = None, None
+
+
+def shutdown_render_pool():
+    global _pool, _pending
+    with _pool_lock:
+        pool, _pool, _pending = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def submit_render(context, block=False, render=render_invoice_pdf_bytes):
+    """
+    Queue a render, returns a concurrent.futures.Future of the PDF bytes.
+    Raises `RendererBusy` instead of queueing without bound, background
+    jobs pass `block=True` to wait for a slot instead.
+    """
+    from django.conf import settings
+
+    pool, pending = get_render_pool()
+    if pool is None:
+        raise RendererBusy()
+    if not pending.acquire(blocking=block, timeout=settings.PDF_RENDER_TIMEOUT if block else -1):
+        raise RendererBusy()
+    try:
+        future = pool.submit(render, context)
+    except BrokenProcessPool:
+        pending.release()
+        _discard_pool(pool)
+        raise
+    except BaseException:
+        pending.release()
+        raise
+
+    def done(future):
+        pending.release()
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            _discard_pool(pool)
+
+    future.add_done_callback(done)
+    return future
+
+
+def render_invoice_pdf(context, timeout=None):
+    from django.conf import settings
+
+    return submit_render(context).result(timeout or settings.PDF_RENDER_TIMEOUT)
+
+
+async def arender_invoice_pdf(context, timeout=None):
+    from django.conf import settings
+
+    future = asyncio.wrap_future(submit_render(context))
+    return await asyncio.wait_for(future, timeout or settings.PDF_RENDER_TIMEOUT)
@@ -0,0 +1,188 @@
+"""
+Bounded LRU cache of presigned URLs.
+
+Mobile clients poll the file endpoints constantly, and every poll used to
+re-sign the same objects. A signed URL stays valid until `ExpiresIn` runs
+out, so we hand back the cached one while enough of its lifetime remains and
+re-sign once it gets too close to expiry.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from ivg.storage import get_storage
+
+
+class PresignedURLCache:
+    """
+    LRU over objects, each slot holding the URLs signed for that object keyed
+    by (operation, expires_in). Keeping one URL per requested lifetime stops
+    the 5 minute view URL and the 1 hour list URL from evicting each other,
+    and grouping by object makes invalidation O(1).
+    """
+
+    def __init__(self, max_entries=10000, min_remaining=0.5, clock=time.time):
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, operation, bucket, key, expires_in):
+        now = self.clock()
+        with self._lock:
+            slot = self._entries.get((bucket, key))
+            cached = slot.get((operation, expires_in)) if slot else None
+            if cached is not None:
+                url, expires_at = cached
+                if expires_at - now >= expires_in * self.min_remaining:
+                    self._entries.move_to_end((bucket, key))
+                    self.hits += 1
+                    return url
+                del slot[(operation, expires_in)]
+            self.misses += 1
+            return None
+
+    def set(self, operation, bucket, key, expires_in, url, signed_at):
+        with self._lock:
+            slot = self._entries.setdefault((bucket, key), {})
+            # X-Amz-Date is truncated to the second, count expiry from there
+            slot[(operation, expires_in)] = (url, int(signed_at) + expires_in)
+            self._entries.move_to_end((bucket, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, bucket, key):
+        with self._lock:
+            self._entries.pop((bucket, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_presign_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PresignedURLCache(
+                    max_entries=settings.PRESIGNED_URL_CACHE_MAX_ENTRIES,
+                    min_remaining=settings.PRESIGNED_URL_CACHE_MIN_REMAINING,
+                )
+    return _cache
+
+
+def _lookup(client_method, keys, expires_in):
+    """
+    Split `keys` into URLs the cache can serve and keys that need signing,
+    along with the storage and cache to fill the misses into
+    """
+    storage = get_storage()
+    cache = get_presign_cache()
+    urls = {}
+    missing = []
+    for key in keys:
+        url = cache.get(client_method, storage.bucket, key, expires_in)
+        if url is None:
+            missing.append(key)
+        else:
+            urls[key] = url
+    return storage, cache, urls, missing
+
+
+def _fill(cache, storage, client_method, expires_in, signed, signed_at):
+    for key, url in signed.items():
+        cache.set(client_method, storage.bucket, key, expires_in, url, signed_at)
+    return signed
+
+
+def cached_presigned_url(client_method, key, expires_in):
+    """
+    Presigned URL for `key`, served from the cache while it is fresh enough
+    """
+    storage, cache, urls, missing = _lookup(client_method, [key], expires_in)
+    if missing:
+        signed_at = cache.clock()
+        url = storage.generate_presigned_url(client_method, key, expires_in=expires_in)
+        urls.update(_fill(cache, storage, client_method, expires_in, {key: url}, signed_at))
+    return urls[key]
+
+
+def cached_presigned_urls(client_method, keys, expires_in):
+    """
+    Batch version of `cached_presigned_url`, misses are signed in one pass
+    """
+    storage, cache, urls, missing = _lookup(client_method, keys, expires_in)
+    if missing:
+        signed_at = cache.clock()
+        signed = storage.generate_presigned_urls(client_method, missing, expires_in=expires_in)
+        urls.update(_fill(cache, storage, client_method, expires_in, signed, signed_at))
+    return urls
+
+
+async def acached_presigned_url(client_method, key, expires_in):
+    """
+    `cached_presigned_url` for async views, a miss is signed without blocking the event loop
+    """
+    storage, cache, urls, missing = _lookup(client_method, [key], expires_in)
+    if missing:
+        signed_at = cache.clock()
+        url = await storage.agenerate_presigned_url(client_method, key, expires_in=expires_in)
+        urls.update(_fill(cache, storage, client_method, expires_in, {key: url}, signed_at))
+    return urls[key]
+
+
+async def acached_presigned_urls(client_method, keys, expires_in):
+    storage, cache, urls, missing = _lookup(client_method, keys, expires_in)
+    if missing:
+        signed_at = cache.clock()
+        signed = await storage.agenerate_presigned_urls(client_method, missing, expires_in=expires_in)
+        urls.update(_fill(cache, storage, client_method, expires_in, signed, signed_at))
+    return urls
+
+
+def reset_presign_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting.startswith('PRESIGNED_URL_CACHE_') or setting == 'STORAGE_BACKEND':
+        reset_presign_cache()
+
+
+setting_changed.connect(_reset_on_setting_change)
+
+
+def invalidate_presigned_urls(*keys):
+    storage = get_storage()
+    cache = get_presign_cache()
+    for key in keys:
+        if key:
+            cache.invalidate(storage.bucket, key)
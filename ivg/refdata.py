@@ -0,0 +1,102 @@
+"""
+In-process cache of the small reference tables, branches and vendors.
+
+Each worker loads a table whole and serves lookups by id and slug from
+memory. The table's DataVersion row (see ivg/versions.py) says when to load
+it again: it is read at most every REFDATA_VERSION_CHECK_INTERVAL seconds,
+and a reload happens only when it changed. A save or delete in this worker
+forces the check right away (see ivg/signals.py); other workers notice the
+new version within the interval, through the database they already share.
+
+Cached instances are shared by every request of the worker, read them only.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from ivg.models import Branches, Vendors
+from ivg.versions import BRANCHES_SCOPE, VENDORS_SCOPE, version_tokens
+
+
+class Snapshot:
+    """
+    One load of a table: its rows in id order, indexed by id and slug
+    """
+    __slots__ = ('token', 'rows', 'by_id', 'by_slug')
+
+    def __init__(self, token, rows):
+        self.token = token
+        self.rows = tuple(rows)
+        self.by_id = {row.pk: row for row in self.rows}
+        self.by_slug = {row.slug: row for row in self.rows}
+
+
+class ReferenceTable:
+    """
+    A table kept in memory, reloaded when its DataVersion row changes
+    """
+
+    def __init__(self, model, scope, clock=time.monotonic):
+        self.model = model
+        self.scope = scope
+        self.clock = clock
+        self.loads = 0
+        self._snapshot = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def all(self):
+        return self.snapshot().rows
+
+    def get(self, pk):
+        """
+        Row by id, or None. A miss checks the version once more, the row may
+        have been added by another worker since the last check.
+        """
+        row = self.snapshot().by_id.get(pk)
+        if row is None and pk is not None:
+            row = self.snapshot(force=True).by_id.get(pk)
+        return row
+
+    def get_by_slug(self, slug):
+        row = self.snapshot().by_slug.get(slug)
+        if row is None and slug:
+            row = self.snapshot(force=True).by_slug.get(slug)
+        return row
+
+    def snapshot(self, force=False):
+        snapshot, checked_at = self._snapshot, self._checked_at
+        if not force and snapshot is not None and checked_at is not None \
+                and self.clock() - checked_at < settings.REFDATA_VERSION_CHECK_INTERVAL:
+            return snapshot
+        with self._lock:
+            # Read before the rows: a write committing in between only causes one more load
+            token = self.current_token()
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.token != token:
+                snapshot = Snapshot(token, self.model.objects.using(DEFAULT_DB_ALIAS).order_by('pk'))
+                self.loads += 1
+                self._snapshot = snapshot
+            self._checked_at = self.clock()
+        return snapshot
+
+    def current_token(self):
+        return version_tokens([self.scope])[0]
+
+    def invalidate(self):
+        """
+        Check the version on the next lookup
+        """
+        self._checked_at = None
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._checked_at = None
+            self.loads = 0
+
+
+branches = ReferenceTable(Branches, BRANCHES_SCOPE)
+vendors = ReferenceTable(Vendors, VENDORS_SCOPE)
@@ -0,0 +1,162 @@
+"""
+Incremental upkeep of InvoiceDailyRollup.
+
+Single invoice saves and deletes are applied from model signals (see
+ivg/signals.py) in the same transaction as the write: the row an invoice
+counted in is decremented and the one it now belongs to incremented with
+F() expressions, so concurrent writers never lose an update. bulk_create
+and queryset updates send no signals; code using them calls
+add_invoices_to_rollup() itself. rebuild_rollup() recomputes everything
+from InvoiceData when the two drift apart.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ivg.constant import TripStatusType
+from ivg.models import InvoiceDailyRollup, InvoiceData
+
+
+def rollup_key(values):
+    branch_id, created_at, trip, _, _ = values
+    return branch_id, timezone.localdate(created_at), trip
+
+
+def add_to_deltas(deltas, values, sign):
+    delta = deltas[rollup_key(values)]
+    delta[0] += sign
+    delta[1] += sign * values[3]
+    delta[2] += sign * values[4]
+
+
+def apply_rollup_deltas(deltas):
+    """
+    Add {(branch_id, day, trip): [invoices, cft, wheels]} to the rollup
+    """
+    for (branch_id, day, trip), (invoices, cft, wheels) in deltas.items():
+        if not (invoices or cft or wheels):
+            continue
+        rows = InvoiceDailyRollup.objects.filter(branch_id=branch_id, day=day, trip=trip)
+        changes = {
+            'invoices': F('invoices') + invoices,
+            'total_cft': F('total_cft') + cft,
+            'wheels': F('wheels') + wheels,
+            'updated_at': timezone.now(),
+        }
+        if rows.update(**changes):
+            if invoices < 0:
+                rows.filter(invoices=0).delete()
+            continue
+        if invoices <= 0:
+            # Nothing counted there, e.g. the rollup row went with its branch in a cascade
+            continue
+        try:
+            with transaction.atomic():
+                InvoiceDailyRollup.objects.create(
+                    branch_id=branch_id, day=day, trip=trip,
+                    invoices=invoices, total_cft=cft, wheels=wheels,
+                )
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(**changes)
+
+
+def record_invoice_change(old, new):
+    """
+    Move one invoice's contribution from `old` to `new` rollup values, either may be None
+    """
+    if old == new:
+        return
+    deltas = defaultdict(lambda: [0, 0.0, 0])
+    if old is not None:
+        add_to_deltas(deltas, old, -1)
+    if new is not None:
+        add_to_deltas(deltas, new, 1)
+    apply_rollup_deltas(deltas)
+
+
+def add_invoices_to_rollup(invoices):
+    """
+    Count freshly bulk created invoices, one upsert per (branch, day, trip)
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0])
+    for invoice in invoices:
+        add_to_deltas(deltas, invoice.rollup_values(), 1)
+    apply_rollup_deltas(deltas)
+
+
+def rollup_rows(invoices):
+    """
+    InvoiceDailyRollup rows computed from scratch for an InvoiceData queryset
+    """
+    rows = (
+        invoices.annotate(day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()))
+        .values('branch', 'day', 'trip')
+        .annotate(count=Count('id'), cft=Sum('cft'), wheel_sum=Sum('wheels'))
+        .order_by()
+    )
+    for row in rows.iterator():
+        yield InvoiceDailyRollup(
+            branch_id=row['branch'], day=row['day'], trip=row['trip'],
+            invoices=row['count'], total_cft=row['cft'] or 0.0, wheels=row['wheel_sum'] or 0,
+        )
+
+
+def rebuild_rollup(branch_id=None, batch_size=1000):
+    """
+    Replace the rollup (of one branch, or all of it) with totals recomputed
+    from InvoiceData. Returns the number of rollup rows written.
+    """
+    invoices = InvoiceData.objects.all()
+    rollups = InvoiceDailyRollup.objects.all()
+    if branch_id is not None:
+        invoices = invoices.filter(branch_id=branch_id)
+        rollups = rollups.filter(branch_id=branch_id)
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Invoice writes wait until the new totals are in, none fall between the scan and the swap
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(InvoiceData._meta.db_table)} IN SHARE MODE')
+        rollups.delete()
+        written = 0
+        batch = []
+        for rollup in rollup_rows(invoices):
+            batch.append(rollup)
+            if len(batch) >= batch_size:
+                InvoiceDailyRollup.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        InvoiceDailyRollup.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def daily_stats(branch_id, date_from, date_to, trip=None):
+    """
+    Per day totals of a branch from the rollup, one query whose cost grows
+    with the days covered, not the invoices in them
+    """
+    rollups = InvoiceDailyRollup.objects.filter(branch_id=branch_id, day__range=(date_from, date_to))
+    if trip:
+        rollups = rollups.filter(trip=trip)
+    trips = [value for value, _ in TripStatusType.choices()]
+    trip_sums = {f'trip_{i}': Sum('invoices', filter=Q(trip=value)) for i, value in enumerate(trips)}
+    rows = (
+        rollups.values('day')
+        .annotate(invoice_count=Sum('invoices'), cft=Sum('total_cft'), wheel_sum=Sum('wheels'), **trip_sums)
+        .order_by('day')
+    )
+    return [
+        {
+            'day': row['day'],
+            'invoices': row['invoice_count'],
+            'total_cft': row['cft'],
+            'wheels': row['wheel_sum'],
+            'trips': {value: row[f'trip_{i}'] or 0 for i, value in enumerate(trips)},
+        }
+        for row in rows
+    ]
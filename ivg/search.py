@@ -0,0 +1,89 @@
+"""
+Substring search over an invoice's car number, phone number, name and location.
+
+PostgreSQL: a pg_trgm GIN index over SEARCH_DOCUMENT_SQL serves the LIKE, and
+matches are ranked by word_similarity. SQLite: an FTS5 table with the trigram
+tokenizer, kept in sync with ivg_invoicedata by triggers, serves the MATCH
+and ranks with bm25. Both are created by migration 0013. Trigrams need three
+characters, shorter terms fall back to a branch scoped icontains.
+
+On SQLite, a migration that makes Django rebuild ivg_invoicedata (most
+AlterField/RemoveField) drops the sync triggers with the old table; such a
+migration has to recreate them.
+"""
+from django.db import connection
+from django.db.models import FloatField, Q, TextField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+from ivg.models import InvoiceData
+
+SEARCH_FIELDS = ('car_number', 'phone_number', 'name', 'location')
+MIN_INDEXED_LENGTH = 3
+TABLE = InvoiceData._meta.db_table
+FTS_TABLE = f'{TABLE}_fts'
+
+# Must stay identical to the expression invoice_search_trgm_idx is built on (migration 0013)
+SEARCH_DOCUMENT_SQL = "lower({})".format(" || ' ' || ".join(f'"{TABLE}"."{field}"' for field in SEARCH_FIELDS))
+
+
+def _fts_phrase(term):
+    # One quoted phrase: the trigram tokenizer then matches it as a substring
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def search_invoices(queryset, term):
+    """
+    `queryset` narrowed to invoices matching `term`, best match first
+    """
+    term = term.strip()
+    if not term:
+        return queryset
+    if len(term) < MIN_INDEXED_LENGTH:
+        matches = Q()
+        for field in SEARCH_FIELDS:
+            matches |= Q(**{f'{field}__icontains': term})
+        return queryset.filter(matches)
+
+    if connection.vendor == 'postgresql':
+        return (
+            queryset.annotate(search_document=RawSQL(SEARCH_DOCUMENT_SQL, [], output_field=TextField()))
+            .filter(search_document__contains=term.lower())
+            .annotate(search_rank=RawSQL(
+                f"word_similarity(%s, {SEARCH_DOCUMENT_SQL})", [term.lower()], output_field=FloatField()
+            ))
+            .order_by('-search_rank', '-created_at', '-id')
+        )
+
+    # A join, not a correlated rank subquery: bm25 is then worked out once per match
+    return (
+        queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'"{TABLE}"."id" = +{FTS_TABLE}.rowid', f'{FTS_TABLE} MATCH %s'],
+            params=[_fts_phrase(term)],
+            select={'search_rank': f'{FTS_TABLE}.rank'},
+        )
+        # bm25: lower is better
+        .order_by('search_rank', '-created_at', '-id')
+    )
+
+
+class InvoiceSearchFilter(BaseFilterBackend):
+    """
+    ?search=<text> on the invoice list and export. Ranked best match first
+    with page numbers; cursor pagination keeps its newest first order.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        return search_invoices(queryset, term) if term.strip() else queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Part of a car number, phone number, name or location',
+            'schema': {'type': 'string'},
+        }]
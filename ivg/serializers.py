@@ -1,14 +1,109 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from ivg.models import Branches, InvoiceData, InvoiceUser
+from ivg.constant import JobStatus, TripStatusType
+from ivg.models import BackgroundJob, Branches, InvoiceData, InvoiceUser
+from ivg.presign_cache import cached_presigned_url
+from ivg import refdata
 
 class InvoiceViewFileSerializer(serializers.Serializer):
     invoice_id = serializers.IntegerField()
+
+
+class RenderInvoicePDFSerializer(serializers.Serializer):
+    invoice_id = serializers.IntegerField()
+
+
+class InvoiceViewFilesSerializer(serializers.Serializer):
+    invoice_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_invoice_ids(self, value):
+        if len(value) > settings.INVOICE_VIEW_URL_BATCH_SIZE:
+            raise serializers.ValidationError(
+                f"At most {settings.INVOICE_VIEW_URL_BATCH_SIZE} invoices per request"
+            )
+        # Keep request order, drop repeats
+        return list(dict.fromkeys(value))
     
+class PDFExportSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    # ZIPs only, no merged PDF: see the ivg/exports.py docstring
+    format = serializers.ChoiceField(choices=['zip'], default='zip')
+    trip = serializers.ChoiceField(choices=TripStatusType.choices(), required=False)
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from must be on or before date_to")
+        return attrs
+
+
+class InvoiceDailyStatsSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    trip = serializers.ChoiceField(choices=TripStatusType.choices(), required=False)
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from must be on or before date_to")
+        return attrs
+
+
+class InvoiceListFilterSerializer(serializers.Serializer):
+    """
+    Query parameters of the invoice list and export (see ivg/filters.py)
+    """
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    trip = serializers.ChoiceField(choices=TripStatusType.choices(), required=False)
+    wheels = serializers.IntegerField(min_value=0, required=False)
+    cft_min = serializers.FloatField(required=False)
+    cft_max = serializers.FloatField(required=False)
+    police_station = serializers.CharField(max_length=160, required=False)
+    car_number = serializers.CharField(max_length=150, required=False)
+    created_by = serializers.UUIDField(required=False)
+    # Missing means either, not False
+    has_attachment = serializers.BooleanField(required=False, allow_null=True, default=None)
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from must be on or before date_to")
+        if attrs.get('cft_min') is not None and attrs.get('cft_max') is not None and attrs['cft_min'] > attrs['cft_max']:
+            raise serializers.ValidationError("cft_min must not be above cft_max")
+        return attrs
+
+
+class InvoiceImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=['csv', 'xlsx'], required=False)
+
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BackgroundJob
+        fields = [
+            'id', 'kind', 'status', 'params', 'processed', 'total', 'result',
+            'error', 'download_url', 'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != JobStatus.SUCCEEDED.value or not (obj.result or {}).get('object_key'):
+            return None
+        return cached_presigned_url('get_object', obj.result['object_key'], expires_in=settings.PDF_EXPORT_URL_EXPIRES)
+
+
 class PresignedURLSerializer(serializers.Serializer):
     filename = serializers.CharField(max_length=255)
     invoice_id = serializers.IntegerField()
+    # Hex SHA-256 of the file, enables upload deduplication
+    content_sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+
+    def validate_content_sha256(self, value):
+        return value.lower()
 
 
 class UpdateInvoiceFileSerializer(serializers.Serializer):
@@ -20,6 +115,42 @@ class ListInvoiceFilesSerializer(serializers.Serializer):
     invoice_id = serializers.IntegerField()
 
 
+class MultipartInitiateSerializer(serializers.Serializer):
+    invoice_id = serializers.IntegerField()
+    filename = serializers.CharField(max_length=255)
+    file_size = serializers.IntegerField(min_value=1, max_value=5 * 1024 ** 4)  # S3 object limit, 5 TiB
+    content_type = serializers.CharField(max_length=255, default='application/octet-stream')
+
+
+class MultipartUploadSerializer(serializers.Serializer):
+    invoice_id = serializers.IntegerField()
+    object_key = serializers.CharField(max_length=500)
+    upload_id = serializers.CharField(max_length=1024)
+
+
+class MultipartPresignPartsSerializer(MultipartUploadSerializer):
+    part_numbers = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=10000),
+        allow_empty=False,
+    )
+
+    def validate_part_numbers(self, value):
+        if len(value) > settings.MULTIPART_PRESIGN_BATCH_SIZE:
+            raise serializers.ValidationError(
+                f"At most {settings.MULTIPART_PRESIGN_BATCH_SIZE} parts can be presigned per request"
+            )
+        return sorted(set(value))
+
+
+class MultipartPartSerializer(serializers.Serializer):
+    part_number = serializers.IntegerField(min_value=1, max_value=10000)
+    etag = serializers.CharField(max_length=255)
+
+
+class MultipartCompleteSerializer(MultipartUploadSerializer):
+    parts = MultipartPartSerializer(many=True, allow_empty=False)
+
+
 class InvoiceGenerationSerializer(serializers.ModelSerializer):
     # Separate formatted fields
     created_by_name = serializers.SerializerMethodField()  # Bonus: user display
@@ -43,9 +174,29 @@ class BranchSerializer(serializers.ModelSerializer) :
     class Meta :
         model = Branches
         fields = '__all__'
+
+
+class CachedBranchField(serializers.Field):
+    """
+    A branch id serialized as BranchSerializer would, from the reference
+    data cache instead of a join
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.branch_serializer = BranchSerializer()
+
+    def get_attribute(self, instance):
+        return instance.branch_id
+
+    def to_representation(self, branch_id):
+        branch = refdata.branches.get(branch_id)
+        return None if branch is None else self.branch_serializer.to_representation(branch)
+
     
 class InvoiceUserSerializer(serializers.ModelSerializer):
-    branch = BranchSerializer(many=True)
+    branch = CachedBranchField()
     class Meta:
         model = InvoiceUser
         fields = ['id', 'branch' , 'username', 'email' , 'first_name' ,'last_name', 'user_type']  # Add more fields as needed: email, first_name, etc.
@@ -54,19 +205,55 @@ class InvoiceUserCreateSerializer(serializers.ModelSerializer) :
     class Meta :
         model = InvoiceUser
     
+class DashBoardStatsSerializer(serializers.Serializer) :
+    users = serializers.IntegerField()
+    users_by_role = serializers.DictField(child=serializers.IntegerField())
+    invoices = serializers.IntegerField()
+    total_cft = serializers.FloatField()
+    trips = serializers.DictField(child=serializers.IntegerField())
+
+class BranchDashBoardSerializer(DashBoardStatsSerializer) :
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    slug = serializers.CharField()
+    is_active = serializers.BooleanField()
+
 class UltraAdminDashBoardSerializer(serializers.Serializer) :
     total_branches = serializers.IntegerField()
+    active_branches = serializers.IntegerField()
     total_users = serializers.IntegerField()
-    
+    users_by_role = serializers.DictField(child=serializers.IntegerField())
+    total_invoices = serializers.IntegerField()
+    total_cft = serializers.FloatField()
+    trips = serializers.DictField(child=serializers.IntegerField())
+    branches = BranchDashBoardSerializer(many=True)
+    unassigned = DashBoardStatsSerializer()  # Users and invoices without a branch
+    generated_at = serializers.DateTimeField()
+
 class InvoiceDataListSerializer(serializers.ModelSerializer):
     created_by = InvoiceUserSerializer(read_only=True)  # Nested user details
+    view_url = serializers.SerializerMethodField()  # Only with ?include_view_url=true
     
     class Meta:
         model = InvoiceData
         fields = [
             'id', 'created_by', 'trip', 'police_station', 'car_number', 
             'phone_number', 'name', 'location', 'wheels', 'cft', 
-            'remarks', 'object_key', 'created_at' , 'updated_at'
+            'remarks', 'object_key', 'created_at' , 'updated_at',
+            'view_url'
         ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'view_urls' not in self.context:
+            self.fields.pop('view_url')
+        # ?fields= projection, validated by the view
+        requested = self.context.get('fields')
+        if requested:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+    def get_view_url(self, obj):
+        return self.context['view_urls'].get(obj.object_key)
+
 
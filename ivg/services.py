@@ -0,0 +1,183 @@
+import base64
+import math
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ivg.models import InvoiceFile
+from ivg.pdf import PDF_CONTENT_TYPE, arender_invoice_pdf, invoice_context, invoice_pdf_key
+from ivg.presign_cache import invalidate_presigned_urls
+from ivg.storage import ObjectNotFound, get_storage
+
+BLOB_PREFIX = 'blobs/'
+# blobs/<branch id>/sha256/..., or blobs/sha256/... from before blobs were kept per branch
+BLOB_KEY_RE = re.compile(r'^blobs/(?:\d+/)?sha256/[0-9a-f]{2}/([0-9a-f]{64})$')
+
+
+def _strip_etag(etag):
+    return (etag or '').strip('"')
+
+
+def blob_key(branch_id, content_sha256):
+    """
+    Content addressed key, the same file uploaded in a branch always lands on
+    the same object. Per branch: knowing a file's hash must not be enough to
+    attach a copy another branch uploaded.
+    """
+    return f"{BLOB_PREFIX}{branch_id}/sha256/{content_sha256[:2]}/{content_sha256}"
+
+
+def invoice_owns_key(invoice, object_key):
+    """
+    Whether `invoice` may point at `object_key`: its own prefix or its branch's blobs
+    """
+    return object_key.startswith((f"invoices/{invoice.id}/", f"blobs/{invoice.branch_id}/"))
+
+
+def content_hash_from_key(object_key):
+    match = BLOB_KEY_RE.match(object_key or '')
+    return match.group(1) if match else None
+
+
+def checksum_header(content_sha256):
+    """
+    x-amz-checksum-sha256 value for a hex digest. Signing it into the PUT URL
+    makes S3 reject any body that doesn't hash to the key it is stored under.
+    """
+    return base64.b64encode(bytes.fromhex(content_sha256)).decode()
+
+
+def _file_head(invoice_file):
+    return {
+        'ContentLength': invoice_file.size,
+        'ETag': invoice_file.etag,
+        'ContentType': invoice_file.content_type,
+        'LastModified': invoice_file.uploaded_at,
+    }
+
+
+def find_blob(branch_id, content_sha256):
+    """
+    (object key, metadata in head_object shape) of a blob the branch already
+    stored, or None
+    """
+    known = InvoiceFile.objects.filter(
+        content_hash=content_sha256, invoice__branch_id=branch_id
+    ).order_by('id').first()
+    if known is not None:
+        return known.key, _file_head(known)
+    object_key = blob_key(branch_id, content_sha256)
+    try:
+        # Uploaded but never confirmed against an invoice
+        return object_key, get_storage().head_object(object_key)
+    except ObjectNotFound:
+        return None
+
+
+async def afind_blob(branch_id, content_sha256):
+    """
+    `find_blob` for async views
+    """
+    known = await InvoiceFile.objects.filter(
+        content_hash=content_sha256, invoice__branch_id=branch_id
+    ).order_by('id').afirst()
+    if known is not None:
+        return known.key, _file_head(known)
+    object_key = blob_key(branch_id, content_sha256)
+    try:
+        return object_key, await get_storage().ahead_object(object_key)
+    except ObjectNotFound:
+        return None
+
+
+def attach_invoice_file(invoice, object_key, head=None):
+    """
+    Confirm an uploaded object, point the invoice at it and record it in the file index.
+    Raises `ObjectNotFound` when nothing was uploaded under `object_key`.
+    """
+    if head is None:
+        head = get_storage().head_object(object_key)
+
+    previous_key = invoice.object_key
+    with transaction.atomic():
+        invoice.object_key = object_key
+        invoice.save()
+        invoice_file, _ = InvoiceFile.objects.update_or_create(
+            invoice=invoice,
+            key=object_key,
+            defaults={
+                'size': head.get('ContentLength', 0),
+                'etag': _strip_etag(head.get('ETag')),
+                'content_type': head.get('ContentType', ''),
+                'content_hash': content_hash_from_key(object_key),
+                'uploaded_at': head['LastModified'],
+            },
+        )
+
+    if previous_key != object_key:
+        invalidate_presigned_urls(previous_key, object_key)
+    return invoice_file
+
+
+async def aattach_invoice_file(invoice, object_key, head=None):
+    """
+    `attach_invoice_file` for async views. The HEAD is awaited on the event
+    loop, only the short transaction runs on the thread the ORM uses.
+    """
+    if head is None:
+        head = await get_storage().ahead_object(object_key)
+    return await sync_to_async(attach_invoice_file, thread_sensitive=True)(invoice, object_key, head=head)
+
+
+
+def store_invoice_pdf(invoice, pdf):
+    """
+    Write rendered PDF bytes to the invoice's own key and attach them
+    """
+    object_key = invoice_pdf_key(invoice)
+    response = get_storage().put_object(object_key, pdf, content_type=PDF_CONTENT_TYPE)
+    # We just wrote it, no need for a HEAD round trip
+    head = {
+        'ContentLength': len(pdf),
+        'ETag': response.get('ETag'),
+        'ContentType': PDF_CONTENT_TYPE,
+        'LastModified': timezone.now(),
+    }
+    return attach_invoice_file(invoice, object_key, head=head)
+
+
+async def arender_invoice_to_storage(invoice):
+    """
+    Render `invoice` in the PDF pool and store it. Raises `RendererBusy` when the pool is saturated.
+    Reads `branch` and `created_by`, select_related them.
+    """
+    # The event loop only waits on the render, the upload and the row go through the sync thread
+    pdf = await arender_invoice_pdf(invoice_context(invoice))
+    return await sync_to_async(store_invoice_pdf, thread_sensitive=True)(invoice, pdf)
+
+# Hard S3 limits for multipart uploads
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+S3_MAX_PARTS = 10000
+MIB = 1024 * 1024
+
+
+def plan_multipart_upload(file_size):
+    """
+    Pick part size, part count and client concurrency for a file of `file_size` bytes.
+    Parts stay small (MULTIPART_PART_SIZE) so a dropped connection only costs one
+    part, and only grow when the file would otherwise need more than 10000 parts.
+    """
+    part_size = max(settings.MULTIPART_PART_SIZE, S3_MIN_PART_SIZE)
+    if math.ceil(file_size / part_size) > S3_MAX_PARTS:
+        part_size = math.ceil(file_size / S3_MAX_PARTS / MIB) * MIB
+    part_size = min(part_size, S3_MAX_PART_SIZE)
+    part_count = max(1, math.ceil(file_size / part_size))
+    return {
+        'part_size': part_size,
+        'part_count': part_count,
+        'concurrency': min(settings.MULTIPART_MAX_CONCURRENCY, part_count),
+    }
@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from ivg.authentication import invalidate_cached_user
+from ivg.dashboard import invalidate_dashboard_stats
+from ivg.models import Branches, InvoiceData, InvoiceUser, Vendors
+from ivg import refdata
+from ivg.rollups import record_invoice_change
+from ivg.versions import BRANCHES_SCOPE, USERS_SCOPE, VENDORS_SCOPE, bump_data_versions, invoices_scope, user_scope
+
+
+@receiver([post_save, post_delete], sender=Branches)
+@receiver([post_save, post_delete], sender=InvoiceUser)
+@receiver([post_save, post_delete], sender=InvoiceData)
+def dashboard_source_changed(sender, **kwargs):
+    # bulk_create and queryset updates send no signals, those paths call invalidate_dashboard_stats themselves
+    invalidate_dashboard_stats()
+
+
+@receiver([post_save, post_delete], sender=InvoiceUser)
+def authenticated_user_changed(sender, instance, update_fields=None, **kwargs):
+    # Role flags, is_active, password or branch may have changed. Branch edits
+    # reach the cached users through BRANCHES_SCOPE, see bump_branch_version.
+    invalidate_cached_user(instance.pk)
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_data_versions(user_scope(instance.pk))
+
+
+def stored_rollup_values(pk):
+    return InvoiceData.objects.filter(pk=pk).values_list(*InvoiceData.ROLLUP_FIELDS).first()
+
+
+@receiver(pre_save, sender=InvoiceData)
+def remember_invoice_rollup(sender, instance, **kwargs):
+    if getattr(instance, '_rollup_values', None) is None:
+        # New, or saved without being fully loaded first: read what the rollup counted
+        instance._rollup_values = stored_rollup_values(instance.pk) if instance.pk is not None else None
+
+
+@receiver(post_save, sender=InvoiceData)
+def bump_invoice_version(sender, instance, **kwargs):
+    # Connected before update_invoice_rollup, which replaces _rollup_values with the new ones
+    old = getattr(instance, '_rollup_values', None)
+    scopes = [invoices_scope(instance.branch_id)]
+    if old is not None:
+        # Moved to another branch, both lists changed
+        scopes.append(invoices_scope(old[0]))
+    bump_data_versions(*scopes)
+
+
+@receiver(post_save, sender=InvoiceData)
+def update_invoice_rollup(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {name.removesuffix('_id') for name in InvoiceData.ROLLUP_FIELDS} & update_fields:
+        return
+    new = instance.rollup_values() or stored_rollup_values(instance.pk)
+    record_invoice_change(instance._rollup_values, new)
+    instance._rollup_values = new
+
+
+@receiver(post_delete, sender=InvoiceData)
+def remove_invoice_from_rollup(sender, instance, **kwargs):
+    old = getattr(instance, '_rollup_values', None) or instance.rollup_values()
+    if old is not None:
+        record_invoice_change(old, None)
+
+
+@receiver(post_delete, sender=InvoiceData)
+def bump_deleted_invoice_version(sender, instance, **kwargs):
+    bump_data_versions(invoices_scope(instance.branch_id))
+
+
+@receiver([post_save, post_delete], sender=InvoiceUser)
+def bump_user_version(sender, update_fields=None, **kwargs):
+    # Invoice lists embed their creator. Logging in only stamps last_login, which they don't show
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_data_versions(USERS_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Branches)
+def bump_branch_version(sender, **kwargs):
+    bump_data_versions(BRANCHES_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Vendors)
+def bump_vendor_version(sender, **kwargs):
+    bump_data_versions(VENDORS_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Branches)
+@receiver([post_save, post_delete], sender=Vendors)
+def reference_data_changed(sender, **kwargs):
+    # Connected after the version bumps. Now for this transaction's own reads,
+    # again after commit for the worker's other threads.
+    table = refdata.branches if sender is Branches else refdata.vendors
+    table.invalidate()
+    transaction.on_commit(table.invalidate)
@@ -0,0 +1,155 @@
+"""
+Lightweight SigV4 query string presigner for S3.
+
+`generate_presigned_url` runs botocore's whole request pipeline (parameter
+validation, serialisation, endpoint rules, event hooks) for every URL. For
+the handful of operations the file views presign we only need the canonical
+request and an HMAC chain, so this module builds the exact same URL directly.
+The derived signing key only changes per (day, region, service) and is cached.
+
+Output is byte-identical to boto3 for the supported operations, see
+`python manage.py bench_presign` which checks that and times both paths.
+"""
+import hashlib
+import hmac
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+SAFE_CHARS = '-._~'
+
+# client_method -> (HTTP method, query params in botocore's serialisation order, header params)
+OPERATIONS = {
+    'get_object': ('GET', (), ()),
+    'head_object': ('HEAD', (), ()),
+    'put_object': ('PUT', (), (('ContentType', 'content-type'), ('ChecksumSHA256', 'x-amz-checksum-sha256'))),
+    'upload_part': ('PUT', (('UploadId', 'uploadId'), ('PartNumber', 'partNumber')), ()),
+}
+
+
+class UnsupportedPresign(ValueError):
+    """
+    Operation / parameter combination the native presigner doesn't handle.
+    Callers fall back to boto3 on this.
+    """
+
+
+def _encode(value):
+    if not isinstance(value, (bytes, str)):
+        value = str(value)
+    return quote(value, safe=SAFE_CHARS)
+
+
+class SigV4Presigner:
+    """
+    Presigns S3 object URLs below `object_base_url`, which is the bucket URL
+    (virtual host or path style) ending in a slash.
+    """
+
+    def __init__(self, object_base_url, access_key_id, secret_access_key, region_name,
+                 session_token=None, service_name='s3'):
+        parts = urlsplit(object_base_url)
+        self.object_base_url = object_base_url
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region_name = region_name
+        self.session_token = session_token
+        self.service_name = service_name
+        self._base_path = parts.path
+        self._host = self._host_header(parts)
+        self._signing_keys = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host_header(parts):
+        host = parts.hostname
+        if ':' in host:
+            host = f'[{host}]'
+        default_port = {'http': 80, 'https': 443}.get(parts.scheme)
+        if parts.port is not None and parts.port != default_port:
+            host = f'{host}:{parts.port}'
+        return host
+
+    def signing_key(self, datestamp):
+        key = self._signing_keys.get(datestamp)
+        if key is None:
+            k_date = hmac.new(f'AWS4{self.secret_access_key}'.encode(), datestamp.encode(), hashlib.sha256).digest()
+            k_region = hmac.new(k_date, self.region_name.encode(), hashlib.sha256).digest()
+            k_service = hmac.new(k_region, self.service_name.encode(), hashlib.sha256).digest()
+            key = hmac.new(k_service, b'aws4_request', hashlib.sha256).digest()
+            with self._lock:
+                # Only today's (and around midnight, yesterday's) key is ever useful
+                if len(self._signing_keys) > 2:
+                    self._signing_keys.clear()
+                self._signing_keys[datestamp] = key
+        return key
+
+    def presign(self, client_method, key, expires_in=3600, now=None, **params):
+        try:
+            method, query_params, header_params = OPERATIONS[client_method]
+        except KeyError:
+            raise UnsupportedPresign(client_method)
+        known = {name for name, _ in query_params} | {name for name, _ in header_params}
+        unknown = set(params) - known
+        if unknown:
+            raise UnsupportedPresign(f"{client_method}: {', '.join(sorted(unknown))}")
+
+        now = now or datetime.now(timezone.utc)
+        timestamp = now.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = timestamp[:8]
+        scope = f'{datestamp}/{self.region_name}/{self.service_name}/aws4_request'
+
+        headers = {'host': self._host}
+        for name, header in header_params:
+            if name in params:
+                headers[header] = ' '.join(str(params[name]).split())
+        signed_headers = ';'.join(sorted(headers))
+
+        query = [(wire, _encode(params[name])) for name, wire in query_params if name in params]
+        query += [
+            ('X-Amz-Algorithm', ALGORITHM),
+            ('X-Amz-Credential', _encode(f'{self.access_key_id}/{scope}')),
+            ('X-Amz-Date', timestamp),
+            ('X-Amz-Expires', str(int(expires_in))),
+            ('X-Amz-SignedHeaders', _encode(signed_headers)),
+        ]
+        if self.session_token is not None:
+            query.append(('X-Amz-Security-Token', _encode(self.session_token)))
+        query_string = '&'.join(f'{name}={value}' for name, value in query)
+
+        quoted_key = quote(key, safe='/~')
+        canonical_request = '\n'.join((
+            method,
+            self._base_path + quoted_key,
+            '&'.join(f'{name}={value}' for name, value in sorted(query)),
+            ''.join(f'{name}:{headers[name]}\n' for name in sorted(headers)),
+            signed_headers,
+            UNSIGNED_PAYLOAD,
+        ))
+        string_to_sign = '\n'.join((
+            ALGORITHM,
+            timestamp,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ))
+        signature = hmac.new(self.signing_key(datestamp), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return f'{self.object_base_url}{quoted_key}?{query_string}&X-Amz-Signature={signature}'
+
+    def presign_many(self, client_method, keys, expires_in=3600, now=None, **params):
+        """
+        Sign many keys against one timestamp, returns {key: url}
+        """
+        now = now or datetime.now(timezone.utc)
+        return {key: self.presign(client_method, key, expires_in, now=now, **params) for key in keys}
+
+    def presign_parts(self, key, upload_id, part_numbers, expires_in=3600, now=None):
+        """
+        Sign upload_part URLs of one multipart upload against one timestamp, returns {part number: url}
+        """
+        now = now or datetime.now(timezone.utc)
+        return {
+            number: self.presign('upload_part', key, expires_in, now=now, UploadId=upload_id, PartNumber=number)
+            for number in part_numbers
+        }
@@ -1,3 +1,1716 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import importlib.util
+import io
+import os
+import runpy
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import Future
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from operator import attrgetter
+from pathlib import Path
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, transaction
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ivg import db_routers, refdata
+from ivg.authentication import CachedJWTAuthentication, get_user_cache, reset_user_cache
+from ivg.constant import JobKind
+from ivg.dashboard import DASHBOARD_CACHE_KEY, compute_dashboard_stats
+from ivg.db_pool import pool_stats
+from ivg.db_routers import (
+    REPLICA_ALIAS, ReplicaHealth, ReplicaRouter, RoutingState, pin_to_primary, pinned_to_primary, replica_health
+)
+from ivg.exports import aiter_sync, escape_csv_cell, export_filename, export_invoice_pdfs, export_queryset, iter_invoice_pdfs
+from ivg.imports import _iter_xlsx_values, _parse_datetime, import_invoices, iter_xlsx_rows, parse_import_datetime, unescape_csv_cell
+from ivg.models import BackgroundJob, Branches, DataVersion, InvoiceDailyRollup, InvoiceData, InvoiceFile, InvoiceUser, Vendors
+from ivg.pdf import invoice_context, render_invoice_pdf_bytes, shutdown_render_pool
+from ivg.presign_cache import (
+    PresignedURLCache, acached_presigned_urls, cached_presigned_url, cached_presigned_urls, get_presign_cache,
+    reset_presign_cache,
+)
+from ivg.refdata import ReferenceTable
+from ivg.rollups import add_invoices_to_rollup, rebuild_rollup
+from ivg.search import FTS_TABLE
+from ivg.services import attach_invoice_file, blob_key
+from ivg.storage import S3Storage, get_storage, reset_storage
+from ivg.versions import BRANCHES_SCOPE, bump_data_versions, invoices_scope, primary_pin_scope, version_tokens
+
+try:
+    import weasyprint
+except (ImportError, OSError):  # OSError: Pango/cairo aren't installed
+    weasyprint = None
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class InvoiceListQueryTests(TestCase):
+    url = '/api/users/invoice/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        refdata.branches.all()  # Loaded once per worker, not per request
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_invoices(self, count):
+        # A different creator per row, so a missing select_related shows up as N+1
+        for i in range(count):
+            creator = InvoiceUser.objects.create(username=f"creator-{InvoiceUser.objects.count()}", branch=self.branch)
+            InvoiceData.objects.create(
+                created_by=creator, trip="first trip", car_number=f"WB-{i}",
+                phone_number="9000000000", name="Driver", location="Yard",
+                wheels=10, cft=120.5,
+            )
+
+    def test_list_query_count_is_independent_of_page_size(self):
+        self.create_invoices(5)
+        with self.assertNumQueries(3):  # ETag versions + COUNT(*) + page
+            response = self.client.get(self.url, {'page_size': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['results'][0]['created_by']['branch']['slug'], "main")
+
+        self.create_invoices(45)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'page_size': 50})
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_fields_projection_narrows_columns_and_output(self):
+        self.create_invoices(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'id,car_number,cft'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'car_number', 'cft'})
+        page_sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"car_number"', page_sql)
+        self.assertNotIn('"remarks"', page_sql)
+        self.assertNotIn('"username"', page_sql)
+
+    def test_unknown_projection_field_is_rejected(self):
+        response = self.client.get(self.url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class InvoiceKeysetPaginationTests(TestCase):
+    url = '/api/users/invoice/'
+
+    def setUp(self):
+        branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=branch)
+        refdata.branches.all()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.invoices = [
+            InvoiceData.objects.create(
+                created_by=self.user, trip="first trip", car_number=f"WB-{i}",
+                phone_number="9000000000", name="Driver", location="Yard",
+                wheels=10, cft=120.5,
+            )
+            for i in range(7)
+        ]
+        # Rows sharing a timestamp must still page without gaps or repeats
+        InvoiceData.objects.filter(id__in=[i.id for i in self.invoices[2:5]]).update(
+            created_at=self.invoices[2].created_at
+        )
+
+    def test_walks_every_row_forwards_and_backwards_without_count(self):
+        seen = []
+        pages = []
+        with self.assertNumQueries(2):  # ETag versions + page
+            response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        self.assertNotIn('count', response.data)
+        while True:
+            pages.append([row['id'] for row in response.data['results']])
+            seen += pages[-1]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(sorted(seen), sorted(i.id for i in self.invoices))
+        self.assertEqual(len(seen), len(set(seen)))
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], pages[-2])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class InvoiceSearchTests(TestCase):
+    url = '/api/users/invoice/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.howrah = [self.create(car_number=f"WB-12-{i}", location="Howrah Yard") for i in range(4)]
+        self.second_trip = self.create(car_number="WB-12-9", location="Howrah Ghat", trip="second trip")
+        self.other = self.create(car_number="OD-02-1", name="Sunil Das", location="Puri")
+        other_branch = Branches.objects.create(name="Other", slug="other")
+        outsider = InvoiceUser.objects.create(username="outsider", branch=other_branch)
+        self.create(created_by=outsider, car_number="WB-12-7", location="Howrah Yard")
+        refdata.branches.all()
+
+    def create(self, **fields):
+        fields = {
+            'created_by': self.user, 'trip': "first trip", 'phone_number': "9000000000",
+            'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 120.5, **fields,
+        }
+        return InvoiceData.objects.create(**fields)
+
+    def search(self, term, **params):
+        response = self.client.get(self.url, {'search': term, 'page_size': 50, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data['results']]
+
+    def assert_found(self, term, invoices, **params):
+        self.assertEqual(sorted(self.search(term, **params)), sorted(invoice.id for invoice in invoices))
+
+    def test_matches_substrings_in_the_branch_only(self):
+        self.assert_found("howrah", self.howrah + [self.second_trip])
+        self.assert_found("B-12-", self.howrah + [self.second_trip])
+        self.assert_found("nil da", [self.other])
+        self.assert_found("nowhere", [])
+
+    def test_uses_the_index_for_terms_of_three_characters(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search("Ghat")
+        page_sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"ivg_invoicedata"', page_sql)
+        if connection.vendor == 'postgresql':
+            self.assertIn('word_similarity', page_sql)
+        else:
+            self.assertIn(FTS_TABLE, page_sql)
+
+    def test_short_terms_fall_back_to_icontains(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assert_found("od", [self.other])
+        page_sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"ivg_invoicedata"', page_sql)
+        self.assertNotIn(FTS_TABLE, page_sql)
+        self.assertNotIn('word_similarity', page_sql)
+        self.assert_found("PU", [self.other])
+        self.assert_found("  ", self.howrah + [self.second_trip, self.other])
+
+    def test_search_with_filters(self):
+        self.assert_found("howrah", [self.second_trip], trip="second trip")
+        self.assert_found("howrah", [self.howrah[2]], car_number="WB-12-2")
+        self.assert_found("wb", [], trip="second trip", car_number="WB-12-2")
+
+    def test_search_with_cursor_pagination(self):
+        seen = []
+        response = self.client.get(self.url, {'search': "howrah", 'pagination': 'cursor', 'page_size': 2})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        # Newest first, not by rank
+        self.assertEqual(seen, [invoice.id for invoice in reversed(self.howrah + [self.second_trip])])
+
+    def test_index_follows_edits_and_deletes(self):
+        invoice = self.howrah[0]
+        invoice.location = "Sealdah Station"
+        invoice.save()
+        self.assert_found("sealdah", [invoice])
+        self.assert_found("howrah", self.howrah[1:] + [self.second_trip])
+
+        InvoiceData.objects.filter(id=self.howrah[1].id).update(name="Ramesh Kumar")
+        self.assert_found("ramesh", [self.howrah[1]])
+
+        self.howrah[2].delete()
+        self.assert_found("howrah", [self.howrah[1], self.howrah[3], self.second_trip])
+        self.assert_found("WB-12-2", [])
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class InvoiceCSVExportTests(TestCase):
+    url = '/api/users/invoice/export/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        other_branch = Branches.objects.create(name="Other", slug="other")
+        outsider = InvoiceUser.objects.create(username="outsider", branch=other_branch)
+        self.create(created_by=outsider, car_number="OD-1")
+        refdata.branches.all()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, **fields):
+        fields = {
+            'created_by': self.user, 'trip': "first trip", 'car_number': "WB-1", 'phone_number': "9000000000",
+            'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 1.5, **fields,
+        }
+        return InvoiceData.objects.create(**fields)
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        return list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_exports_what_the_list_returns(self):
+        first = self.create(car_number="WB-1", location="Howrah Yard")
+        self.create(car_number="WB-2", location="Howrah Ghat", trip="second trip")
+        self.create(car_number="WB-3", location="Puri")
+        rows = self.export()
+        self.assertEqual([row['car_number'] for row in rows], ["WB-3", "WB-2", "WB-1"])
+        self.assertEqual(rows[-1]['invoice_id'], str(first.id))
+        self.assertEqual(rows[-1]['created_by'], "officer")
+
+        self.assertEqual([row['car_number'] for row in self.export(trip="first trip")], ["WB-3", "WB-1"])
+        self.assertEqual([row['car_number'] for row in self.export(search="howrah")], ["WB-2", "WB-1"])
+        self.assertEqual([row['car_number'] for row in self.export(search="howrah", trip="first trip")], ["WB-1"])
+
+    def test_formulas_are_exported_as_text(self):
+        self.create(
+            name='=HYPERLINK("http://evil.example","click")', location="+cmd|' /C calc'!A0",
+            remarks="@SUM(1+1)", police_station="-2+3", car_number="\tWB-1", cft=-1.5,
+        )
+        row = self.export()[0]
+        self.assertEqual(row['name'], '\'=HYPERLINK("http://evil.example","click")')
+        self.assertEqual(row['location'], "'+cmd|' /C calc'!A0")
+        self.assertEqual(row['remarks'], "'@SUM(1+1)")
+        self.assertEqual(row['police_station'], "'-2+3")
+        self.assertEqual(row['car_number'], "'\tWB-1")
+        # Numbers are numbers, not text
+        self.assertEqual(row['cft'], "-1.5")
+
+    def test_escaped_cells_import_back_unchanged(self):
+        self.assertEqual(unescape_csv_cell(escape_csv_cell("=1+1")), "=1+1")
+        self.assertEqual(unescape_csv_cell(escape_csv_cell("+919000000000")), "+919000000000")
+        self.assertEqual(unescape_csv_cell("'quoted"), "'quoted")
+
+    @override_settings(INVOICE_EXPORT_CHUNK_SIZE=2)
+    def test_streams_in_chunks_under_asgi(self):
+        for i in range(30):
+            self.create(car_number=f"WB-{i:02}")
+
+        async def download():
+            client = AsyncClient()
+            response = await client.get(self.url, headers={'Authorization': f"Bearer {AccessToken.for_user(self.user)}"})
+            self.assertTrue(response.is_async)
+            return [chunk async for chunk in response.streaming_content]
+
+        with patch('ivg.exports.CSV_FLUSH_BYTES', 512):
+            chunks = async_to_sync(download)()
+        self.assertGreater(len(chunks), 2)
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual([row['car_number'] for row in rows], [f"WB-{i:02}" for i in reversed(range(30))])
+
+    def test_closing_the_stream_early_closes_the_iterator(self):
+        closed = []
+
+        def rows():
+            try:
+                yield 'a'
+                yield 'b'
+            finally:
+                closed.append(True)
+
+        async def read_one():
+            stream = aiter_sync(rows())
+            first = await anext(stream)
+            await stream.aclose()
+            return first
+
+        self.assertEqual(async_to_sync(read_one)(), 'a')
+        self.assertEqual(closed, [True])
+
+
+class InvoiceBulkCreateTests(TestCase):
+    url = '/api/users/invoice/bulk/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, **overrides):
+        return {
+            'trip': "first trip", 'car_number': "WB-1", 'phone_number': "9000000000",
+            'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 120.5, **overrides,
+        }
+
+    def post(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, data, format='json')
+
+    def test_all_rows_created(self):
+        response = self.post([self.row(), self.row(car_number="WB-2", trip="second trip")])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 0))
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual([result['index'] for result in response.data['results']], [0, 1])
+        invoices = InvoiceData.objects.filter(id__in=ids)
+        self.assertEqual(set(invoices.values_list('branch_id', 'created_by_id')), {(self.branch.id, self.user.id)})
+
+    def test_wrapped_list_is_accepted(self):
+        response = self.post({'invoices': [self.row()]})
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_invalid_rows_are_reported_by_index(self):
+        response = self.post([self.row(), self.row(wheels="many"), self.row(car_number="WB-3"), self.row(trip="third trip")])
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'created', 'error'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertIn('wheels', results[1]['errors'])
+        self.assertIn('trip', results[3]['errors'])
+        self.assertEqual(InvoiceData.objects.count(), 2)
+
+    def test_nothing_valid_is_a_bad_request(self):
+        response = self.post([self.row(cft="lots"), self.row(name="")])
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (0, 2))
+        self.assertFalse(InvoiceData.objects.exists())
+
+    @override_settings(INVOICE_BULK_MAX_ROWS=2)
+    def test_rejects_empty_and_oversized_requests(self):
+        for data in ([], {'invoices': []}, {'trip': "first trip"}, [self.row()] * 3):
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('error', response.data)
+        self.assertFalse(InvoiceData.objects.exists())
+
+    @override_settings(INVOICE_BULK_BATCH_SIZE=2)
+    def test_failed_batch_rolls_back_alone(self):
+        calls = []
+
+        def fail_second_batch(invoices):
+            calls.append(len(invoices))
+            if len(calls) == 2:
+                raise DatabaseError("disk full")
+            add_invoices_to_rollup(invoices)
+
+        with patch('ivg.views.add_invoices_to_rollup', fail_second_batch):
+            response = self.post([self.row(car_number=f"WB-{i}") for i in range(5)])
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'created', 'error', 'error', 'created'])
+        self.assertEqual(response.data['results'][2]['errors'], {'non_field_errors': ["disk full"]})
+        self.assertEqual(sorted(InvoiceData.objects.values_list('car_number', flat=True)), ["WB-0", "WB-1", "WB-4"])
+        rollup = InvoiceDailyRollup.objects.get(branch=self.branch)
+        self.assertEqual((rollup.invoices, rollup.total_cft, rollup.wheels), (3, 3 * 120.5, 30))
+
+    def test_updates_rollup_versions_and_dashboard(self):
+        cache.set(DASHBOARD_CACHE_KEY, {'stale': True})
+        before = version_tokens([invoices_scope(self.branch.id)])[0]
+        response = self.post([self.row(), self.row(trip="second trip", cft=10, wheels=6), self.row(cft=4.5)])
+        self.assertEqual(response.status_code, 201, response.data)
+
+        rollup = {
+            trip: (invoices, total_cft, wheels)
+            for trip, invoices, total_cft, wheels in InvoiceDailyRollup.objects.filter(branch=self.branch)
+            .values_list('trip', 'invoices', 'total_cft', 'wheels')
+        }
+        self.assertEqual(rollup, {"first trip": (2, 125.0, 20), "second trip": (1, 10.0, 6)})
+        self.assertNotEqual(version_tokens([invoices_scope(self.branch.id)])[0], before)
+        self.assertIsNone(cache.get(DASHBOARD_CACHE_KEY))
+
+
+class InvoiceRollupTests(TestCase):
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.other_branch = Branches.objects.create(name="Other", slug="other")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+
+    def create(self, **fields):
+        fields = {
+            'created_by': self.user, 'branch': self.branch, 'trip': "first trip", 'car_number': "WB-1",
+            'phone_number': "9000000000", 'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 20.5, **fields,
+        }
+        return InvoiceData.objects.create(**fields)
+
+    def rollup(self):
+        return sorted(InvoiceDailyRollup.objects.values_list('branch_id', 'day', 'trip', 'invoices', 'total_cft', 'wheels'))
+
+    def assert_matches_rebuild(self):
+        incremental = self.rollup()
+        rebuild_rollup()
+        self.assertEqual(incremental, self.rollup())
+        return incremental
+
+    def test_create(self):
+        self.create()
+        self.create(trip="second trip", cft=4.5, wheels=6)
+        self.create(branch=self.other_branch)
+        self.assertEqual(len(self.assert_matches_rebuild()), 3)
+
+    def test_updates_move_the_invoice_between_rows(self):
+        invoice = self.create()
+        self.create()
+        yesterday = timezone.now() - timedelta(days=1)
+        for field, value in [
+            ('trip', "second trip"), ('cft', 99.5), ('wheels', 4),
+            ('created_at', yesterday), ('branch', self.other_branch),
+        ]:
+            setattr(invoice, field, value)
+            invoice.save()
+            with self.subTest(field=field):
+                self.assert_matches_rebuild()
+
+    def test_save_of_a_partially_loaded_invoice(self):
+        invoice = self.create()
+        partial = InvoiceData.objects.only('id', 'cft').get(pk=invoice.pk)
+        partial.cft = 1.5
+        partial.save()
+        partial = InvoiceData.objects.only('id').get(pk=invoice.pk)
+        partial.trip = "second trip"
+        partial.save(update_fields=['trip'])
+        self.assertEqual(self.assert_matches_rebuild()[0][2:], ("second trip", 1, 1.5, 10))
+
+    def test_delete(self):
+        kept, deleted = self.create(), self.create(cft=5.0)
+        gone = self.create(trip="second trip")
+        deleted.delete()
+        InvoiceData.objects.filter(pk=gone.pk).delete()
+        self.assertEqual(self.assert_matches_rebuild(), [
+            (self.branch.id, timezone.localdate(kept.created_at), "first trip", 1, 20.5, 10),
+        ])
+
+    def test_bulk_create(self):
+        self.create()
+        invoices = InvoiceData.objects.bulk_create([
+            InvoiceData(
+                created_by=self.user, branch=branch, trip=trip, car_number="WB-2", phone_number="9000000000",
+                name="Driver", location="Yard", wheels=6, cft=2.5,
+            )
+            for branch in (self.branch, self.other_branch) for trip in ("first trip", "second trip")
+        ])
+        add_invoices_to_rollup(invoices)
+        self.assertEqual(len(self.assert_matches_rebuild()), 4)
+
+
+def xlsx_cell(ref, kind, value):
+    if kind == 'inlineStr':
+        return f'<c r="{ref}" t="inlineStr"><is><t>{value}</t></is></c>'
+    kind = f' t="{kind}"' if kind else ''
+    return f'<c r="{ref}"{kind}><v>{value}</v></c>'
+
+
+def make_xlsx(sheet_rows, shared_strings=()):
+    """
+    Minimal workbook: `sheet_rows` are lists of (reference, type, value) cells
+    """
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    rel_ns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    rows = ''.join(
+        f'<row r="{number}">' + ''.join(xlsx_cell(*cell) for cell in cells) + '</row>'
+        for number, cells in enumerate(sheet_rows, 1)
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('xl/workbook.xml', f'<workbook {ns} {rel_ns}><sheets><sheet name="Invoices" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="worksheets/data.xml"/></Relationships>'
+        ))
+        archive.writestr('xl/sharedStrings.xml', f'<sst {ns}>' + ''.join(shared_strings) + '</sst>')
+        archive.writestr('xl/worksheets/data.xml', f'<worksheet {ns}><sheetData>{rows}</sheetData></worksheet>')
+    buffer.seek(0)
+    return buffer
+
+
+class InvoiceImportParsingTests(SimpleTestCase):
+    def test_xlsx_values_resolve_shared_strings_and_sparse_cells(self):
+        workbook = make_xlsx(
+            [
+                [('A1', 's', 0), ('B1', 's', 1), ('D1', 'inlineStr', 'wheels')],
+                [('A2', 's', 2), ('D2', None, 10)],
+                [('C3', 'n', '12.5')],
+            ],
+            shared_strings=[
+                '<si><t>trip</t></si>',
+                '<si><r><t>car</t></r><r><t>_number</t></r><rPh><t>hint</t></rPh></si>',
+                '<si><t>first trip</t></si>',
+            ],
+        )
+        with zipfile.ZipFile(workbook) as archive:
+            values = list(_iter_xlsx_values(archive))
+        self.assertEqual(values, [
+            ['trip', 'car_number', '', 'wheels'],
+            ['first trip', '', '', '10'],
+            ['', '', '12.5'],
+        ])
+
+    def test_xlsx_rows_keep_known_columns(self):
+        workbook = make_xlsx([
+            [('A1', 'inlineStr', 'Vehicle No'), ('B1', 'inlineStr', 'Date'), ('C1', 'inlineStr', 'Colour')],
+            [('A2', 'inlineStr', 'WB-1'), ('B2', None, '45292'), ('C2', 'inlineStr', 'red')],
+            [],
+            [('A4', 'inlineStr', 'WB-2')],
+        ])
+        self.assertEqual(list(iter_xlsx_rows(workbook)), [
+            (1, {'car_number': 'WB-1', 'created_at': '45292'}),
+            (3, {'car_number': 'WB-2'}),
+        ])
+
+    def test_excel_serial_dates_only_for_xlsx(self):
+        self.assertEqual(_parse_datetime('45292', excel_serials=True), datetime(2024, 1, 1))
+        self.assertEqual(_parse_datetime('45292.5', excel_serials=True), datetime(2024, 1, 1, 12))
+        self.assertIsNone(_parse_datetime('45292'))
+        self.assertIsNone(_parse_datetime('2024'))
+        with self.assertRaises(ValidationError):
+            parse_import_datetime('2024')
+
+    def test_text_dates(self):
+        for value, expected in [
+            ('2024-01-31', datetime(2024, 1, 31)),
+            ('2024-01-31 08:15', datetime(2024, 1, 31, 8, 15)),
+            ('31/01/2024', datetime(2024, 1, 31)),
+            ('31-01-2024 08:15', datetime(2024, 1, 31, 8, 15)),
+            ('31.01.2024', datetime(2024, 1, 31)),
+        ]:
+            self.assertEqual(_parse_datetime(value), expected, value)
+            self.assertEqual(_parse_datetime(value, excel_serials=True), expected, value)
+        self.assertIsNone(_parse_datetime('31/02/2024'))
+        self.assertIsNone(_parse_datetime('soon'))
+
+
+@override_settings(INVOICE_IMPORT_BATCH_SIZE=2)
+class InvoiceImportResumeTests(TestCase):
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        lines = ["trip,car_number,phone_number,name,location,wheels,cft,date"]
+        lines += [f"First Trip,WB-{i},9000000000,Driver,Yard,10,1.5,0{i + 1}/01/2024" for i in range(5)]
+        lines.insert(3, "first trip,WB-X,9000000000,Driver,Yard,ten,1.5,")
+        path = Path(tempfile.mkdtemp()) / 'invoices.csv'
+        path.write_text("\n".join(lines) + "\n")
+        self.addCleanup(shutil.rmtree, path.parent)
+        self.job = BackgroundJob.objects.create(
+            kind=JobKind.INVOICE_IMPORT.value, created_by=self.user, branch=self.branch,
+            params={'format': 'csv', 'path': str(path)},
+        )
+
+    def test_resumes_after_a_failed_batch(self):
+        calls = []
+
+        def fail_second_batch(invoices):
+            calls.append(len(invoices))
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            add_invoices_to_rollup(invoices)
+
+        with patch('ivg.imports.add_invoices_to_rollup', fail_second_batch), self.assertRaises(DatabaseError):
+            import_invoices(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.checkpoint, {'row': 2, 'created': 2, 'failed': 0, 'errors': []})
+        self.assertEqual(self.job.processed, 2)
+        self.assertEqual(InvoiceData.objects.count(), 2)
+
+        result = import_invoices(self.job)
+        self.assertEqual((result['rows'], result['created'], result['failed']), (6, 5, 1))
+        self.assertEqual([error['row'] for error in result['errors']], [3])
+        self.assertEqual(
+            sorted(InvoiceData.objects.values_list('car_number', flat=True)),
+            ["WB-0", "WB-1", "WB-2", "WB-3", "WB-4"],
+        )
+        self.assertEqual(InvoiceDailyRollup.objects.filter(branch=self.branch).count(), 5)
+        self.assertEqual(
+            timezone.localdate(InvoiceData.objects.get(car_number="WB-4").created_at),
+            date(2024, 1, 5),
+        )
+
+
+@override_settings(STORAGE_BACKEND='local')
+class ImportInvoicesAPITests(TestCase):
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_client_filename_stays_out_of_the_object_key(self):
+        upload = io.BytesIO(b"trip,car_number\n")
+        upload.name = "../../march 2024 (final).csv"
+        response = self.client.post('/api/users/invoice/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+
+        job = BackgroundJob.objects.get(id=response.data['id'])
+        self.assertRegex(job.params['object_key'], rf'^imports/{self.branch.id}/[0-9a-f]{{32}}\.csv$')
+        self.assertEqual(job.params['filename'], "march 2024 (final).csv")
+        self.assertEqual(get_storage().read_object(job.params['object_key']), b"trip,car_number\n")
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class ReferenceTableTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.table = ReferenceTable(Branches, BRANCHES_SCOPE, clock=lambda: self.now)
+        self.main = Branches.objects.create(name="Main", slug="main")
+        refdata.branches.clear()
+        refdata.vendors.clear()
+        self.addCleanup(refdata.branches.clear)
+        self.addCleanup(refdata.vendors.clear)
+
+    def add_in_another_worker(self, **fields):
+        # bulk_create sends no signals: this worker only learns of it from the version row
+        branch, = Branches.objects.bulk_create([Branches(**fields)])
+        bump_data_versions(BRANCHES_SCOPE)
+        return branch
+
+    def test_lookups_by_id_and_slug(self):
+        self.assertEqual(self.table.all(), (self.main,))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.table.get(self.main.pk).slug, "main")
+            self.assertEqual(self.table.get_by_slug("main").pk, self.main.pk)
+
+    def test_reloads_only_when_the_version_changes(self):
+        self.table.all()
+        self.now += 61
+        with self.assertNumQueries(1):  # Version only, nothing changed
+            self.table.all()
+        self.assertEqual(self.table.loads, 1)
+
+        self.add_in_another_worker(name="North", slug="north")
+        self.now += 61
+        with self.assertNumQueries(2):
+            self.assertEqual([branch.slug for branch in self.table.all()], ["main", "north"])
+        self.assertEqual(self.table.loads, 2)
+
+    def test_other_workers_changes_show_within_the_interval(self):
+        self.table.all()
+        north = self.add_in_another_worker(name="North", slug="north")
+        self.now += 59
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.table.all()), 1)
+        self.now += 1
+        self.assertEqual(len(self.table.all()), 2)
+        self.assertEqual(self.table.get(north.pk).name, "North")
+
+    def test_misses_check_the_version_again(self):
+        self.table.all()
+        north = self.add_in_another_worker(name="North", slug="north")
+        self.assertEqual(self.table.get(north.pk).pk, north.pk)
+        south = self.add_in_another_worker(name="South", slug="south")
+        self.assertEqual(self.table.get_by_slug("south").pk, south.pk)
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.table.get_by_slug("west"))
+
+    def test_saves_and_deletes_in_this_worker_show_at_once(self):
+        self.assertEqual(len(refdata.branches.all()), 1)
+        north = Branches.objects.create(name="North", slug="north")
+        self.assertEqual([branch.slug for branch in refdata.branches.all()], ["main", "north"])
+        north.name = "North Yard"
+        north.save()
+        self.assertEqual(refdata.branches.get_by_slug("north").name, "North Yard")
+        north.delete()
+        self.assertEqual([branch.slug for branch in refdata.branches.all()], ["main"])
+
+    def test_vendors(self):
+        self.assertEqual(refdata.vendors.all(), ())
+        vendor = Vendors.objects.create(name="Sand Co", slug="sand-co")
+        self.assertEqual(refdata.vendors.get_by_slug("sand-co").pk, vendor.pk)
+        self.assertEqual(refdata.vendors.get(vendor.pk).name, "Sand Co")
+        vendor.delete()
+        self.assertIsNone(refdata.vendors.get(vendor.pk))
+
+    def test_rebuild_rollup_command_finds_the_branch_by_slug(self):
+        out = io.StringIO()
+        call_command('rebuild_invoice_rollup', branch="main", stdout=out)
+        self.assertIn("rollup rows written", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('rebuild_invoice_rollup', branch="nowhere", stdout=out)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        reset_user_cache()
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.user.set_password("old-password")
+        self.user.save()
+        self.token = str(AccessToken.for_user(self.user))
+
+    def authenticate(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+    def change_in_another_worker(self, change):
+        """
+        Run `change`, then put back this worker's cached entry: only the
+        version bump in the database tells the cache the user changed
+        """
+        user_cache = get_user_cache()
+        entry = user_cache._entries[str(self.user.pk)]
+        change()
+        user_cache._entries[str(self.user.pk)] = entry
+
+    def test_repeat_requests_only_check_versions(self):
+        self.authenticate()
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        self.assertEqual(user.branch.slug, "main")
+
+    def test_deactivation_is_seen_on_the_next_request(self):
+        self.authenticate()
+
+        def deactivate():
+            self.user.is_active = False
+            self.user.save()
+
+        self.change_in_another_worker(deactivate)
+        with self.assertRaises(AuthenticationFailed) as raised:
+            self.authenticate()
+        self.assertEqual(raised.exception.detail['code'], 'user_inactive')
+
+    def test_password_change_is_seen_on_the_next_request(self):
+        self.authenticate()
+
+        def change_password():
+            self.user.set_password("new-password")
+            self.user.save()
+
+        self.change_in_another_worker(change_password)
+        self.assertTrue(self.authenticate().check_password("new-password"))
+
+    def test_branch_move_and_branch_edit_are_seen(self):
+        self.authenticate()
+        other = Branches.objects.create(name="Other", slug="other")
+
+        def move():
+            self.user.branch = other
+            self.user.save()
+
+        self.change_in_another_worker(move)
+        self.assertEqual(self.authenticate().branch.slug, "other")
+
+        def rename():
+            other.name = "Renamed"
+            other.save()
+
+        self.change_in_another_worker(rename)
+        self.assertEqual(self.authenticate().branch.name, "Renamed")
+
+    def test_logging_in_keeps_other_workers_cached(self):
+        self.authenticate()
+        self.change_in_another_worker(lambda: self.user.save(update_fields=['last_login']))
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+
+@override_settings(STORAGE_BACKEND='local')
+class InvoiceFileDeduplicationTests(TestCase):
+    presign_url = '/api/users/get-presigned-url/'
+    attach_url = '/api/users/update-invoice-file/'
+    body = b'%PDF-1.7 scanned invoice'
+
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.content_sha256 = hashlib.sha256(self.body).hexdigest()
+        self.main, self.mine, self.client = self.branch_with_invoice("main")
+        self.other, self.theirs, self.other_client = self.branch_with_invoice("other")
+
+    def branch_with_invoice(self, slug):
+        branch = Branches.objects.create(name=slug.title(), slug=slug)
+        user = InvoiceUser.objects.create(username=f"{slug}-officer", branch=branch)
+        invoice = InvoiceData.objects.create(
+            created_by=user, branch=branch, trip="first trip", car_number="WB-1",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=120.5,
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        return branch, invoice, client
+
+    def upload(self, client, invoice):
+        response = client.post(self.presign_url, {
+            'invoice_id': invoice.id, 'filename': "scan.pdf", 'content_sha256': self.content_sha256,
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def attach(self, client, invoice, object_key):
+        return client.post(self.attach_url, {'invoice_id': invoice.id, 'object_key': object_key}, format='json')
+
+    def test_identical_files_are_shared_within_a_branch(self):
+        upload = self.upload(self.client, self.mine)
+        self.assertEqual(upload['object_key'], blob_key(self.main.id, self.content_sha256))
+        get_storage().put_object(upload['object_key'], self.body)
+        self.assertEqual(self.attach(self.client, self.mine, upload['object_key']).status_code, 200)
+
+        second = InvoiceData.objects.create(
+            created_by=self.mine.created_by, branch=self.main, trip="first trip", car_number="WB-2",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+        )
+        again = self.upload(self.client, second)
+        self.assertTrue(again['deduplicated'])
+        self.assertEqual(again['object_key'], upload['object_key'])
+        self.assertEqual(InvoiceFile.objects.get(invoice=second).content_hash, self.content_sha256)
+
+    def test_hash_alone_does_not_reach_another_branchs_blob(self):
+        upload = self.upload(self.client, self.mine)
+        get_storage().put_object(upload['object_key'], self.body)
+        self.attach(self.client, self.mine, upload['object_key'])
+
+        theirs = self.upload(self.other_client, self.theirs)
+        self.assertFalse(theirs['deduplicated'])
+        self.assertEqual(theirs['object_key'], blob_key(self.other.id, self.content_sha256))
+        self.assertIsNotNone(theirs['presigned_url'])
+
+        for object_key in (upload['object_key'], f"invoices/{self.mine.id}/scan.pdf"):
+            response = self.attach(self.other_client, self.theirs, object_key)
+            self.assertEqual(response.status_code, 400, object_key)
+        self.assertFalse(InvoiceFile.objects.filter(invoice=self.theirs).exists())
+        self.theirs.refresh_from_db()
+        self.assertIsNone(self.theirs.object_key)
+
+    def test_keys_indexed_in_the_branch_stay_usable(self):
+        legacy_key = f"blobs/sha256/{self.content_sha256[:2]}/{self.content_sha256}"
+        get_storage().put_object(legacy_key, self.body)
+        attach_invoice_file(self.mine, legacy_key)
+        upload = self.upload(self.client, self.mine)
+        self.assertEqual((upload['object_key'], upload['deduplicated']), (legacy_key, True))
+        self.assertEqual(self.attach(self.client, self.mine, legacy_key).status_code, 200)
+        self.assertEqual(self.attach(self.other_client, self.theirs, legacy_key).status_code, 400)
+
+
+@override_settings(STORAGE_BACKEND='local', PDF_EXPORT_CONCURRENCY=2)
+class InvoicePDFExportTests(TestCase):
+    url = '/api/users/invoice/pdf-export/'
+
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.invoices = [
+            InvoiceData.objects.create(
+                created_by=self.user, branch=self.branch, trip="first trip", car_number=f"WB {i}",
+                phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+            )
+            for i in range(5)
+        ]
+        # One uploaded PDF, one whose upload has gone missing from the bucket
+        self.uploaded, self.missing = self.invoices[1], self.invoices[3]
+        for invoice in (self.uploaded, self.missing):
+            invoice.object_key = f"invoices/{invoice.id}/scan.pdf"
+            invoice.save()
+        get_storage().put_object(self.uploaded.object_key, b'%PDF uploaded')
+
+        self.rendered = []
+
+        def fake_render(invoice_id, block=False):
+            # Stands in for the WeasyPrint pool
+            self.rendered.append(invoice_id)
+            future = Future()
+            future.set_result(b'%%PDF rendered %d' % invoice_id)
+            return future
+
+        for target, replacement in [('ivg.exports.submit_render', fake_render), ('ivg.exports.invoice_context', attrgetter('id'))]:
+            patcher = patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_export(self, **data):
+        with patch('ivg.views.enqueue_job'):
+            response = self.client.post(self.url, {'date_from': str(timezone.localdate()), 'date_to': str(timezone.localdate()), **data}, format='json')
+        return response
+
+    def test_iter_invoice_pdfs_keeps_order_and_falls_back_to_rendering(self):
+        results = list(iter_invoice_pdfs(export_queryset(self.branch.id, {
+            'date_from': str(timezone.localdate()), 'date_to': str(timezone.localdate()),
+        }), window=2))
+        self.assertEqual([invoice.id for invoice, _, _ in results], [invoice.id for invoice in self.invoices])
+        by_id = {invoice.id: (pdf, source) for invoice, pdf, source in results}
+        self.assertEqual(by_id[self.uploaded.id], (b'%PDF uploaded', 'fetched'))
+        self.assertEqual(by_id[self.missing.id], (b'%%PDF rendered %d' % self.missing.id, 'rendered'))
+        self.assertEqual(sorted(self.rendered), sorted(invoice.id for invoice in self.invoices if invoice is not self.uploaded))
+
+    def test_export_job_writes_a_zip(self):
+        response = self.start_export()
+        self.assertEqual(response.status_code, 202, response.data)
+        job = BackgroundJob.objects.get(pk=response.data['id'])
+
+        result = export_invoice_pdfs(job)
+        self.assertEqual((result['count'], result['fetched'], result['rendered']), (5, 1, 4))
+        self.assertEqual(result['object_key'], f"exports/{self.branch.id}/{job.pk}.zip")
+        body = get_storage().read_object(result['object_key'])
+        self.assertEqual(result['size'], len(body))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            names = archive.namelist()
+            self.assertEqual(names, [export_filename(invoice) for invoice in self.invoices])
+            self.assertEqual(names[0], f"INV-{self.invoices[0].id:06d}-wb-0.pdf")
+            self.assertEqual(archive.read(export_filename(self.uploaded)), b'%PDF uploaded')
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.total), (5, 5))
+
+    def test_merged_pdf_is_not_offered(self):
+        response = self.start_export(format='pdf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('format', response.data)
+
+        job = BackgroundJob.objects.create(
+            kind=JobKind.PDF_EXPORT.value, created_by=self.user, branch=self.branch,
+            params={'date_from': str(timezone.localdate()), 'date_to': str(timezone.localdate()), 'format': 'pdf'},
+        )
+        with self.assertRaisesMessage(ValueError, "export a ZIP instead"):
+            export_invoice_pdfs(job)
+
+    def test_empty_range_fails_the_job(self):
+        response = self.start_export(date_from="2000-01-01", date_to="2000-01-31")
+        job = BackgroundJob.objects.get(pk=response.data['id'])
+        with self.assertRaisesMessage(ValueError, "No invoices"):
+            export_invoice_pdfs(job)
+
+
+@override_settings(REFDATA_VERSION_CHECK_INTERVAL=60)
+class ConditionalListTests(TestCase):
+    url = '/api/users/invoice/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.invoice = self.create_invoice()
+        refdata.branches.all()
+
+    def create_invoice(self, **overrides):
+        return InvoiceData.objects.create(**{
+            'created_by': self.user, 'branch': self.branch, 'trip': "first trip", 'car_number': "WB-1",
+            'phone_number': "9000000000", 'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 1.5,
+            **overrides,
+        })
+
+    def etag(self, client=None, **params):
+        response = (client or self.client).get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_matching_if_none_match_gets_a_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertLessEqual({'Authorization', 'Accept'}, set(response['Vary'].split(', ')))
+
+        with self.assertNumQueries(1):  # The version rows only
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Authorization', response['Vary'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_the_query(self):
+        self.assertNotEqual(self.etag(), self.etag(search="WB-1"))
+        self.assertEqual(self.etag(search="WB-1"), self.etag(search="WB-1"))
+
+    def test_etag_changes_after_every_kind_of_write(self):
+        def bulk():
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'{self.url}bulk/', [{
+                    'trip': "first trip", 'car_number': "WB-3", 'phone_number': "9000000000",
+                    'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 1.5,
+                }], format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+
+        def update():
+            self.invoice.remarks = "checked"
+            self.invoice.save()
+
+        def import_rows():
+            path = Path(tempfile.mkdtemp()) / 'invoices.csv'
+            self.addCleanup(shutil.rmtree, path.parent)
+            path.write_text("trip,car_number,phone_number,name,location,wheels,cft\nfirst trip,WB-4,9000000000,Driver,Yard,10,1.5\n")
+            job = BackgroundJob.objects.create(
+                kind=JobKind.INVOICE_IMPORT.value, created_by=self.user, branch=self.branch,
+                params={'format': 'csv', 'path': str(path)},
+            )
+            self.assertEqual(import_invoices(job)['created'], 1)
+
+        writes = [
+            ('create', lambda: self.create_invoice(car_number="WB-2")),
+            ('update', update),
+            ('delete', lambda: InvoiceData.objects.get(car_number="WB-2").delete()),
+            ('bulk', bulk),
+            ('import', import_rows),
+        ]
+        for name, write in writes:
+            before = self.etag()
+            write()
+            self.assertNotEqual(self.etag(), before, name)
+
+    def test_etag_is_scoped_to_the_branch(self):
+        other_branch = Branches.objects.create(name="Other", slug="other")
+        outsider = InvoiceUser.objects.create(username="outsider", branch=other_branch)
+        other_client = APIClient()
+        other_client.force_authenticate(outsider)
+        same_branch = APIClient()
+        same_branch.force_authenticate(InvoiceUser.objects.create(username="colleague", branch=self.branch))
+
+        mine, theirs = self.etag(), self.etag(other_client)
+        self.assertNotEqual(mine, theirs)
+        response = other_client.get(self.url, HTTP_IF_NONE_MATCH=mine)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+        # A write in the other branch leaves this branch's invoices alone
+        mine = self.etag(same_branch)
+        InvoiceData.objects.create(
+            created_by=outsider, branch=other_branch, trip="first trip", car_number="WB-9",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+        )
+        self.assertEqual(self.etag(same_branch), mine)
+        self.assertNotEqual(self.etag(other_client), theirs)
+
+
+def load_settings(**environ):
+    """
+    Run the settings module against `environ`, returns its globals
+    """
+    environ.setdefault('DATABASE_ENGINE', 'django.db.backends.postgresql')
+    path = Path(settings.BASE_DIR) / 'invoice_generator' / 'settings.py'
+    with patch.dict(os.environ, environ), redirect_stdout(io.StringIO()):
+        return runpy.run_path(str(path))
+
+
+class DatabasePoolTests(TestCase):
+    @skipIf(importlib.util.find_spec('psycopg_pool') is None, "psycopg[pool] is not installed")
+    def test_pool_options_come_from_the_environment(self):
+        loaded = load_settings(
+            DATABASE_POOL_MIN_SIZE='3', DATABASE_POOL_MAX_SIZE='7', DATABASE_POOL_TIMEOUT='2.5',
+            DATABASE_POOL_MAX_LIFETIME='600', DATABASE_POOL_MAX_IDLE='60', DATABASE_CONN_MAX_AGE='60',
+            DATABASE_REPLICA_HOST='replica.internal', DATABASE_REPLICA_CONNECT_TIMEOUT='1',
+        )
+        default, replica = loaded['DATABASES']['default'], loaded['DATABASES']['replica']
+        pool = default['OPTIONS']['pool']
+        self.assertEqual(
+            (pool['min_size'], pool['max_size'], pool['timeout'], pool['max_lifetime'], pool['max_idle']),
+            (3, 7, 2.5, 600.0, 60.0),
+        )
+        self.assertTrue(callable(pool['check']))
+        self.assertEqual(default['CONN_MAX_AGE'], 0)
+        self.assertEqual(replica['OPTIONS']['pool']['timeout'], 1)
+        self.assertEqual(replica['OPTIONS']['pool']['max_size'], 7)
+
+    @skipIf(importlib.util.find_spec('psycopg_pool') is not None, "psycopg[pool] is installed")
+    def test_missing_pool_package(self):
+        loaded = load_settings(DATABASE_POOL='', DATABASE_CONN_MAX_AGE='60')
+        self.assertNotIn('OPTIONS', loaded['DATABASES']['default'])
+        self.assertEqual(loaded['DATABASES']['default']['CONN_MAX_AGE'], 60)
+        with self.assertRaises(ImproperlyConfigured):
+            load_settings(DATABASE_POOL='1')
+
+    def test_pool_turned_off(self):
+        loaded = load_settings(DATABASE_POOL='0', DATABASE_CONN_MAX_AGE='60')
+        self.assertFalse(loaded['DATABASE_POOL'])
+        self.assertNotIn('OPTIONS', loaded['DATABASES']['default'])
+        self.assertEqual(loaded['DATABASES']['default']['CONN_MAX_AGE'], 60)
+
+    @skipIf(connection.vendor != 'sqlite', "Needs the SQLite test settings")
+    def test_stats_of_a_backend_without_a_pool(self):
+        stats = pool_stats()
+        self.assertEqual(stats['default'], {
+            'vendor': 'sqlite', 'pooled': False,
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+        })
+
+        admin = InvoiceUser.objects.create(username="admin", is_ultraadmin=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.get('/api/users/db-pool/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['default']['pooled'])
+
+
+class DashboardStatsTests(TestCase):
+    url = '/api/users/dashboard/ultradmin/stats/'
+
+    def setUp(self):
+        cache.delete(DASHBOARD_CACHE_KEY)
+        self.addCleanup(cache.delete, DASHBOARD_CACHE_KEY)
+        self.main = Branches.objects.create(name="Main", slug="main")
+        self.other = Branches.objects.create(name="Other", slug="other", is_active=False)
+        self.officer = InvoiceUser.objects.create(username="officer", branch=self.main, is_coofficer=True)
+        InvoiceUser.objects.create(username="driver", branch=self.other)
+        for trip, cft in [("first trip", 1.5), ("first trip", 2.0), ("second trip", 4.0)]:
+            self.create_invoice(trip=trip, cft=cft)
+        admin = InvoiceUser.objects.create(username="admin", is_ultraadmin=True)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def create_invoice(self, **overrides):
+        return InvoiceData.objects.create(**{
+            'created_by': self.officer, 'branch': self.main, 'trip': "first trip", 'car_number': "WB-1",
+            'phone_number': "9000000000", 'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 1.5,
+            **overrides,
+        })
+
+    def get_stats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_invoice_totals_come_from_the_rollup(self):
+        with self.assertNumQueries(3), CaptureQueriesContext(connection) as queries:
+            compute_dashboard_stats()  # Branches, users per branch, rollup per branch
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertIn('ivg_invoicedailyrollup', statements[2])
+        self.assertFalse(any('ivg_invoicedata' in sql for sql in statements))
+
+        stats = self.get_stats()
+
+        self.assertEqual((stats['total_branches'], stats['active_branches']), (2, 1))
+        self.assertEqual((stats['total_users'], stats['users_by_role']['coofficer']), (2, 1))
+        self.assertEqual((stats['total_invoices'], stats['total_cft']), (3, 7.5))
+        self.assertEqual(stats['trips'], {"first trip": 2, "second trip": 1})
+        main = next(branch for branch in stats['branches'] if branch['slug'] == "main")
+        self.assertEqual((main['invoices'], main['trips']["second trip"]), (3, 1))
+
+    @override_settings(DASHBOARD_CACHE_TTL=60)
+    def test_cached_for_the_ttl(self):
+        with patch('django.core.cache.backends.base.time') as set_clock, \
+                patch('django.core.cache.backends.locmem.time') as get_clock:
+            set_clock.time.return_value = get_clock.time.return_value = 1000
+            first = self.get_stats()
+            get_clock.time.return_value = 1059
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get_stats(), first)
+            get_clock.time.return_value = 1061
+            with CaptureQueriesContext(connection) as queries:
+                self.get_stats()
+        self.assertTrue(any('ivg_invoicedailyrollup' in query['sql'] for query in queries.captured_queries))
+
+    def test_invalidated_only_after_commit(self):
+        self.get_stats()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_invoice(cft=10.0)
+        self.assertIsNotNone(cache.get(DASHBOARD_CACHE_KEY))
+        self.assertEqual(self.get_stats()['total_invoices'], 3)
+
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(DASHBOARD_CACHE_KEY))
+        self.assertEqual(self.get_stats()['total_invoices'], 4)
+
+    def test_rolled_back_write_keeps_the_cache(self):
+        self.get_stats()
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                self.create_invoice()
+                raise DatabaseError("rolled back")
+        self.assertIsNotNone(cache.get(DASHBOARD_CACHE_KEY))
+
+
+@override_settings(STORAGE_BACKEND='local', INVOICE_VIEW_URL_BATCH_SIZE=5)
+class InvoiceFileURLTests(TestCase):
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        reset_presign_cache()
+        self.addCleanup(reset_presign_cache)
+        self.storage = get_storage()
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.other_branch = Branches.objects.create(name="Other", slug="other")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_invoice(self, branch=None, object_key=None):
+        invoice = InvoiceData.objects.create(
+            created_by=self.user, branch=branch or self.branch, trip="first trip", car_number="WB-1",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+        )
+        if object_key:
+            self.storage.put_object(object_key.format(id=invoice.id), b'%PDF')
+            attach_invoice_file(invoice, object_key.format(id=invoice.id))
+        return invoice
+
+    def test_list_files_reads_the_index(self):
+        invoice = self.create_invoice(object_key="invoices/{id}/scan.pdf")
+        self.storage.put_object(f"invoices/{invoice.id}/back.pdf", b'%PDF-back')
+        attach_invoice_file(invoice, f"invoices/{invoice.id}/back.pdf")
+        self.create_invoice(object_key="invoices/{id}/scan.pdf")
+
+        with patch.object(self.storage, 'list_objects', side_effect=AssertionError("listed the bucket")):
+            response = self.client.post('/api/users/list-invoice-files/', {'invoice_id': invoice.id}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        files = response.data['files']
+        self.assertEqual([file['key'] for file in files], [f"invoices/{invoice.id}/back.pdf", f"invoices/{invoice.id}/scan.pdf"])
+        self.assertEqual([file['size'] for file in files], [9, 4])
+        self.assertIn(f"invoices/{invoice.id}/back.pdf", files[0]['presigned_url'])
+
+    def test_list_files_of_another_branch(self):
+        theirs = self.create_invoice(branch=self.other_branch, object_key="invoices/{id}/scan.pdf")
+        response = self.client.post('/api/users/list-invoice-files/', {'invoice_id': theirs.id}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('files', response.data)
+
+    def test_view_files_reports_each_invoice(self):
+        with_file = self.create_invoice(object_key="invoices/{id}/scan.pdf")
+        without_file = self.create_invoice()
+        theirs = self.create_invoice(branch=self.other_branch, object_key="invoices/{id}/scan.pdf")
+        missing = theirs.id + 100
+
+        ids = [missing, with_file.id, theirs.id, without_file.id]
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/users/invoice/view-files/', {'invoice_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([file['invoice_id'] for file in response.data['files']], [with_file.id])
+        self.assertIn(f"invoices/{with_file.id}/scan.pdf", response.data['files'][0]['view_url'])
+        self.assertEqual(response.data['no_file'], [without_file.id])
+        # Another branch's invoice looks the same as one that doesn't exist
+        self.assertEqual(response.data['not_found'], [missing, theirs.id])
+
+    def test_view_files_batch_size(self):
+        response = self.client.post('/api/users/invoice/view-files/', {'invoice_ids': list(range(1, 7))}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(STORAGE_BACKEND='local')
+class ReconcileInvoiceFilesTests(TestCase):
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.storage = get_storage()
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.first, self.second, self.third = [
+            InvoiceData.objects.create(
+                created_by=self.user, branch=self.branch, trip=f"trip {n}", car_number="WB-1",
+                phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+            )
+            for n in range(3)
+        ]
+
+    def index(self, invoice, key, size=1):
+        return InvoiceFile.objects.create(invoice=invoice, key=key, size=size, uploaded_at=timezone.now())
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_invoice_files', *args, stdout=out)
+        return out.getvalue()
+
+    def test_reconciles_invoice_and_blob_prefixes(self):
+        content_hash = hashlib.sha256(b"scan").hexdigest()
+        shared_blob = blob_key(self.branch.id, content_hash)
+        gone_blob = blob_key(self.branch.id, hashlib.sha256(b"gone").hexdigest())
+        orphan_blob = blob_key(self.branch.id, hashlib.sha256(b"orphan").hexdigest())
+        for key in (f"invoices/{self.first.id}/scan.pdf", f"invoices/{self.first.id}/extra.pdf", shared_blob, orphan_blob):
+            self.storage.put_object(key, b"scan")
+        attach_invoice_file(self.first, f"invoices/{self.first.id}/scan.pdf")
+        InvoiceData.objects.filter(id=self.second.id).update(object_key=shared_blob)
+        stale = [
+            self.index(self.first, f"invoices/{self.first.id}/gone.pdf"),
+            self.index(self.third, f"invoices/{self.third.id}/gone.pdf"),
+            self.index(self.third, gone_blob),
+        ]
+        outdated = self.index(self.third, shared_blob, size=99)
+
+        output = self.reconcile('--dry-run')
+        self.assertIn("[dry run] seen: 4, created: 2, updated: 1, deleted: 3, skipped: 1", output)
+        self.assertEqual(InvoiceFile.objects.count(), 5)
+
+        self.reconcile('--batch-size', '1')
+        self.assertEqual(
+            set(InvoiceFile.objects.values_list('invoice_id', 'key')),
+            {
+                (self.first.id, f"invoices/{self.first.id}/scan.pdf"),
+                (self.first.id, f"invoices/{self.first.id}/extra.pdf"),
+                (self.second.id, shared_blob),
+                (self.third.id, shared_blob),
+            },
+        )
+        self.assertEqual(InvoiceFile.objects.get(invoice=self.second).content_hash, content_hash)
+        outdated.refresh_from_db()
+        self.assertEqual(outdated.size, 4)
+        self.assertFalse(InvoiceFile.objects.filter(id__in=[row.id for row in stale]).exists())
+
+        self.assertIn("created: 0, updated: 0, deleted: 0", self.reconcile())
+
+    def test_prefix_limits_the_run(self):
+        self.index(self.first, f"invoices/{self.first.id}/gone.pdf")
+        missing_blob = self.index(self.first, blob_key(self.branch.id, "0" * 64))
+
+        self.reconcile('--prefix', 'invoices/')
+        self.assertEqual(list(InvoiceFile.objects.all()), [missing_blob])
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class PresignedURLCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = PresignedURLCache(max_entries=2, min_remaining=0.5, clock=self.clock)
+
+    def test_served_until_min_remaining_then_resigned(self):
+        self.cache.set('get_object', "bucket", "a.pdf", 300, "url-1", self.clock())
+        self.clock.now += 150
+        self.assertEqual(self.cache.get('get_object', "bucket", "a.pdf", 300), "url-1")
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get('get_object', "bucket", "a.pdf", 300))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_least_recently_used_object_is_evicted(self):
+        for key in ("a.pdf", "b.pdf"):
+            self.cache.set('get_object', "bucket", key, 300, f"url-{key}", self.clock())
+        self.cache.get('get_object', "bucket", "a.pdf", 300)
+        self.cache.set('get_object', "bucket", "c.pdf", 300, "url-c.pdf", self.clock())
+
+        self.assertIsNone(self.cache.get('get_object', "bucket", "b.pdf", 300))
+        self.assertEqual(self.cache.get('get_object', "bucket", "a.pdf", 300), "url-a.pdf")
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_operation_and_lifetime_get_their_own_slots(self):
+        self.cache.set('get_object', "bucket", "a.pdf", 300, "view", self.clock())
+        self.cache.set('get_object', "bucket", "a.pdf", 3600, "list", self.clock())
+        self.cache.set('put_object', "bucket", "a.pdf", 300, "upload", self.clock())
+
+        self.assertEqual(self.cache.get('get_object', "bucket", "a.pdf", 300), "view")
+        self.assertEqual(self.cache.get('get_object', "bucket", "a.pdf", 3600), "list")
+        self.assertEqual(self.cache.get('put_object', "bucket", "a.pdf", 300), "upload")
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+
+@override_settings(STORAGE_BACKEND='local')
+class CachedPresignedURLTests(TestCase):
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        reset_presign_cache()
+        self.addCleanup(reset_presign_cache)
+        self.clock = FakeClock()
+        get_presign_cache().clock = self.clock
+        self.storage = get_storage()
+
+    def test_resigns_once_min_remaining_has_passed(self):
+        with patch.object(self.storage, 'generate_presigned_url', wraps=self.storage.generate_presigned_url) as sign:
+            cached_presigned_url('get_object', "a.pdf", expires_in=300)
+            self.clock.now += 100
+            cached_presigned_url('get_object', "a.pdf", expires_in=300)
+            self.assertEqual(sign.call_count, 1)
+            self.clock.now += 100
+            cached_presigned_url('get_object', "a.pdf", expires_in=300)
+            self.assertEqual(sign.call_count, 2)
+
+    def test_batch_signs_only_the_misses(self):
+        cached_presigned_url('get_object', "a.pdf", expires_in=300)
+        with patch.object(self.storage, 'generate_presigned_urls', wraps=self.storage.generate_presigned_urls) as sign:
+            urls = cached_presigned_urls('get_object', ["a.pdf", "b.pdf"], expires_in=300)
+            sign.assert_called_once_with('get_object', ["b.pdf"], expires_in=300)
+            self.assertEqual(set(urls), {"a.pdf", "b.pdf"})
+            self.assertEqual(async_to_sync(acached_presigned_urls)('get_object', ["a.pdf", "b.pdf"], 300), urls)
+            self.assertEqual(sign.call_count, 1)
+
+    def test_attach_invalidates_the_old_and_new_keys(self):
+        branch = Branches.objects.create(name="Main", slug="main")
+        user = InvoiceUser.objects.create(username="officer", branch=branch)
+        invoice = InvoiceData.objects.create(
+            created_by=user, branch=branch, trip="first trip", car_number="WB-1",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+        )
+        for key in ("invoices/old.pdf", "invoices/new.pdf"):
+            self.storage.put_object(key, b'%PDF', 'application/pdf')
+        attach_invoice_file(invoice, "invoices/old.pdf")
+        cached_presigned_url('get_object', "invoices/old.pdf", expires_in=300)
+        cached_presigned_url('get_object', "invoices/new.pdf", expires_in=300)
+
+        attach_invoice_file(invoice, "invoices/new.pdf")
+
+        presign_cache = get_presign_cache()
+        for key in ("invoices/old.pdf", "invoices/new.pdf"):
+            self.assertIsNone(presign_cache.get('get_object', self.storage.bucket, key, 300), key)
+
+
+@override_settings(STORAGE_BACKEND='local', MULTIPART_PART_SIZE=5 * 1024 * 1024, MULTIPART_PRESIGN_BATCH_SIZE=2)
+class MultipartUploadTests(TestCase):
+    def setUp(self):
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        self.invoice = InvoiceData.objects.create(
+            created_by=self.user, branch=self.branch, trip="first trip", car_number="WB-1",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=1.5,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, action, **data):
+        return self.client.post(f'/api/users/multipart/{action}/', {'invoice_id': self.invoice.id, **data}, format='json')
+
+    def initiate(self, file_size=12 * 1024 * 1024):
+        response = self.post('initiate', filename="scan.pdf", file_size=file_size, content_type="application/pdf")
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_initiate_plans_parts_and_signs_the_first_batch(self):
+        upload = self.initiate()
+        self.assertEqual(upload['object_key'], f"invoices/{self.invoice.id}/scan.pdf")
+        self.assertEqual((upload['part_size'], upload['part_count']), (5 * 1024 * 1024, 3))
+        self.assertEqual([part['part_number'] for part in upload['parts']], [1, 2])
+        self.assertIn('X-Local-Method=upload_part', upload['parts'][1]['url'])
+        self.assertIn(f"UploadId={upload['upload_id']}", upload['parts'][1]['url'])
+        self.assertIn('PartNumber=2', upload['parts'][1]['url'])
+
+    def test_presign_parts(self):
+        upload = self.initiate()
+        response = self.post('presign-parts', object_key=upload['object_key'], upload_id=upload['upload_id'], part_numbers=[3, 1])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([part['part_number'] for part in response.data['parts']], [1, 3])
+        self.assertIn('PartNumber=3', response.data['parts'][1]['url'])
+
+        response = self.post('presign-parts', object_key=upload['object_key'], upload_id=upload['upload_id'], part_numbers=[2, 2])
+        self.assertEqual([part['part_number'] for part in response.data['parts']], [2])
+
+        response = self.post('presign-parts', object_key=upload['object_key'], upload_id=upload['upload_id'], part_numbers=[1, 2, 3])
+        self.assertEqual(response.status_code, 400)
+
+    def test_complete_with_parts_out_of_order(self):
+        upload = self.initiate()
+        storage = get_storage()
+        bodies = {1: b'a' * 10, 2: b'b' * 10, 3: b'c' * 3}
+        etags = {
+            number: storage.upload_part(upload['object_key'], upload['upload_id'], number, body)['ETag']
+            for number, body in bodies.items()
+        }
+        parts = [{'part_number': number, 'etag': etags[number]} for number in (3, 1, 2)]
+        response = self.post('complete', object_key=upload['object_key'], upload_id=upload['upload_id'], parts=parts)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(storage.read_object(upload['object_key']), b'a' * 10 + b'b' * 10 + b'ccc')
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.object_key, upload['object_key'])
+        self.assertEqual(InvoiceFile.objects.get(invoice=self.invoice, key=upload['object_key']).size, 23)
+
+    def test_complete_with_a_missing_part(self):
+        upload = self.initiate()
+        etag = get_storage().upload_part(upload['object_key'], upload['upload_id'], 1, b'a')['ETag']
+        parts = [{'part_number': 1, 'etag': etag}, {'part_number': 2, 'etag': '"nope"'}]
+        response = self.post('complete', object_key=upload['object_key'], upload_id=upload['upload_id'], parts=parts)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(InvoiceFile.objects.exists())
+
+    def test_abort(self):
+        upload = self.initiate()
+        response = self.post('abort', object_key=upload['object_key'], upload_id="unknown")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown upload", response.data['error'])
+
+        response = self.post('abort', object_key=upload['object_key'], upload_id=upload['upload_id'])
+        self.assertEqual(response.status_code, 200, response.data)
+        response = self.post('complete', object_key=upload['object_key'], upload_id=upload['upload_id'], parts=[{'part_number': 1, 'etag': 'x'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_keys_outside_the_invoice_and_other_branches_are_refused(self):
+        upload = self.initiate()
+        for action in ('presign-parts', 'abort'):
+            data = {'object_key': "invoices/999/scan.pdf", 'upload_id': upload['upload_id'], 'part_numbers': [1]}
+            self.assertEqual(self.post(action, **data).status_code, 404, action)
+
+        other_branch = Branches.objects.create(name="Other", slug="other")
+        outsider = InvoiceUser.objects.create(username="outsider", branch=other_branch)
+        self.client.force_authenticate(outsider)
+        response = self.post('initiate', filename="scan.pdf", file_size=1024)
+        self.assertEqual(response.status_code, 404)
+        response = self.post('abort', object_key=upload['object_key'], upload_id=upload['upload_id'])
+        self.assertEqual(response.status_code, 404)
+
+    def test_s3_signs_a_batch_of_parts_against_one_timestamp(self):
+        storage = S3Storage('bucket', 'us-east-1', 'AKIDEXAMPLE', 'secret')
+        now = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        urls = storage.presigner.presign_parts("invoices/1/scan.pdf", "up-1", [1, 2], expires_in=60, now=now)
+        self.assertEqual(urls[2], storage.presigner.presign(
+            'upload_part', "invoices/1/scan.pdf", 60, now=now, UploadId="up-1", PartNumber=2
+        ))
+        self.assertEqual(set(storage.generate_presigned_part_urls("invoices/1/scan.pdf", "up-1", [1, 2])), {1, 2})
+
+
+@skipIf(weasyprint is None, "WeasyPrint or its system libraries are not installed")
+@override_settings(STORAGE_BACKEND='local', PDF_RENDER_WORKERS=1)
+class InvoicePDFRenderTests(TestCase):
+    url = '/api/users/invoice/render-pdf/'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_render_pool()
+        super().tearDownClass()
+
+    def setUp(self):
+        branch = Branches.objects.create(name="Main", slug="main", address="1 Yard Road")
+        self.user = InvoiceUser.objects.create(username="officer", branch=branch)
+        self.invoice = InvoiceData.objects.create(
+            created_by=self.user, branch=branch, trip="first trip", car_number="WB-1",
+            phone_number="9000000000", name="Driver", location="Yard", wheels=10, cft=120.5,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_renders_in_process(self):
+        pdf = render_invoice_pdf_bytes(invoice_context(self.invoice))
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+
+    def test_view_renders_in_the_pool_and_stores_the_pdf(self):
+        response = self.client.post(self.url, {'invoice_id': self.invoice.id}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertTrue(get_storage().read_object(response.data['object_key']).startswith(b'%PDF-'))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.object_key, response.data['object_key'])
+
+
+class S3StorageAsyncTests(SimpleTestCase):
+    def setUp(self):
+        self.storage = S3Storage('bucket', 'us-east-1', 'AKIDEXAMPLE', 'secret')
+
+    def test_each_loop_gets_its_own_client_closed_with_the_loop(self):
+        async def use_client():
+            client = await self.storage.get_async_client()
+            self.assertIs(await self.storage.get_async_client(), client)
+            return client
+
+        first = asyncio.run(use_client())
+        second = asyncio.run(use_client())
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
+        self.assertEqual(len(self.storage._async_clients), 0)
+
+    def test_aclose_closes_the_running_loops_client(self):
+        async def close_early():
+            client = await self.storage.get_async_client()
+            await self.storage.aclose()
+            self.assertTrue(client.is_closed)
+            self.assertIsNot(await self.storage.get_async_client(), client)
+
+        asyncio.run(close_early())
+
+    def test_presigns_without_blocking_the_loop(self):
+        url = self.storage.generate_presigned_url('get_object', 'invoices/1/a.pdf', expires_in=300)
+        signed = asyncio.run(self.storage.agenerate_presigned_url('get_object', 'invoices/1/a.pdf', expires_in=300))
+        self.assertEqual(signed.split('X-Amz-Date=')[0], url.split('X-Amz-Date=')[0])
+        self.assertIn('X-Amz-Signature=', signed)
+
+
+@override_settings(
+    DATABASE_ROUTERS=['ivg.db_routers.ReplicaRouter'],
+    MIDDLEWARE=[*settings.MIDDLEWARE, 'ivg.db_routers.ReplicaRoutingMiddleware'],
+    REPLICA_STICKY_SECONDS=5,
+    REFDATA_VERSION_CHECK_INTERVAL=60,
+)
+class ReplicaRoutingTests(TestCase):
+    url = '/api/users/invoice/'
+
+    def setUp(self):
+        self.branch = Branches.objects.create(name="Main", slug="main")
+        self.user = InvoiceUser.objects.create(username="officer", branch=self.branch)
+        refdata.branches.all()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def route_reads(self):
+        state = RoutingState()
+        state.replica_reads = True
+        token = db_routers._routing_state.set(state)
+        self.addCleanup(db_routers._routing_state.reset, token)
+        return state
+
+    def test_pin_is_kept_in_the_database(self):
+        other = InvoiceUser.objects.create(username="other", branch=self.branch)
+        pin_to_primary(self.user.pk)
+        # What another worker reads: the DataVersion row, nothing held in this process
+        self.assertTrue(DataVersion.objects.filter(scope=primary_pin_scope(self.user.pk)).exists())
+        self.assertTrue(pinned_to_primary(self.user.pk))
+        self.assertFalse(pinned_to_primary(other.pk))
+
+        DataVersion.objects.filter(scope=primary_pin_scope(self.user.pk)).update(
+            updated_at=timezone.now() - timedelta(seconds=6)
+        )
+        self.assertFalse(pinned_to_primary(self.user.pk))
+        pin_to_primary(self.user.pk)
+        self.assertTrue(pinned_to_primary(self.user.pk))
+
+    def test_a_write_pins_the_users_next_reads(self):
+        self.assertFalse(pinned_to_primary(self.user.pk))
+        with patch.object(replica_health, 'is_healthy', return_value=False):
+            self.client.get(self.url)
+        self.assertFalse(pinned_to_primary(self.user.pk))
+
+        response = self.client.post(self.url, {
+            'trip': "first trip", 'car_number': "WB-1", 'phone_number': "9000000000",
+            'name': "Driver", 'location': "Yard", 'wheels': 10, 'cft': 1.5,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(pinned_to_primary(self.user.pk))
+
+        # Pinned: the list never asks for the replica, whatever its health
+        with patch.object(replica_health, 'is_healthy', return_value=True) as is_healthy:
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 1)
+        is_healthy.assert_not_called()
+
+    def test_reads_go_to_the_replica_outside_transactions(self):
+        router = ReplicaRouter()
+        self.route_reads()
+        with patch.object(replica_health, 'is_healthy', return_value=True):
+            # TestCase wraps each test in atomic(), leave it for the check
+            with patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(InvoiceData), REPLICA_ALIAS)
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(InvoiceData), DEFAULT_DB_ALIAS)
+
+    def test_after_a_write_the_request_stays_on_the_primary(self):
+        router = ReplicaRouter()
+        state = self.route_reads()
+        with patch.object(replica_health, 'is_healthy', return_value=True), \
+                patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(router.db_for_write(InvoiceData), DEFAULT_DB_ALIAS)
+            self.assertTrue(state.wrote)
+            self.assertEqual(router.db_for_read(InvoiceData), DEFAULT_DB_ALIAS)
+
+    @override_settings(REPLICA_HEALTH_CHECK_INTERVAL=10)
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        now = [100.0]
+        health = ReplicaHealth(clock=lambda: now[0])
+        router = ReplicaRouter()
+        self.route_reads()
+        with patch.object(db_routers, 'replica_health', health), \
+                patch.object(connection, 'in_atomic_block', False), \
+                patch.object(health, 'check', return_value=False) as check:
+            self.assertEqual(router.db_for_read(InvoiceData), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(InvoiceData), DEFAULT_DB_ALIAS)
+            self.assertEqual(check.call_count, 1)  # Cached for the interval
+
+            check.return_value = True
+            now[0] += 5
+            self.assertEqual(router.db_for_read(InvoiceData), DEFAULT_DB_ALIAS)
+            now[0] += 6
+            self.assertEqual(router.db_for_read(InvoiceData), REPLICA_ALIAS)
+            self.assertEqual(check.call_count, 2)
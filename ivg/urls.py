@@ -1,10 +1,11 @@
 
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from .views import BranchViewSet, HealthCheckViewSet, InvoiceCreationViewSet, UserManagementViewSet, GetPresignedURLAPIView, UpdateInvoiceFileAPIView, ListInvoiceFilesAPIView, GetInvoiceViewURLAPIView
+from .views import BranchViewSet, HealthCheckViewSet, InvoiceCreationViewSet, UserManagementViewSet, UltraAdminDashBoardViewSet, GetPresignedURLAPIView, UpdateInvoiceFileAPIView, ListInvoiceFilesAPIView, GetInvoiceViewURLAPIView, GetInvoiceViewURLsAPIView, PresignCacheStatsAPIView, DatabasePoolStatsAPIView, InitiateMultipartUploadAPIView, PresignMultipartPartsAPIView, CompleteMultipartUploadAPIView, AbortMultipartUploadAPIView, RenderInvoicePDFAPIView, PDFExportAPIView, BackgroundJobAPIView, ImportInvoicesAPIView, RetryBackgroundJobAPIView, InvoiceDailyStatsAPIView
 
 router = DefaultRouter()
 router.register("invoice" , InvoiceCreationViewSet , basename='invoice')
+router.register("dashboard" , UltraAdminDashBoardViewSet , basename='dashboard')
 
 branch_router = DefaultRouter()
 branch_router.register("" , BranchViewSet , basename='branch')
@@ -19,6 +20,19 @@ urlpatterns = [
     path('update-invoice-file/', UpdateInvoiceFileAPIView.as_view(), name='update_invoice_file'),
     path('list-invoice-files/', ListInvoiceFilesAPIView.as_view(), name='list_invoice_files'),
      path('invoice/view-file/', GetInvoiceViewURLAPIView.as_view(), name='invoice_view_file'),
+    path('invoice/view-files/', GetInvoiceViewURLsAPIView.as_view(), name='invoice_view_files'),
+    path('invoice/render-pdf/', RenderInvoicePDFAPIView.as_view(), name='invoice_render_pdf'),
+    path('invoice/pdf-export/', PDFExportAPIView.as_view(), name='invoice_pdf_export'),
+    path('invoice/daily-stats/', InvoiceDailyStatsAPIView.as_view(), name='invoice_daily_stats'),
+    path('invoice/import/', ImportInvoicesAPIView.as_view(), name='invoice_import'),
+    path('jobs/<uuid:job_id>/', BackgroundJobAPIView.as_view(), name='background_job'),
+    path('jobs/<uuid:job_id>/retry/', RetryBackgroundJobAPIView.as_view(), name='background_job_retry'),
+    path('presign-cache/stats/', PresignCacheStatsAPIView.as_view(), name='presign_cache_stats'),
+    path('db-pool/stats/', DatabasePoolStatsAPIView.as_view(), name='db_pool_stats'),
+    path('multipart/initiate/', InitiateMultipartUploadAPIView.as_view(), name='multipart_initiate'),
+    path('multipart/presign-parts/', PresignMultipartPartsAPIView.as_view(), name='multipart_presign_parts'),
+    path('multipart/complete/', CompleteMultipartUploadAPIView.as_view(), name='multipart_complete'),
+    path('multipart/abort/', AbortMultipartUploadAPIView.as_view(), name='multipart_abort'),
     path('' , include(router.urls))
 
 ]
\ No newline at end of file
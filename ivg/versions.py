@@ -0,0 +1,120 @@
+"""
+Data version counters and conditional GET for the list endpoints.
+
+Every write to a scope's data bumps its DataVersion row in the same
+transaction: model signals cover single saves and deletes (ivg/signals.py),
+the bulk_create paths call bump_data_versions() themselves. A list's ETag
+hashes the versions of the scopes it reads together with the query string
+and response format, so a client sending back the current ETag in
+If-None-Match gets a 304 after one small query, without the list query or
+serialization.
+"""
+import functools
+import hashlib
+import json
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from ivg.models import DataVersion
+
+BRANCHES_SCOPE = 'branches'
+USERS_SCOPE = 'users'
+VENDORS_SCOPE = 'vendors'
+
+
+def invoices_scope(branch_id):
+    return f'invoices:{branch_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def primary_pin_scope(user_id):
+    # Bumped after a user's requests that wrote, its updated_at is the last write (see ivg/db_routers.py)
+    return f'primary-pin:{user_id}'
+
+
+def bump_data_versions(*scopes):
+    """
+    Increment each scope's version, creating its row on first use
+    """
+    # Sorted: concurrent writers lock the rows in the same order
+    for scope in sorted(set(scopes)):
+        rows = DataVersion.objects.filter(scope=scope)
+        changes = {'version': F('version') + 1, 'updated_at': timezone.now()}
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(scope=scope, version=1)
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(**changes)
+
+
+def data_versions(scopes):
+    """
+    Current version of each scope, 0 for one never written
+    """
+    versions = dict(DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    return [versions.get(scope, 0) for scope in scopes]
+
+
+def version_tokens(scopes):
+    """
+    (version, updated_at) of each scope, None for one never written, read
+    from the primary. updated_at as well: a row deleted and created again
+    restarts at version 1.
+    """
+    rows = DataVersion.objects.using(DEFAULT_DB_ALIAS).filter(scope__in=scopes)
+    tokens = {scope: (version, updated_at) for scope, version, updated_at in rows.values_list('scope', 'version', 'updated_at')}
+    return tuple(tokens.get(scope) for scope in scopes)
+
+
+def etag_matches(etag, if_none_match):
+    # Weak comparison, as If-None-Match uses
+    candidates = parse_etags(if_none_match or '')
+    return '*' in candidates or any(
+        candidate.removeprefix('W/') == etag.removeprefix('W/') for candidate in candidates
+    )
+
+
+def list_etag(request, scopes):
+    key = json.dumps([
+        scopes,
+        data_versions(scopes),
+        sorted(request.query_params.lists()),
+        request.accepted_renderer.format,
+    ])
+    return f'W/"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def conditional_list(list_method):
+    """
+    ETag / If-None-Match for a viewset's `list`. The view's `get_etag_scopes()`
+    returns the scopes the list reads, or None to opt a request out.
+    """
+    @functools.wraps(list_method)
+    def wrapper(self, request, *args, **kwargs):
+        scopes = self.get_etag_scopes()
+        if scopes is None:
+            return list_method(self, request, *args, **kwargs)
+        etag = list_etag(request, scopes)
+        if etag_matches(etag, request.headers.get('If-None-Match')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = list_method(self, request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            # Per user, and always revalidated: the ETag makes that a cheap round trip
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ('Authorization', 'Accept'))
+        return response
+    return wrapper
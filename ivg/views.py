@@ -2,18 +2,58 @@ from rest_framework.permissions import  IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView , status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.viewsets import GenericViewSet , mixins
-from ivg.models import Branches, InvoiceData, InvoiceUser
-from ivg.serializers import BranchSerializer, InvoiceDataListSerializer, InvoiceGenerationSerializer, InvoiceUserSerializer, UltraAdminDashBoardSerializer, PresignedURLSerializer, UpdateInvoiceFileSerializer, ListInvoiceFilesSerializer, InvoiceViewFileSerializer
+from adrf.views import APIView as AsyncAPIView
+from ivg.constant import JobKind, JobStatus
+from ivg.models import BackgroundJob, Branches, InvoiceData, InvoiceFile, InvoiceUser
+from ivg.serializers import BranchSerializer, InvoiceDataListSerializer, InvoiceGenerationSerializer, InvoiceUserSerializer, UltraAdminDashBoardSerializer, PresignedURLSerializer, UpdateInvoiceFileSerializer, ListInvoiceFilesSerializer, InvoiceViewFileSerializer, InvoiceViewFilesSerializer, RenderInvoicePDFSerializer, PDFExportSerializer, InvoiceDailyStatsSerializer, BackgroundJobSerializer, InvoiceImportSerializer, MultipartInitiateSerializer, MultipartUploadSerializer, MultipartPresignPartsSerializer, MultipartCompleteSerializer
+from ivg.pagination import KeysetPagination
+from ivg.renderers import CSVRenderer
+from ivg.exports import aiter_sync, iter_invoice_csv
+from ivg.dashboard import get_dashboard_stats, invalidate_dashboard_stats
+from ivg.rollups import add_invoices_to_rollup, daily_stats
+from ivg.filters import InvoiceFilter
+from ivg.search import InvoiceSearchFilter
 from ivg.permissions import UltraAdminPermission, CoOfficerPermission
+from ivg.storage import InvalidUpload, MultipartWriter, ObjectNotFound, get_storage
+from ivg.db_pool import pool_stats
+from ivg.db_routers import ReplicaReadMixin
+from ivg import refdata
+from ivg.versions import BRANCHES_SCOPE, USERS_SCOPE, bump_data_versions, conditional_list, invoices_scope
+from ivg.presign_cache import acached_presigned_url, acached_presigned_urls, cached_presigned_urls, get_presign_cache
+from ivg.services import aattach_invoice_file, afind_blob, attach_invoice_file, blob_key, checksum_header, invoice_owns_key, plan_multipart_upload, arender_invoice_to_storage
+from ivg.pdf import RendererBusy
+from ivg.jobs import enqueue_job
+from ivg.imports import import_format
 import requests
-import boto3
+import uuid
 from botocore.exceptions import NoCredentialsError
-from django.conf import settings 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
 
 
+# Columns InvoiceDataListSerializer reads, the list never loads anything else
+INVOICE_LIST_COLUMNS = (
+    'id', 'trip', 'police_station', 'car_number', 'phone_number', 'name',
+    'location', 'wheels', 'cft', 'remarks', 'object_key', 'created_at', 'updated_at',
+)
+INVOICE_CREATOR_COLUMNS = (
+    'created_by__id', 'created_by__username', 'created_by__email',
+    'created_by__first_name', 'created_by__last_name', 'created_by__is_ultraadmin',
+    'created_by__is_superadmin', 'created_by__is_coofficer', 'created_by__is_admin',
+    'created_by__branch',
+)
+# Serializer fields that aren't columns of their own
+LIST_FIELD_COLUMNS = {'view_url': 'object_key'}
+
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 20  # Default 20 items per page
     page_size_query_param = 'page_size'
@@ -42,6 +82,17 @@ class BranchViewSet(GenericViewSet ,
     serializer_class = BranchSerializer
     queryset = Branches.objects.all()
 
+    def get_queryset(self):
+        if self.action == 'list':
+            # The whole table is in memory, pages are sliced from there
+            return refdata.branches.all()
+        return super().get_queryset()
+
+    def get_etag_scopes(self):
+        return [BRANCHES_SCOPE]
+
+    list = conditional_list(mixins.ListModelMixin.list)
+
 
 class UserManagementViewSet(GenericViewSet ,
                             mixins.CreateModelMixin , 
@@ -59,96 +110,258 @@ class UserManagementViewSet(GenericViewSet ,
     serializer_class = InvoiceUserSerializer
     queryset = InvoiceUser.objects.filter(is_ultraadmin=False)
 
-class UltraAdminDashBoardViewSet(GenericViewSet) :
+class UltraAdminDashBoardViewSet(ReplicaReadMixin, GenericViewSet) :
     permission_classes = [IsAuthenticated , UltraAdminPermission]
     serializer_class = UltraAdminDashBoardSerializer
     
     @action(detail=False , methods=['get'] , url_path='ultradmin/stats')
     def ultraadmin_stat(self , request) :
+        """
+        Branches, users per role and invoice totals per branch and trip.
+        Three grouped queries, cached for DASHBOARD_CACHE_TTL seconds and
+        dropped on any branch, user or invoice write.
+        """
         try :
-            # retreive branch users together 
-            pass
+            serializer = self.get_serializer(get_dashboard_stats())
+            return Response(serializer.data , status=status.HTTP_200_OK)
         except Exception as e :
             return Response({"detail" : str(e)} , status=status.HTTP_400_BAD_REQUEST)
 
-class InvoiceCreationViewSet(GenericViewSet , mixins.CreateModelMixin , mixins.ListModelMixin) :
+class InvoiceCreationViewSet(ReplicaReadMixin, GenericViewSet , mixins.CreateModelMixin , mixins.ListModelMixin) :
 
     permission_classes = [IsAuthenticated]
     serializer_class = InvoiceGenerationSerializer
     pagination_class = StandardResultsSetPagination
+    filter_backends = [InvoiceFilter, InvoiceSearchFilter]
     
 
     def get_serializer_class(self):
-        if self.action in ['create' , 'update'] :
+        if self.action in ['create' , 'update' , 'bulk'] :
             return InvoiceGenerationSerializer
         return InvoiceDataListSerializer
     
+    @property
+    def paginator(self):
+        """
+        Page numbers by default, keyset cursors with ?pagination=cursor (or a ?cursor=)
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_requested_fields(self):
+        """
+        Top level fields picked with ?fields=a,b,c on the list, None for all
+        """
+        if self.action != 'list' or not self.request.query_params.get('fields'):
+            return None
+        requested = [name.strip() for name in self.request.query_params['fields'].split(',') if name.strip()]
+        unknown = set(requested) - set(InvoiceDataListSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return requested
+
     def get_queryset(self):
-        return InvoiceData.objects.filter(
-                created_by__branch=self.request.user.branch 
+        queryset = InvoiceData.objects.filter(
+                branch=self.request.user.branch 
         )
+        if self.action != 'list':
+            return queryset
+
+        # Load the creator in the same query, whatever the page size. Its branch comes from ivg/refdata.py
+        fields = self.get_requested_fields()
+        if fields is None:
+            return queryset.select_related('created_by').only(*INVOICE_LIST_COLUMNS, *INVOICE_CREATOR_COLUMNS)
+        columns = [LIST_FIELD_COLUMNS.get(name, name) for name in fields]
+        if 'created_by' in fields:
+            queryset = queryset.select_related('created_by')
+            columns.remove('created_by')
+            columns += INVOICE_CREATOR_COLUMNS
+        return queryset.only(*columns)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_etag_scopes(self):
+        if self.request.query_params.get('include_view_url') in ('1', 'true', 'True'):
+            # Signed view URLs expire, a 304 would keep the client on stale ones
+            return None
+        # Invoices embed their creator and the creator's branch
+        return [invoices_scope(self.request.user.branch_id), USERS_SCOPE, BRANCHES_SCOPE]
     
+    @conditional_list
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        invoices = page if page is not None else list(queryset)
+
+        context = self.get_serializer_context()
+        if request.query_params.get('include_view_url') in ('1', 'true', 'True'):
+            # Sign the whole page in one pass instead of a view-file call per row
+            context['view_urls'] = cached_presigned_urls(
+                'get_object',
+                {invoice.object_key for invoice in invoices if invoice.object_key},
+                expires_in=300
+            )
+        serializer = self.get_serializer_class()(invoices, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(created_by=request.user)
+        serializer.save(created_by=request.user, branch=request.user.branch)
         return Response(serializer.data, status=201)
 
-class GetPresignedURLAPIView(APIView):
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[JSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        """
+        Every invoice the list would return, as one CSV download. Rows are
+        streamed off a server side cursor, so memory stays flat and the first
+        bytes go out before the query has finished.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        content = iter_invoice_csv(queryset, settings.INVOICE_EXPORT_CHUNK_SIZE)
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_sync(content)
+        response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="invoices-{timezone.localdate():%Y-%m-%d}.csv"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create many invoices in one request, e.g. after an offline sync.
+        Takes a list (or {"invoices": [...]}). Every row is validated on its own,
+        valid rows are inserted with bulk_create in batched transactions and the
+        response reports each row by its index.
+        """
+        rows = request.data.get('invoices') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "Expected a non empty list of invoices"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.INVOICE_BULK_MAX_ROWS:
+            return Response(
+                {"error": f"At most {settings.INVOICE_BULK_MAX_ROWS} invoices per request, got {len(rows)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # One serializer validates every row, its fields are built once instead of per row
+        validator = self.get_serializer()
+        results = [None] * len(rows)
+        pending = []
+        for index, row in enumerate(rows):
+            try:
+                data = validator.run_validation(row)
+            except ValidationError as e:
+                results[index] = {"index": index, "status": "error", "errors": e.detail}
+                continue
+            pending.append((index, InvoiceData(**data, created_by=request.user, branch=request.user.branch)))
+
+        batch_size = settings.INVOICE_BULK_BATCH_SIZE
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            try:
+                with transaction.atomic():
+                    invoices = InvoiceData.objects.bulk_create([invoice for _, invoice in batch])
+                    add_invoices_to_rollup(invoices)
+                    bump_data_versions(invoices_scope(request.user.branch_id))
+                    invalidate_dashboard_stats()
+            except DatabaseError as e:
+                for index, _ in batch:
+                    results[index] = {"index": index, "status": "error", "errors": {"non_field_errors": [str(e)]}}
+                continue
+            for index, invoice in batch:
+                results[index] = {"index": index, "status": "created", "id": invoice.pk}
+
+        created = sum(1 for result in results if result["status"] == "created")
+        if created == len(rows):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {"created": created, "failed": len(rows) - created, "results": results},
+            status=response_status
+        )
+
+class GetPresignedURLAPIView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = PresignedURLSerializer
 
-    def post(self, request):
+    async def post(self, request):
         try:
             serializer = self.serializer_class(data=request.data)
             serializer.is_valid(raise_exception=True)
             filename = serializer.validated_data['filename']
             invoice_id = serializer.validated_data['invoice_id']
 
+            content_sha256 = serializer.validated_data.get('content_sha256')
+
             # Check if invoice exists and accessible
             try:
-                InvoiceData.objects.get(id=invoice_id, created_by__branch=request.user.branch)
+                invoice = await InvoiceData.objects.aget(id=invoice_id, branch_id=request.user.branch_id)
             except InvoiceData.DoesNotExist:
                 return Response({"error": "Invoice not found or not accessible"}, status=status.HTTP_404_NOT_FOUND)
 
-            # Generate object key
-            object_key = f"invoices/{invoice_id}/{filename}"
-
-            # Create S3 client
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_S3_REGION_NAME
-            )
+            upload_params = {'ContentType': 'application/octet-stream'}  # Adjust if needed
+            if content_sha256:
+                # Content addressed: identical files of a branch share one object
+                existing = await afind_blob(invoice.branch_id, content_sha256)
+                if existing is not None:
+                    object_key, head = existing
+                    await aattach_invoice_file(invoice, object_key, head=head)
+                    return Response({
+                        "presigned_url": None,
+                        "object_key": object_key,
+                        "invoice_id": invoice_id,
+                        "deduplicated": True
+                    }, status=status.HTTP_200_OK)
+                object_key = blob_key(invoice.branch_id, content_sha256)
+                upload_params['ChecksumSHA256'] = checksum_header(content_sha256)
+            else:
+                # Generate object key
+                object_key = f"invoices/{invoice_id}/{filename}"
 
             try:
-                presigned_url = s3_client.generate_presigned_url(
+                presigned_url = await get_storage().agenerate_presigned_url(
                     'put_object',
-                    Params={
-                        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                        'Key': object_key,
-                        'ContentType': 'application/octet-stream'  # Adjust if needed
-                    },
-                    ExpiresIn=3000  # 5 minutes
+                    object_key,
+                    expires_in=3000,  # 5 minutes
+                    **upload_params
                 )
             except NoCredentialsError:
                 return Response({"error": "AWS credentials not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            return Response({
+            response = {
                 "presigned_url": presigned_url,
                 "object_key": object_key,
                 "invoice_id": invoice_id
-            }, status=status.HTTP_200_OK)
+            }
+            if content_sha256:
+                # Signed into the URL, the PUT has to send exactly these headers
+                response["deduplicated"] = False
+                response["required_headers"] = {
+                    "Content-Type": upload_params['ContentType'],
+                    "x-amz-checksum-sha256": upload_params['ChecksumSHA256']
+                }
+            return Response(response, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class UpdateInvoiceFileAPIView(APIView):
+class UpdateInvoiceFileAPIView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UpdateInvoiceFileSerializer
 
-    def post(self, request):
+    async def post(self, request):
         try:
             serializer = self.serializer_class(data=request.data)
             serializer.is_valid(raise_exception=True)
@@ -158,9 +371,9 @@ class UpdateInvoiceFileAPIView(APIView):
 
             try:
                 # Fetch the specific invoice
-                invoice = InvoiceData.objects.get(
+                invoice = await InvoiceData.objects.aget(
                     id=invoice_id, 
-                    created_by__branch=request.user.branch
+                    branch_id=request.user.branch_id
                 )
             except InvoiceData.DoesNotExist:
                 return Response(
@@ -168,9 +381,24 @@ class UpdateInvoiceFileAPIView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # SAVE ACTION: Store the permanent object key only
-            invoice.object_key = object_key
-            invoice.save()
+            # Another branch's blob only by uploading it again. Keys the branch has
+            # indexed already stay usable, e.g. blobs from before they were per branch
+            if not invoice_owns_key(invoice, object_key) and not await InvoiceFile.objects.filter(
+                key=object_key, invoice__branch_id=invoice.branch_id
+            ).aexists():
+                return Response(
+                    {"error": "Object key does not belong to this invoice"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # SAVE ACTION: Store the permanent object key and index the uploaded file
+            try:
+                await aattach_invoice_file(invoice, object_key)
+            except ObjectNotFound:
+                return Response(
+                    {"error": "Uploaded file not found for this object key"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
             return Response({
                 "message": "Invoice updated successfully", 
@@ -180,95 +408,236 @@ class UpdateInvoiceFileAPIView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ListInvoiceFilesAPIView(APIView):
+class MultipartUploadAPIView(APIView):
+    """
+    Shared lookups for the multipart upload endpoints.
+    Uploads always live under the invoice's own prefix.
+    """
     permission_classes = [IsAuthenticated]
-    serializer_class = ListInvoiceFilesSerializer
+
+    def get_invoice(self, invoice_id):
+        try:
+            return InvoiceData.objects.get(id=invoice_id, branch=self.request.user.branch)
+        except InvoiceData.DoesNotExist:
+            return None
+
+    def invoice_not_found(self):
+        return Response({"error": "Invoice not found or not accessible"}, status=status.HTTP_404_NOT_FOUND)
+
+    def key_belongs_to(self, invoice, object_key):
+        return object_key.startswith(f"invoices/{invoice.id}/")
+
+    def presign_parts(self, object_key, upload_id, part_numbers):
+        # One signing pass for the whole batch
+        urls = get_storage().generate_presigned_part_urls(
+            object_key, upload_id, part_numbers, expires_in=settings.MULTIPART_PART_URL_EXPIRES
+        )
+        return [{"part_number": number, "url": urls[number]} for number in part_numbers]
+
+
+class InitiateMultipartUploadAPIView(MultipartUploadAPIView):
+    """
+    Start a multipart upload. The server decides part size and how many parts
+    the client uploads in parallel, and returns URLs for the first batch.
+    """
+    serializer_class = MultipartInitiateSerializer
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         invoice_id = serializer.validated_data['invoice_id']
 
-        # Check if invoice exists and accessible
+        invoice = self.get_invoice(invoice_id)
+        if invoice is None:
+            return self.invoice_not_found()
+
+        object_key = f"invoices/{invoice_id}/{serializer.validated_data['filename']}"
+        plan = plan_multipart_upload(serializer.validated_data['file_size'])
         try:
-            InvoiceData.objects.get(id=invoice_id, created_by__branch=request.user.branch)
-        except InvoiceData.DoesNotExist:
-            return Response({"error": "Invoice not found or not accessible"}, status=status.HTTP_404_NOT_FOUND)
+            upload_id = get_storage().create_multipart_upload(
+                object_key, serializer.validated_data['content_type']
+            )
+            first_batch = range(1, min(plan['part_count'], settings.MULTIPART_PRESIGN_BATCH_SIZE) + 1)
+            parts = self.presign_parts(object_key, upload_id, first_batch)
+        except NoCredentialsError:
+            return Response({"error": "AWS credentials not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({"error": f"Failed to start upload: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Create S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
+        return Response({
+            "invoice_id": invoice_id,
+            "object_key": object_key,
+            "upload_id": upload_id,
+            **plan,
+            "parts": parts
+        }, status=status.HTTP_201_CREATED)
+
+
+class PresignMultipartPartsAPIView(MultipartUploadAPIView):
+    """
+    Presign a batch of part URLs. Clients also call this with a single part
+    number to retry just that part after its URL expired.
+    """
+    serializer_class = MultipartPresignPartsSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        invoice = self.get_invoice(data['invoice_id'])
+        if invoice is None or not self.key_belongs_to(invoice, data['object_key']):
+            return self.invoice_not_found()
 
-        prefix = f"invoices/{invoice_id}/"
         try:
-            response = s3_client.list_objects_v2(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Prefix=prefix)
-            files = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    # Generate presigned GET URL for private bucket
-                    presigned_url = s3_client.generate_presigned_url(
-                        'get_object',
-                        Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': obj['Key']},
-                        ExpiresIn=3600  # 1 hour
-                    )
-                    files.append({
-                        "key": obj['Key'],
-                        "presigned_url": presigned_url,
-                        "size": obj['Size'],
-                        "last_modified": obj['LastModified'].isoformat()
-                    })
+            parts = self.presign_parts(data['object_key'], data['upload_id'], data['part_numbers'])
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"upload_id": data['upload_id'], "parts": parts}, status=status.HTTP_200_OK)
+
+
+class CompleteMultipartUploadAPIView(MultipartUploadAPIView):
+    serializer_class = MultipartCompleteSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        invoice = self.get_invoice(data['invoice_id'])
+        if invoice is None or not self.key_belongs_to(invoice, data['object_key']):
+            return self.invoice_not_found()
+
+        parts = [(part['part_number'], part['etag']) for part in data['parts']]
+        try:
+            get_storage().complete_multipart_upload(data['object_key'], data['upload_id'], parts)
+            # Same bookkeeping as UpdateInvoiceFileAPIView
+            attach_invoice_file(invoice, data['object_key'])
+        except (InvalidUpload, ObjectNotFound) as e:
+            return Response({"error": f"Upload could not be completed: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "message": "Invoice updated successfully",
+            "invoice_id": invoice.id,
+            "object_key": data['object_key']
+        }, status=status.HTTP_200_OK)
+
+
+class AbortMultipartUploadAPIView(MultipartUploadAPIView):
+    serializer_class = MultipartUploadSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        invoice = self.get_invoice(data['invoice_id'])
+        if invoice is None or not self.key_belongs_to(invoice, data['object_key']):
+            return self.invoice_not_found()
+
+        try:
+            get_storage().abort_multipart_upload(data['object_key'], data['upload_id'])
+        except InvalidUpload as e:
+            return Response({"error": f"Unknown upload: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"message": "Upload aborted", "upload_id": data['upload_id']}, status=status.HTTP_200_OK)
+
+
+class PresignCacheStatsAPIView(APIView):
+    """
+    Hit / miss counters of this worker's presigned URL cache
+    """
+    permission_classes = [IsAuthenticated , UltraAdminPermission]
+
+    def get(self, request):
+        return Response(get_presign_cache().stats(), status=status.HTTP_200_OK)
+
+class DatabasePoolStatsAPIView(APIView):
+    """
+    Connection reuse settings and pool counters of this worker's database connections
+    """
+    permission_classes = [IsAuthenticated , UltraAdminPermission]
+
+    def get(self, request):
+        return Response(pool_stats(), status=status.HTTP_200_OK)
+
+class ListInvoiceFilesAPIView(ReplicaReadMixin, AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ListInvoiceFilesSerializer
+    replica_methods = ('POST',)  # Read only, the invoice id is in the body
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        invoice_id = serializer.validated_data['invoice_id']
+
+        # Check if invoice exists and accessible
+        if not await InvoiceData.objects.filter(id=invoice_id, branch_id=request.user.branch_id).aexists():
+            return Response({"error": "Invoice not found or not accessible"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Files come from the InvoiceFile index, kept in sync by
+        # UpdateInvoiceFileAPIView and `manage.py reconcile_invoice_files`
+        invoice_files = [
+            row async for row in
+            InvoiceFile.objects.filter(invoice_id=invoice_id).values_list('key', 'size', 'uploaded_at')
+        ]
+        try:
+            # Generate presigned GET URLs for private bucket in one pass
+            presigned_urls = await acached_presigned_urls(
+                'get_object',
+                [key for key, _, _ in invoice_files],
+                expires_in=3600  # 1 hour
+            )
+            files = [
+                {
+                    "key": key,
+                    "presigned_url": presigned_urls[key],
+                    "size": size,
+                    "last_modified": uploaded_at.isoformat()
+                }
+                for key, size, uploaded_at in invoice_files
+            ]
         except Exception as e:
             return Response({"error": f"Failed to list files: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response({"files": files}, status=status.HTTP_200_OK)
     
-class GetInvoiceViewURLAPIView(APIView):
+class GetInvoiceViewURLAPIView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = InvoiceViewFileSerializer
 
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         invoice_id = serializer.validated_data['invoice_id']
 
         try:
-            invoice = InvoiceData.objects.get(
+            object_key = await InvoiceData.objects.filter(
                 id=invoice_id,
-                created_by__branch=request.user.branch
-            )
+                branch_id=request.user.branch_id
+            ).values_list('object_key', flat=True).aget()
         except InvoiceData.DoesNotExist:
             return Response(
                 {"error": "Invoice not found or not accessible"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        if not invoice.object_key:
+        if not object_key:
             return Response(
                 {"error": "No file attached to this invoice"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
-
         try:
-            view_url = s3_client.generate_presigned_url(
+            # Signed locally, no round trip to S3
+            view_url = await acached_presigned_url(
                 'get_object',
-                Params={
-                    'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                    'Key': invoice.object_key
-                },
-                ExpiresIn=300  # 5 minutes
+                object_key,
+                expires_in=300  # 5 minutes
             )
         except Exception as e:
             return Response(
@@ -284,3 +653,235 @@ class GetInvoiceViewURLAPIView(APIView):
             },
             status=status.HTTP_200_OK
         )
+
+
+class GetInvoiceViewURLsAPIView(AsyncAPIView):
+    """
+    View URLs for a whole page of invoices: one branch scoped `id__in`
+    query and a single signing pass instead of one request per row
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = InvoiceViewFilesSerializer
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        invoice_ids = serializer.validated_data['invoice_ids']
+        object_keys = {
+            pk: key async for pk, key in InvoiceData.objects.filter(
+                id__in=invoice_ids,
+                branch_id=request.user.branch_id
+            ).values_list('id', 'object_key')
+        }
+
+        try:
+            view_urls = await acached_presigned_urls(
+                'get_object',
+                {key for key in object_keys.values() if key},
+                expires_in=300  # 5 minutes
+            )
+        except Exception as e:
+            return Response(
+                {"error": f"Failed to generate view URLs: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        return Response(
+            {
+                "success": True,
+                "files": [
+                    {"invoice_id": invoice_id, "view_url": view_urls[object_keys[invoice_id]]}
+                    for invoice_id in invoice_ids
+                    if object_keys.get(invoice_id)
+                ],
+                "no_file": [
+                    invoice_id for invoice_id in invoice_ids
+                    if invoice_id in object_keys and not object_keys[invoice_id]
+                ],
+                "not_found": [invoice_id for invoice_id in invoice_ids if invoice_id not in object_keys]
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class RenderInvoicePDFAPIView(AsyncAPIView):
+    """
+    Render the invoice to PDF on the server and store it under the invoice's own key.
+    The render runs in the PDF process pool, the event loop only awaits it.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = RenderInvoicePDFSerializer
+
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        invoice_id = serializer.validated_data['invoice_id']
+
+        try:
+            invoice = await InvoiceData.objects.select_related('branch', 'created_by').aget(
+                id=invoice_id,
+                branch_id=request.user.branch_id
+            )
+        except InvoiceData.DoesNotExist:
+            return Response(
+                {"error": "Invoice not found or not accessible"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            invoice_file = await arender_invoice_to_storage(invoice)
+        except RendererBusy:
+            return Response(
+                {"error": "PDF renderer is busy, try again shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "5"}
+            )
+        except Exception as e:
+            return Response(
+                {"error": f"Failed to render invoice: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        return Response(
+            {
+                "success": True,
+                "invoice_id": invoice_id,
+                "object_key": invoice_file.key,
+                "size": invoice_file.size,
+                "view_url": await acached_presigned_url('get_object', invoice_file.key, expires_in=300)
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class PDFExportAPIView(APIView):
+    """
+    Start a bulk PDF export (ZIP of one PDF per invoice, merged PDFs aren't
+    offered) of the branch's invoices in a date range. Poll jobs/<id>/ for progress.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = PDFExportSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if request.user.branch_id is None:
+            return Response({"error": "User is not assigned to a branch"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        params = {
+            'date_from': data['date_from'].isoformat(),
+            'date_to': data['date_to'].isoformat(),
+            'format': data['format'],
+        }
+        if data.get('trip'):
+            params['trip'] = data['trip']
+
+        with transaction.atomic():
+            job = BackgroundJob.objects.create(
+                kind=JobKind.PDF_EXPORT.value,
+                created_by=request.user,
+                branch_id=request.user.branch_id,
+                params=params,
+            )
+            enqueue_job(job)
+
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class BackgroundJobAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = BackgroundJob.objects.get(id=job_id, branch=request.user.branch)
+        except BackgroundJob.DoesNotExist:
+            return Response({"error": "Job not found or not accessible"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class ImportInvoicesAPIView(APIView):
+    """
+    Import historical invoices from a CSV or XLSX upload. The file is streamed
+    to S3 and imported by a background job, poll jobs/<id>/ for progress.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = InvoiceImportSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if request.user.branch_id is None:
+            return Response({"error": "User is not assigned to a branch"}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = serializer.validated_data['file']
+        try:
+            file_format = import_format(upload.name, serializer.validated_data.get('format'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The client's name stays out of the key, it is only kept in params for display
+        object_key = f"imports/{request.user.branch_id}/{uuid.uuid4().hex}.{file_format}"
+        with MultipartWriter(get_storage(), object_key) as out:
+            for chunk in upload.chunks(settings.MULTIPART_PART_SIZE):
+                out.write(chunk)
+
+        with transaction.atomic():
+            job = BackgroundJob.objects.create(
+                kind=JobKind.INVOICE_IMPORT.value,
+                created_by=request.user,
+                branch_id=request.user.branch_id,
+                params={'object_key': object_key, 'filename': upload.name, 'format': file_format},
+            )
+            enqueue_job(job)
+
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class InvoiceDailyStatsAPIView(ReplicaReadMixin, APIView):
+    """
+    Invoice count, cft and wheels per day (and per trip) of the branch,
+    read from the daily rollup
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = InvoiceDailyStatsSerializer
+
+    def get(self, request):
+        serializer = self.serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        if request.user.branch_id is None:
+            return Response({"error": "User is not assigned to a branch"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        days = daily_stats(request.user.branch_id, data['date_from'], data['date_to'], data.get('trip'))
+        return Response({
+            "date_from": data['date_from'],
+            "date_to": data['date_to'],
+            "invoices": sum(day['invoices'] for day in days),
+            "total_cft": sum(day['total_cft'] for day in days),
+            "wheels": sum(day['wheels'] for day in days),
+            "days": days,
+        }, status=status.HTTP_200_OK)
+
+
+class RetryBackgroundJobAPIView(APIView):
+    """
+    Run a failed job again. Imports continue after their last committed row.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, job_id):
+        with transaction.atomic():
+            retried = BackgroundJob.objects.filter(
+                id=job_id, branch=request.user.branch, status=JobStatus.FAILED.value
+            ).update(status=JobStatus.PENDING.value, error=None, finished_at=None)
+            if not retried:
+                return Response({"error": "No failed job with this id"}, status=status.HTTP_404_NOT_FOUND)
+            job = BackgroundJob.objects.get(id=job_id)
+            enqueue_job(job)
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
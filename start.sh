@@ -15,9 +15,8 @@ if [ "$DATABASE_ENGINE" = "django.db.backends.postgresql" ] || [ "$DATABASE_ENGI
     done || echo "⚠️  No wait needed or timeout"
 fi
 
-# Run migrations
+# Run migrations (they ship with the code, never generate them at boot)
 echo "📦 Running Django migrations..."
-python manage.py makemigrations
 python manage.py migrate
 
 # Collect static files